@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+
+    def ready(self):
+        # Cached report counts and PDFs are invalidated by signal receivers
+        from . import pdf_export, reports  # noqa: F401
+
+        # Build the knowledge snapshot at startup so the first chat message doesn't pay for it
+        from .manual_engine import knowledge_store
+        knowledge_store.get()
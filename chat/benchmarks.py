@@ -0,0 +1,591 @@
+"""
+Performance benchmarks for the chat engine.
+Run them with `python manage.py benchmark_chat [suite ...]`.
+"""
+import os
+import re
+import json
+import time
+import random
+import difflib
+import tempfile
+import statistics
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.shortcuts import render
+from django.test import Client, RequestFactory, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from . import manual_engine, vector_index
+from .knowledge_index import build_entry_table, build_inverted_index
+from .knowledge_artifact import write_artifact
+from .context_store import ContextStore
+from .knowledge_store import KnowledgeSnapshot, KnowledgeStore, StructuredFormsStore, forms_version
+from .response_cache import ResponseCache
+from .views import ULCER_QUESTIONS, chat_view
+
+# Typical patient questions: the chat page suggestions plus short free text
+BENCHMARK_QUERIES = [
+    "What should I eat if I have an ulcer?",
+    "What foods should I avoid with an ulcer?",
+    "What are the symptoms of a stomach ulcer?",
+    "How are ulcers treated?",
+    "What causes ulcers?",
+    "How can I prevent ulcers?",
+    "What is the difference between gastric and duodenal ulcers?",
+    "How long does it take for an ulcer to heal?",
+    "Can I drink coffee?",
+    "is milk good for ulcer",
+    "black stools",
+    "omeprazole dose",
+]
+
+# Broader corpus for latency percentiles: misspellings, small talk and follow-ups
+REALISTIC_QUERIES = BENCHMARK_QUERIES + [
+    "stomache ulser",
+    "duodinal ulcer treatmnt",
+    "hello",
+    "thank you",
+    "is spicy food bad",
+    "can stress cause ulcers",
+    "H. pylori antibiotics",
+    "vomiting blood what do I do",
+    "what is a peptic ulcer",
+    "alcohol and smoking",
+    "probiotics yogurt",
+    "bland diet foods",
+    "when should I see a doctor",
+    "Is it safe to take ibuprofen?",
+]
+
+# Patient answers for a complete ulcer_diagnosis structured form, in question order
+DIAGNOSIS_WALKTHROUGH = [
+    "I have a burning stomach pain",
+    "upper stomach",
+    "on an empty stomach, improves after eating",
+    "7",
+    "burning and gnawing",
+    "bloating and nausea",
+    "yes, ibuprofen most days",
+    "a few times a week",
+    "no",
+    "high",
+]
+
+# (misspelt query, what the patient meant) pairs for the typo-tolerance benchmark
+MISSPELLED_QUERIES = [
+    ("what causes ulsers", "what causes ulcers"),
+    ("stomache ulser symptons", "stomach ulcer symptoms"),
+    ("duodinal ulcer", "duodenal ulcer"),
+    ("h pylory infecton", "h pylori infection"),
+    ("omeprazol dose", "omeprazole dose"),
+    ("bleding ulcer", "bleeding ulcer"),
+    ("ulcer tretment", "ulcer treatment"),
+    ("gastrik ulcer diet", "gastric ulcer diet"),
+    ("can I drink cofee", "can I drink coffee"),
+    ("heartbern after eating", "heartburn after eating"),
+    ("nausia and vomitting", "nausea and vomiting"),
+    ("antibiotcs for ulcers", "antibiotics for ulcers"),
+    ("how to prevnt ulcers", "how to prevent ulcers"),
+    ("perforated ulcr", "perforated ulcer"),
+    ("alchohol and ulcers", "alcohol and ulcers"),
+    ("endoscpy procedure", "endoscopy procedure"),
+]
+
+# (question, fragment of the text that answers it) pairs for the passage benchmark
+PASSAGE_QUERIES = [
+    ("Is milk good for ulcers?", "increase acid production"),
+    ("Are ulcers contagious?", "passed through saliva"),
+    ("Can stress alone cause ulcers?", "worsen symptoms or delay healing"),
+    ("Can I use painkillers if I have ulcers?", "acetaminophen"),
+    ("Will ulcers come back after treatment?", "not fully treated"),
+    ("what antibiotics treat h pylori", "Clarithromycin"),
+    ("omeprazole dose", "Omeprazole (Prilosec): 20mg"),
+    ("how long do h2 blockers take", "4-8 weeks"),
+    ("what does burning stomach pain feel like", "burning sensation"),
+    ("duodenal ulcer pain timing", "Improves after eating"),
+    ("is spicy food bad", "Spicy foods"),
+    ("can I drink coffee", "Caffeine"),
+    ("what are the warning signs", "Vomiting blood"),
+    ("how to prevent ulcers", "NSAID"),
+    ("probiotic foods", "Yogurt"),
+    ("foods to eat with an ulcer", "High-fiber foods"),
+    ("home remedies for ulcers", "smaller, more frequent meals"),
+    ("risk factors for ulcers", "Family history"),
+    ("what causes esophageal ulcers", "Acid reflux"),
+    ("unexplained weight loss", "Losing weight without trying"),
+]
+
+
+def legacy_find_best_match(query, entries, threshold=0.5, context_boost=None):
+    """The original per-entry difflib loop, kept as the baseline for comparisons and tests"""
+    context_boost = context_boost or {}
+    best_match = None
+    best_score = 0.0
+
+    for entry in entries:
+        score = difflib.SequenceMatcher(None, query.lower(), entry.lower()).ratio()
+
+        for keyword, boost in context_boost.items():
+            if keyword in entry.lower():
+                score += boost
+
+        phrases = manual_engine.extract_key_phrases(query)
+        for phrase in phrases:
+            if len(phrase) > 3 and phrase.lower() in entry.lower():
+                score += 0.15
+
+        if score > best_score:
+            best_score = score
+            best_match = entry
+
+    if best_score >= threshold:
+        return best_match, best_score
+    return None, best_score
+
+
+def time_per_call(func, arguments, repeat):
+    """Run func over every argument `repeat` times and return the per-call latencies in seconds"""
+    timings = []
+    for _ in range(repeat):
+        for argument in arguments:
+            start = time.perf_counter()
+            func(argument)
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(timings):
+    """Latency summary in milliseconds"""
+    ordered = sorted(timings)
+    return {
+        'calls': len(ordered),
+        'mean_ms': statistics.fmean(ordered) * 1000,
+        'p50_ms': percentile(ordered, 0.50) * 1000,
+        'p90_ms': percentile(ordered, 0.90) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def synthetic_entries(entries, count, seed=0):
+    """
+    `count` made-up entries drawn from the vocabulary and length distribution of
+    the real ones, for measuring how matching scales with knowledge size
+    """
+    rng = random.Random(seed)
+    words = [word for entry in entries for word in entry.split()]
+    lengths = [len(entry.split()) for entry in entries]
+    return [' '.join(rng.choices(words, k=rng.choice(lengths))) for _ in range(count)]
+
+
+class StaticKnowledgeStore:
+    """Stands in for the knowledge store with a fixed, in-memory snapshot"""
+
+    def __init__(self, entries, version):
+        self.reload_count = 1
+        self._snapshot = KnowledgeSnapshot(entries, version, signature=())
+
+    def get(self):
+        return self._snapshot
+
+
+@contextmanager
+def scaled_knowledge(scale, seed=0):
+    """
+    Run with the knowledge base grown to `scale` times its size by adding synthetic
+    entries after the real ones. The response cache is swapped out alongside.
+    """
+    if scale <= 1:
+        yield manual_engine.knowledge_store.get()
+        return
+    entries = list(manual_engine.knowledge_store.get().entries)
+    entries += synthetic_entries(entries, len(entries) * (scale - 1), seed)
+    store = StaticKnowledgeStore(entries, f'synthetic-x{scale}-{seed}')
+    with mock.patch.object(manual_engine, 'knowledge_store', store), \
+            mock.patch.object(manual_engine, 'response_cache', ResponseCache()):
+        yield store.get()
+
+
+@contextmanager
+def response_cache_disabled():
+    """Measure matching itself rather than cache lookups"""
+    with mock.patch.object(manual_engine, 'response_cache', ResponseCache(max_size=0)):
+        yield
+
+
+def bench_query_plan(repeat=3):
+    """Per-query cost of the original scoring loop vs. the compiled QueryPlan, full scan of knowledge.txt"""
+    snapshot = KnowledgeStore([manual_engine.KNOWLEDGE_PATH]).get()
+    table = build_entry_table(snapshot)
+
+    def compiled(query):
+        return manual_engine.score_entries(manual_engine.QueryPlan(query), table, 0.5)
+
+    def legacy(query):
+        return legacy_find_best_match(query, snapshot.entries)
+
+    for query in BENCHMARK_QUERIES:
+        if compiled(query) != legacy(query):
+            raise AssertionError(f"Compiled plan disagrees with the original loop for {query!r}")
+
+    before = summarize(time_per_call(legacy, BENCHMARK_QUERIES, repeat))
+    after = summarize(time_per_call(compiled, BENCHMARK_QUERIES, repeat))
+    return {
+        'entries': len(snapshot.entries),
+        'before': before,
+        'after': after,
+        'speedup': before['mean_ms'] / after['mean_ms'],
+    }
+
+
+def bench_pruning(repeat=3):
+    """Exhaustive vs. bound-pruned difflib scoring over the whole knowledge base (no candidate index)"""
+    snapshot = manual_engine.knowledge_store.get()
+    table = build_entry_table(snapshot)
+
+    def exhaustive(query):
+        return manual_engine.score_entries(manual_engine.QueryPlan(query), table, 0.5, prune=False)
+
+    def pruned(query):
+        return manual_engine.score_entries(manual_engine.QueryPlan(query), table, 0.5)
+
+    for query in REALISTIC_QUERIES:
+        if pruned(query) != exhaustive(query):
+            raise AssertionError(f"Pruned scoring disagrees with the exhaustive scan for {query!r}")
+
+    before = summarize(time_per_call(exhaustive, REALISTIC_QUERIES, repeat))
+    after = summarize(time_per_call(pruned, REALISTIC_QUERIES, repeat))
+    return {
+        'entries': len(table),
+        'before': before,
+        'after': after,
+        'speedup': before['mean_ms'] / after['mean_ms'],
+    }
+
+
+def bench_typos(repeat=3):
+    """
+    Misspelt queries: latency and how often the answer is the one the correctly spelt query
+    gets, for the exhaustive difflib scan, candidate retrieval without typo tolerance, and
+    MinHash-LSH typo tolerance at a few (num_perm, bands) settings.
+    """
+    snapshot = manual_engine.knowledge_store.get()
+    table = build_entry_table(snapshot)
+    misspelt = [query for query, _ in MISSPELLED_QUERIES]
+    intended = {query: manual_engine.DifflibMatcher().match(snapshot, correct)[0] for query, correct in MISSPELLED_QUERIES}
+
+    configurations = {
+        'full_scan': None,
+        'index_only': {'candidate_index': True, 'typo_tolerance': False},
+        'lsh_16x1': {'candidate_index': True, 'typo_num_perm': 16, 'typo_bands': 16},
+        'lsh_32x2': {'candidate_index': True},  # Default typo settings
+        'lsh_32x1': {'candidate_index': True, 'typo_num_perm': 32, 'typo_bands': 32},
+        'lsh_64x4': {'candidate_index': True, 'typo_num_perm': 64, 'typo_bands': 16},
+    }
+    results = {}
+    for name, options in configurations.items():
+        if options is None:
+            match = lambda query: manual_engine.score_entries(manual_engine.QueryPlan(query), table, 0.5)
+        else:
+            matcher = manual_engine.DifflibMatcher(**options)
+            matcher.match(snapshot, misspelt[0])  # Build the indexes outside the timing
+            match = lambda query, matcher=matcher: matcher.match(snapshot, query)
+        correct = sum(match(query)[0] == intended[query] for query in misspelt)
+        results[name] = {
+            'accuracy': correct / len(misspelt),
+            'latency': summarize(time_per_call(match, misspelt, repeat)),
+        }
+    return results
+
+
+def bench_passages(repeat=3):
+    """
+    Line entries vs. compiled passages (scored on short units, answered with the whole
+    passage) at a few length limits: how often the answer contains the text that answers
+    the question, how long answers are, and latency.
+    """
+    snapshot = manual_engine.knowledge_store.get()
+    queries = [query for query, _ in PASSAGE_QUERIES]
+    configurations = {
+        'lines': {},
+        'passages_300_100': {'passages': True, 'passage_max_chars': 300, 'unit_max_chars': 100},
+        'passages_600_160': {'passages': True},  # Defaults
+        'passages_1000_240': {'passages': True, 'passage_max_chars': 1000, 'unit_max_chars': 240},
+    }
+    results = {}
+    for name, options in configurations.items():
+        matcher = manual_engine.DifflibMatcher(**options)
+        answers = [matcher.match(snapshot, query)[0] for query in queries]
+        answered = [answer for answer in answers if answer]
+        results[name] = {
+            'rows': len(matcher.entry_table(snapshot)),
+            'accuracy': sum(
+                bool(answer) and fragment.lower() in answer.lower()
+                for answer, (_, fragment) in zip(answers, PASSAGE_QUERIES)
+            ) / len(queries),
+            'answered': len(answered) / len(queries),
+            'mean_answer_chars': statistics.fmean(len(answer) for answer in answered) if answered else 0,
+            'latency': summarize(time_per_call(lambda query: matcher.match(snapshot, query), queries, repeat)),
+        }
+    return results
+
+
+def bench_vectors(repeat=3):
+    """
+    The vector engine's random-projection ANN index against brute-force cosine over the
+    same memory-mapped embeddings: recall@k and search latency, for a few index settings.
+    Use --scale to see how both grow with the knowledge base.
+    """
+    snapshot = manual_engine.knowledge_store.get()
+    queries = REALISTIC_QUERIES + [query for query, _ in MISSPELLED_QUERIES]
+    ks = (1, 5, 10)
+    configurations = {
+        'tables8_bits8': {'tables': 8, 'bits': 8},
+        'tables16_bits10': {'tables': 16, 'bits': 10},
+        'tables32_bits12': {},  # Defaults
+        'tables64_bits14': {'tables': 64, 'bits': 14},
+    }
+
+    vectors = vector_index.load_entry_vectors(snapshot, 512)
+    query_vectors = list(vector_index.embed(queries, 512))
+    exact = [vector_index.brute_force_search(vectors, vector, max(ks)) for vector in query_vectors]
+    results = {
+        'entries': len(snapshot.entries),
+        'brute_force': {'latency': summarize(time_per_call(
+            lambda vector: vector_index.brute_force_search(vectors, vector, max(ks)), query_vectors, repeat
+        ))},
+    }
+    for name, options in configurations.items():
+        index = manual_engine.VectorMatcher(exact_below=0, **options).build(snapshot)
+        found = [index.search(vector, max(ks)) for vector in query_vectors]
+        recall = {}
+        for k in ks:
+            hits = sum(
+                len({entry_id for entry_id, _ in approximate[:k]} & {entry_id for entry_id, _ in reference[:k]})
+                for approximate, reference in zip(found, exact)
+            )
+            recall[f'recall@{k}'] = hits / (k * len(queries))
+        results[name] = {
+            **recall,
+            'mean_candidates': statistics.fmean(len(index.candidates(vector)) for vector in query_vectors),
+            'latency': summarize(time_per_call(lambda vector: index.search(vector, max(ks)), query_vectors, repeat)),
+        }
+    return results
+
+
+def legacy_chat_get(request):
+    """The chat page GET as it was: re-read the knowledge files and re-run the question regex"""
+    entries = []
+    for path in (manual_engine.KNOWLEDGE_PATH, manual_engine.ULCER_KNOWLEDGE_PATH):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries.extend(line.strip() for line in f if line.strip())
+    questions = []
+    for entry in entries:
+        match = re.match(r'(Q:)?\s*(.*?\?)', entry)
+        if match:
+            questions.append(match.group(2).strip())
+        else:
+            first_sentence = entry.split('.')[0]
+            if len(first_sentence) > 10:
+                questions.append(first_sentence.strip())
+    return render(request, 'chat/chat.html', {'questions': list(ULCER_QUESTIONS) + questions})
+
+
+def bench_cold_start(repeat=3):
+    """
+    What a new worker pays before answering: loading the knowledge and forms, the suggested
+    questions, the token index and the trigger pattern, parsed from the text files vs. mapped
+    from a build_knowledge artifact
+    """
+    snapshot = KnowledgeStore([manual_engine.KNOWLEDGE_PATH], optional_paths=[manual_engine.ULCER_KNOWLEDGE_PATH]).get()
+    with open(manual_engine.STRUCTURED_FORMS_PATH, 'rb') as f:
+        data = f.read()
+    forms = json.loads(data)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'knowledge.bin')
+        size = write_artifact(
+            path, snapshot, snapshot.derive('questions', manual_engine.build_questions), forms, forms_version(data)
+        )
+
+        def cold_start(artifact_path):
+            store = KnowledgeStore(
+                [manual_engine.KNOWLEDGE_PATH], optional_paths=[manual_engine.ULCER_KNOWLEDGE_PATH],
+                artifact_path=artifact_path,
+            )
+            forms_store = StructuredFormsStore(
+                manual_engine.STRUCTURED_FORMS_PATH, manual_engine.DEFAULT_STRUCTURED_FORMS, artifact_path=artifact_path
+            )
+            loaded = store.get()
+            loaded.derive('questions', manual_engine.build_questions)
+            loaded.derive('inverted_index', build_inverted_index).candidates(['ulcer'], 10)
+            forms_store.get().match_trigger('burning pain')
+            return loaded
+
+        if cold_start(path).artifact != path:
+            raise AssertionError("The artifact was not used")
+        before = summarize(time_per_call(cold_start, [None] * 10, repeat))
+        after = summarize(time_per_call(cold_start, [path] * 10, repeat))
+    return {
+        'entries': len(snapshot.entries),
+        'artifact_bytes': size,
+        'before': before,
+        'after': after,
+        'speedup': before['mean_ms'] / after['mean_ms'],
+    }
+
+
+def bench_chat_get(repeat=3):
+    """Chat page GET latency: per-request file reads and regex vs. questions cached per knowledge version"""
+    factory = RequestFactory()
+
+    def make_request():
+        request = factory.get('/chat/')
+        request.user = AnonymousUser()
+        return request
+
+    requests = [make_request() for _ in range(20)]
+    chat_view(make_request())  # Warm the snapshot and template caches
+    before = summarize(time_per_call(legacy_chat_get, requests, repeat))
+    after = summarize(time_per_call(chat_view, requests, repeat))
+    return {
+        'before': before,
+        'after': after,
+        'speedup': before['mean_ms'] / after['mean_ms'],
+    }
+
+
+def bench_batch_matching(repeat=3):
+    """
+    Throughput of find_best_matches() vs. one find_best_match() call per query, for each engine,
+    on distinct queries, so `speedup` is what scoring queries together gains. `dedup_speedup`
+    is measured separately: the same batch with every query sent four times, against the
+    distinct batch, per query. The response cache is off, or the single calls would be free.
+    """
+    queries = list(dict.fromkeys(REALISTIC_QUERIES))
+    repeated = queries * 4
+    results = {}
+    for engine in manual_engine.MATCHERS:
+        with override_settings(CHAT_MATCHER=engine), response_cache_disabled():
+            manual_engine.find_best_matches(queries[:1])  # Build the engine's model outside the timing
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for query in queries:
+                    manual_engine.find_best_match(query)
+            one_by_one = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                manual_engine.find_best_matches(queries)
+            batched = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                manual_engine.find_best_matches(repeated)
+            batched_repeated = time.perf_counter() - start
+
+        total = len(queries) * repeat
+        results[engine] = {
+            'queries': len(queries),
+            'queries_per_second_single': total / one_by_one,
+            'queries_per_second_batch': total / batched,
+            'speedup': one_by_one / batched,
+            'queries_per_second_batch_repeated': len(repeated) * repeat / batched_repeated,
+            'dedup_speedup': (batched / len(queries)) / (batched_repeated / len(repeated)),
+        }
+    return results
+
+
+def bench_engine(repeat=3):
+    """
+    Latency percentiles of the engine entry points over the realistic query corpus:
+    find_best_match, check_needs_structured_form, process_message (fresh session per query)
+    and every step of a full ulcer_diagnosis form walkthrough. The response cache is off
+    throughout, so every repeat does the real matching and results don't depend on --repeat.
+    """
+    snapshot = manual_engine.knowledge_store.get()
+    manual_engine.find_best_match(REALISTIC_QUERIES[0])  # Build indexes outside the timing
+
+    with response_cache_disabled():
+        matching = summarize(time_per_call(manual_engine.find_best_match, REALISTIC_QUERIES, repeat))
+
+        triggers = summarize(time_per_call(
+            lambda query: manual_engine.check_needs_structured_form(query, None), REALISTIC_QUERIES, repeat * 10
+        ))
+
+        store = ContextStore()
+        sessions = iter(range(10 ** 9))
+        messages = summarize(time_per_call(
+            lambda query: manual_engine.process_message(query, f'bench-{next(sessions)}', store),
+            REALISTIC_QUERIES, repeat,
+        ))
+
+        steps = [[] for _ in DIAGNOSIS_WALKTHROUGH]
+        for run in range(repeat * 3):
+            session_id = f'walkthrough-{run}'
+            for step, answer in enumerate(DIAGNOSIS_WALKTHROUGH):
+                start = time.perf_counter()
+                manual_engine.process_message(answer, session_id, store)
+                steps[step].append(time.perf_counter() - start)
+    walkthrough = {
+        'per_step': summarize([timing for step in steps for timing in step]),
+        'full_form_mean_ms': sum(statistics.fmean(step) for step in steps) * 1000,
+    }
+
+    return {
+        'entries': len(snapshot.entries),
+        'engine': manual_engine.get_matcher().name,
+        'find_best_match': matching,
+        'check_needs_structured_form': triggers,
+        'process_message': messages,
+        'ulcer_diagnosis_walkthrough': walkthrough,
+    }
+
+
+def bench_http(repeat=3):
+    """
+    End-to-end requests/second on the chat_api endpoint through Django's test client,
+    against a throwaway test database (session creation writes to it).
+    """
+    setup_test_environment()
+    old_database_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        client = Client()
+        url = reverse('chat_api')
+        client.post(url, {'message': REALISTIC_QUERIES[0]})  # Create the session, warm caches
+
+        timings = time_per_call(lambda query: client.post(url, {'message': query}), REALISTIC_QUERIES, repeat)
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0)
+        teardown_test_environment()
+
+    latency = summarize(timings)
+    return {
+        'requests_per_second': len(timings) / sum(timings),
+        'latency': latency,
+    }
+
+
+# Suites runnable from the benchmark_chat command
+SUITES = {
+    'query_plan': bench_query_plan,
+    'chat_get': bench_chat_get,
+    'cold_start': bench_cold_start,
+    'batch_matching': bench_batch_matching,
+    'engine': bench_engine,
+    'pruning': bench_pruning,
+    'typos': bench_typos,
+    'passages': bench_passages,
+    'vectors': bench_vectors,
+    'http': bench_http,
+}
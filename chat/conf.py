@@ -0,0 +1,10 @@
+def setting(name, default):
+    """
+    Read an optional CHAT_* setting.
+    The engine also runs outside Django (scripts, benchmarks), so fall back to
+    the default when settings aren't configured.
+    """
+    from django.conf import settings
+    if not settings.configured:
+        return default
+    return getattr(settings, name, default)
@@ -0,0 +1,267 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+
+class ContextStore:
+    """
+    Bounded, evicting mapping of session id -> ConversationContext.
+    Keeps at most `max_sessions` contexts (least recently used evicted first)
+    and drops contexts idle for longer than `idle_ttl` seconds.
+    Supports the dict operations process_message uses, so it can be passed as
+    its `contexts_dict`.
+    """
+
+    def __init__(self, max_sessions=10000, idle_ttl=3600, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self.clock = clock
+        self.evictions = 0  # Dropped because the store was full
+        self.expirations = 0  # Dropped because they sat idle too long
+        self._items = OrderedDict()  # session id -> (context, last access), least recent first
+        self._lock = threading.Lock()
+
+    def _purge_expired(self, now):
+        # Entries are kept in access order, so expired ones are all at the front
+        if not self.idle_ttl:
+            return
+        while self._items:
+            session_id, (_, last_access) = next(iter(self._items.items()))
+            if now - last_access <= self.idle_ttl:
+                break
+            del self._items[session_id]
+            self.expirations += 1
+
+    def __contains__(self, session_id):
+        with self._lock:
+            self._purge_expired(self.clock())
+            return session_id in self._items
+
+    def __getitem__(self, session_id):
+        with self._lock:
+            now = self.clock()
+            self._purge_expired(now)
+            context, _ = self._items[session_id]
+            self._items[session_id] = (context, now)
+            self._items.move_to_end(session_id)
+            return context
+
+    def get(self, session_id, default=None):
+        try:
+            return self[session_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, session_id, context):
+        with self._lock:
+            now = self.clock()
+            self._purge_expired(now)
+            self._items[session_id] = (context, now)
+            self._items.move_to_end(session_id)
+            while self.max_sessions and len(self._items) > self.max_sessions:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def __delitem__(self, session_id):
+        with self._lock:
+            del self._items[session_id]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def approximate_size(self):
+        """Rough memory held by the stored conversations, in bytes"""
+        with self._lock:
+            contexts = [context for context, _ in self._items.values()]
+        total = 0
+        for context in contexts:
+            total += sys.getsizeof(context.history)
+            for user_msg, system_response in context.history:
+                total += sys.getsizeof(user_msg) + sys.getsizeof(system_response)
+            total += sum(sys.getsizeof(value) for value in context.form_data.values())
+        return total
+
+    def stats(self):
+        return {
+            'sessions': len(self),
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'approximate_bytes': self.approximate_size(),
+        }
+
+
+def dump_context(context):
+    """Compact JSON form of a ConversationContext"""
+    return json.dumps(context.to_dict(), separators=(',', ':'), ensure_ascii=False)
+
+
+def load_context(data, context_class):
+    """Rebuild a context from dump_context() output; None if unreadable or from another schema version"""
+    try:
+        return context_class.from_dict(json.loads(data))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class SerializedContextBackend:
+    """
+    Base for backends that keep serialized contexts outside the process, so
+    any worker can pick up a session. Subclasses implement get/__setitem__/
+    __delitem__/__len__/purge_expired; the rest of the mapping API is derived.
+    Concurrent messages for one session are last-write-wins.
+
+    Idle contexts are unreadable but stay stored until purged: a write purges
+    them at most once per `purge_interval` seconds per process (0 disables it,
+    leaving it to the purge_contexts command).
+    """
+
+    def __init__(self, context_class, idle_ttl=3600, purge_interval=300):
+        self.context_class = context_class
+        self.idle_ttl = idle_ttl
+        self.purge_interval = purge_interval
+        self._next_purge = 0
+        self._purge_lock = threading.Lock()
+
+    def _purge_if_due(self):
+        if not self.idle_ttl or not self.purge_interval:
+            return
+        with self._purge_lock:
+            now = time.monotonic()
+            if now < self._next_purge:
+                return
+            self._next_purge = now + self.purge_interval
+        self.purge_expired()
+
+    @staticmethod
+    def _key(session_id):
+        return '' if session_id is None else str(session_id)
+
+    def __getitem__(self, session_id):
+        context = self.get(session_id)
+        if context is None:
+            raise KeyError(session_id)
+        return context
+
+    def __contains__(self, session_id):
+        return self.get(session_id) is not None
+
+    def stats(self):
+        return {'sessions': len(self)}
+
+
+class DatabaseContextBackend(SerializedContextBackend):
+    """Contexts stored in the ConversationState table, shared by every worker on the database"""
+
+    @staticmethod
+    def _model():
+        # Imported lazily: this module is loaded while the app registry is still being set up
+        from .models import ConversationState
+        return ConversationState
+
+    def _expiry_cutoff(self):
+        from django.utils import timezone
+        return timezone.now() - timedelta(seconds=self.idle_ttl)
+
+    def get(self, session_id, default=None):
+        rows = self._model().objects.filter(session_id=self._key(session_id))
+        if self.idle_ttl:
+            rows = rows.filter(updated_at__gte=self._expiry_cutoff())
+        data = rows.values_list('data', flat=True).first()
+        context = load_context(data, self.context_class) if data is not None else None
+        return default if context is None else context
+
+    def __setitem__(self, session_id, context):
+        self._model().objects.update_or_create(
+            session_id=self._key(session_id), defaults={'data': dump_context(context)}
+        )
+        self._purge_if_due()
+
+    def __delitem__(self, session_id):
+        self._model().objects.filter(session_id=self._key(session_id)).delete()
+
+    def __len__(self):
+        return self._model().objects.count()
+
+    def purge_expired(self):
+        """Delete idle contexts; returns how many were removed"""
+        if not self.idle_ttl:
+            return 0
+        deleted, _ = self._model().objects.filter(updated_at__lt=self._expiry_cutoff()).delete()
+        return deleted
+
+
+class FileContextBackend(SerializedContextBackend):
+    """
+    One JSON file per session in a directory shared by the workers.
+    Writes go to a temporary file renamed into place, so readers never see a partial context.
+    """
+
+    def __init__(self, directory, context_class, idle_ttl=3600, purge_interval=300):
+        super().__init__(context_class, idle_ttl, purge_interval)
+        self.directory = str(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, session_id):
+        name = hashlib.sha1(self._key(session_id).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name + '.json')
+
+    def _expired(self, mtime):
+        return bool(self.idle_ttl) and time.time() - mtime > self.idle_ttl
+
+    def get(self, session_id, default=None):
+        path = self._path(session_id)
+        try:
+            if self._expired(os.stat(path).st_mtime):
+                return default
+            with open(path, 'r', encoding='utf-8') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return default
+        context = load_context(data, self.context_class)
+        return default if context is None else context
+
+    def __setitem__(self, session_id, context):
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(dump_context(context))
+            os.replace(temp_path, self._path(session_id))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self._purge_if_due()
+
+    def __delitem__(self, session_id):
+        try:
+            os.unlink(self._path(session_id))
+        except FileNotFoundError:
+            raise KeyError(session_id)
+
+    def _files(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+
+    def __len__(self):
+        return len(self._files())
+
+    def purge_expired(self):
+        """Delete idle context files; returns how many were removed"""
+        removed = 0
+        for entry in self._files():
+            try:
+                if self._expired(entry.stat().st_mtime):
+                    os.unlink(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # Purged concurrently by another worker
+        return removed
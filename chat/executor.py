@@ -0,0 +1,89 @@
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections
+
+from .conf import setting
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a BoundedExecutor already holds as much work as it may queue"""
+
+
+def _setup_worker_process():
+    # Spawned workers start from a clean interpreter and need Django configured
+    import django
+    django.setup()
+
+
+def _run_task(fn, *args, **kwargs):
+    # Pool workers outlive requests, so nothing else releases the database connection
+    # a task opens; drop stale or broken ones around each task, as Django does per request
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+class BoundedExecutor:
+    """
+    Thread or process pool that refuses new work once `max_workers` tasks are
+    running and `queue_size` more are waiting, instead of queueing without limit.
+    """
+
+    def __init__(self, kind='thread', max_workers=4, queue_size=16):
+        if kind == 'thread':
+            self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chat')
+        elif kind == 'process':
+            self._pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_setup_worker_process,
+            )
+        else:
+            raise ImproperlyConfigured(f"Unknown CHAT_EXECUTOR {kind!r}; expected 'thread' or 'process'")
+        self.kind = kind
+        self.capacity = max_workers + queue_size
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(self.capacity)
+
+    def submit(self, fn, *args, **kwargs):
+        """Schedule fn(*args, **kwargs) and return its Future; raises ExecutorSaturated when full"""
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise ExecutorSaturated()
+        try:
+            future = self._pool.submit(_run_task, fn, *args, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+_chat_executor = None
+_chat_executor_lock = threading.Lock()
+
+
+def get_chat_executor():
+    """The process-wide executor for chat messages, configured by the CHAT_EXECUTOR* settings"""
+    global _chat_executor
+    if _chat_executor is None:
+        with _chat_executor_lock:
+            if _chat_executor is None:
+                kind = setting('CHAT_EXECUTOR', 'thread')
+                if kind == 'process' and setting('CHAT_CONTEXT_BACKEND', 'memory') == 'memory':
+                    # Each worker process would keep its own contexts and lose the conversation
+                    raise ImproperlyConfigured("CHAT_EXECUTOR = 'process' needs a shared CHAT_CONTEXT_BACKEND")
+                _chat_executor = BoundedExecutor(
+                    kind,
+                    max_workers=setting('CHAT_EXECUTOR_WORKERS', 4),
+                    queue_size=setting('CHAT_EXECUTOR_QUEUE_SIZE', 16),
+                )
+    return _chat_executor
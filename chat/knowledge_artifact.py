@@ -0,0 +1,240 @@
+"""
+The compiled knowledge artifact written by `python manage.py build_knowledge`.
+
+One binary file holds everything workers would otherwise derive from the raw
+knowledge and structured form files: the entries, their normalized text, the
+inverted token index, the suggested questions and the form trigger pattern.
+Workers memory-map it, so its pages are read from disk once and shared by
+every process on the machine.
+
+Layout: MAGIC, the header length (uint32), a JSON header describing the
+sections, then the sections themselves, each 8-byte aligned. A string table
+is an `<name>.offsets` array of uint64 (one more than the strings) and a
+`<name>.data` UTF-8 blob; the index is a sorted term table, `postings.offsets`
+and `postings.ids` (uint32) and `idf` (float64).
+"""
+import os
+import sys
+import json
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping, Sequence
+
+from .knowledge_index import InvertedIndex, build_inverted_index, build_normalized_text
+from .knowledge_store import FormRegistry, KnowledgeSnapshot
+
+MAGIC = b'CHATKB\x00\x01'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sI')
+ALIGNMENT = 8
+
+
+class ArtifactError(ValueError):
+    """The file is not a knowledge artifact this code can read"""
+
+
+class MappedStrings(Sequence):
+    """Read-only sequence of strings decoded on access from a memory-mapped string table"""
+
+    def __init__(self, offsets, data):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self[position] for position in range(*index.indices(len(self))))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('string table index out of range')
+        return str(self._data[self._offsets[index]:self._offsets[index + 1]], 'utf-8')
+
+    def __iter__(self):
+        data = self._data.tobytes()
+        offsets = self._offsets.tolist()
+        return (data[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:]))
+
+
+class TermTable(Mapping):
+    """
+    term -> value for the sorted memory-mapped term table, found by binary search,
+    so no per-process dictionary of the vocabulary is built. `value(position)` reads
+    the value of the term at a position.
+    """
+
+    def __init__(self, terms, value):
+        self._terms = terms
+        self._value = value
+
+    def position(self, term):
+        position = bisect_left(self._terms, term)
+        if position < len(self._terms) and self._terms[position] == term:
+            return position
+        return None
+
+    def __getitem__(self, term):
+        position = self.position(term)
+        if position is None:
+            raise KeyError(term)
+        return self._value(position)
+
+    def __contains__(self, term):
+        return self.position(term) is not None
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+
+class MappedInvertedIndex(InvertedIndex):
+    """An InvertedIndex whose terms, postings and weights stay in the memory map"""
+
+    def __init__(self, size, terms, offsets, ids, weights):
+        self.size = size
+        self.postings = TermTable(terms, lambda position: tuple(ids[offsets[position]:offsets[position + 1]]))
+        self.idf = TermTable(terms, weights.__getitem__)
+
+
+def string_table(strings):
+    """(offsets, data) sections of a string table"""
+    offsets = array('Q', [0])
+    data = bytearray()
+    for string in strings:
+        data += string.encode('utf-8')
+        offsets.append(len(data))
+    return offsets, bytes(data)
+
+
+def artifact_sections(snapshot, questions):
+    """The named sections of an artifact, as arrays or bytes"""
+    normalized = snapshot.derive('normalized_text', build_normalized_text)
+    index = snapshot.derive('inverted_index', build_inverted_index)
+    sections = {}
+    for name, strings in (('entries', snapshot.entries), ('normalized', normalized), ('questions', questions)):
+        sections[f'{name}.offsets'], sections[f'{name}.data'] = string_table(strings)
+
+    terms = sorted(index.postings)
+    sections['terms.offsets'], sections['terms.data'] = string_table(terms)
+    offsets = array('Q', [0])
+    ids = array('I')
+    for term in terms:
+        ids.extend(index.postings[term])
+        offsets.append(len(ids))
+    sections['postings.offsets'] = offsets
+    sections['postings.ids'] = ids
+    sections['idf'] = array('d', (index.idf[term] for term in terms))
+    return sections
+
+
+def write_artifact(path, snapshot, questions, forms, forms_version):
+    """
+    Write the artifact for a knowledge snapshot, its suggested questions and the parsed
+    structured forms, atomically, so workers mapping the previous file keep reading it
+    intact. `forms_version` identifies the forms file content. Returns the file size.
+    """
+    sections = artifact_sections(snapshot, questions)
+    trigger_pattern = FormRegistry(forms, signature=()).trigger_pattern
+    layout = {}
+    offset = 0
+    for name, section in sections.items():
+        data = section.tobytes() if isinstance(section, array) else section
+        typecode = section.typecode if isinstance(section, array) else 'B'
+        layout[name] = (offset, len(data), typecode)
+        sections[name] = data
+        offset += len(data) + (-len(data) % ALIGNMENT)
+
+    header = json.dumps({
+        'format': FORMAT_VERSION,
+        'byteorder': sys.byteorder,
+        'version': snapshot.version,
+        'forms_version': forms_version,
+        'forms': forms,
+        'trigger_pattern': trigger_pattern.pattern if trigger_pattern else None,
+        'sections': layout,
+    }).encode('utf-8')
+    header += b' ' * (-(PREAMBLE.size + len(header)) % ALIGNMENT)
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREAMBLE.pack(MAGIC, len(header)))
+            f.write(header)
+            for data in sections.values():
+                f.write(data)
+                f.write(b'\0' * (-len(data) % ALIGNMENT))
+        os.chmod(temp_path, 0o644)  # mkstemp creates it private; workers may run as another user
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return os.path.getsize(path)
+
+
+class KnowledgeArtifact:
+    """A memory-mapped artifact; raises ArtifactError if the file isn't one this code can read"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise ArtifactError(f"{path} is empty")
+        try:
+            magic, header_length = PREAMBLE.unpack_from(self._map)
+            if magic != MAGIC:
+                raise ArtifactError(f"{path} is not a knowledge artifact")
+            header = json.loads(self._map[PREAMBLE.size:PREAMBLE.size + header_length])
+        except (struct.error, UnicodeDecodeError, json.JSONDecodeError):
+            raise ArtifactError(f"{path} has a damaged header")
+        if header.get('format') != FORMAT_VERSION or header.get('byteorder') != sys.byteorder:
+            raise ArtifactError(f"{path} was built for another format or platform; rebuild it with build_knowledge")
+
+        self.version = header.get('version')
+        self.forms_version = header.get('forms_version')
+        self._header = header
+        self._base = PREAMBLE.size + header_length
+        self._view = memoryview(self._map)
+
+    def array(self, name):
+        offset, length, typecode = self._header['sections'][name]
+        start = self._base + offset
+        return self._view[start:start + length].cast(typecode)
+
+    def strings(self, name):
+        return MappedStrings(self.array(f'{name}.offsets'), self.array(f'{name}.data'))
+
+    def snapshot(self, signature, sources):
+        """A KnowledgeSnapshot served from the map, its index, questions and normalized text prebuilt"""
+        entries = self.strings('entries')
+        index = MappedInvertedIndex(
+            len(entries), self.strings('terms'),
+            self.array('postings.offsets'), self.array('postings.ids'), self.array('idf'),
+        )
+        derived = {
+            'inverted_index': index,
+            'questions': tuple(self.strings('questions')),  # Callers concatenate it with other tuples
+            'normalized_text': self.strings('normalized'),
+        }
+        return KnowledgeSnapshot(entries, self.version, signature, sources, derived=derived, artifact=self.path)
+
+    def form_registry(self, signature):
+        return FormRegistry(self._header['forms'], signature, self._header['trigger_pattern'])
+
+
+def open_artifact(path):
+    """The artifact at `path`, or None if there is none or it can't be read"""
+    try:
+        return KnowledgeArtifact(path)
+    except (FileNotFoundError, ArtifactError):
+        return None
@@ -0,0 +1,113 @@
+import re
+import math
+import heapq
+import difflib
+from collections import defaultdict
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Words too common to say anything about which entry a query is after
+STOP_WORDS = frozenset([
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do', 'does', 'for',
+    'from', 'has', 'have', 'how', 'i', 'if', 'in', 'is', 'it', 'my', 'of', 'on',
+    'or', 'should', 'that', 'the', 'this', 'to', 'was', 'what', 'when', 'which',
+    'who', 'why', 'will', 'with', 'you', 'your',
+])
+
+# Longest suffixes first so 'ies' wins over 's'
+SUFFIXES = ('ies', 'ing', 'ed', 'es', 'ly', 's')
+
+
+def stem(token):
+    """Very light suffix stripping, enough to make 'ulcers'/'ulcer' and 'eating'/'eat' meet"""
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix == 'ies':
+                return token[:-3] + 'y'
+            return token[:-len(suffix)]
+    return token
+
+
+def tokenize(text):
+    """Lowercase, split into word tokens, drop stop words and stem"""
+    return [stem(token) for token in TOKEN_RE.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def index_terms(text):
+    """
+    Stemmed content words plus adjacent word pairs (stop words included).
+    The pairs let entries that would earn a phrase boost, like 'can i' or
+    'what causes', reach the candidate set even when their content words don't.
+    """
+    words = TOKEN_RE.findall(text.lower())
+    terms = [stem(word) for word in words if word not in STOP_WORDS]
+    terms.extend(f"{first} {second}" for first, second in zip(words, words[1:]))
+    return terms
+
+
+class InvertedIndex:
+    """Maps stemmed terms to the ids of the knowledge entries containing them"""
+
+    def __init__(self, entries):
+        self.size = len(entries)
+        postings = defaultdict(set)
+        for entry_id, entry in enumerate(entries):
+            for term in index_terms(entry):
+                postings[term].add(entry_id)
+        self.postings = {term: tuple(sorted(ids)) for term, ids in postings.items()}
+        self.idf = {
+            term: math.log(1 + self.size / len(ids))
+            for term, ids in self.postings.items()
+        }
+
+    def candidates(self, terms, limit):
+        """
+        Return up to `limit` entry ids sharing terms with the query, best lexical overlap first.
+        An empty list means no term was indexed and the caller should fall back to a full scan.
+        """
+        scores = defaultdict(float)
+        for term in set(terms):
+            weight = self.idf.get(term)
+            if weight is None:
+                continue
+            for entry_id in self.postings[term]:
+                scores[entry_id] += weight
+        if not scores:
+            return []
+        # Ties go to the earlier entry, matching the scan order of the full scorer
+        return heapq.nsmallest(limit, scores, key=lambda entry_id: (-scores[entry_id], entry_id))
+
+
+class NormalizedEntry:
+    """
+    A knowledge entry with its lowercased text and a difflib matcher already seeded with it.
+    With `unit`, queries are scored against that part of the entry instead of all of it;
+    `lower` is the lowercased text when it is already at hand.
+    """
+
+    __slots__ = ('text', 'lower', 'matcher')
+
+    def __init__(self, text, unit=None, lower=None):
+        self.text = text
+        self.lower = lower if lower is not None else (text if unit is None else unit).lower()
+        # The entry is difflib's second sequence, whose lookup tables are the
+        # expensive part to build; queries only ever replace the first one
+        self.matcher = difflib.SequenceMatcher(None, '', self.lower)
+        # Also build the entry's character counts used by quick_ratio(); copies share them
+        self.matcher.quick_ratio()
+
+
+def build_normalized_text(snapshot):
+    """Builder for KnowledgeSnapshot.derive(): the lowercased entries, same order"""
+    return tuple(entry.lower() for entry in snapshot.entries)
+
+
+def build_entry_table(snapshot):
+    """Builder for KnowledgeSnapshot.derive(): one NormalizedEntry per entry, same order"""
+    normalized = snapshot.derive('normalized_text', build_normalized_text)
+    return [NormalizedEntry(entry, lower=lower) for entry, lower in zip(snapshot.entries, normalized)]
+
+
+def build_inverted_index(snapshot):
+    """Builder for KnowledgeSnapshot.derive()"""
+    return InvertedIndex(snapshot.entries)
@@ -0,0 +1,245 @@
+import io
+import os
+import re
+import json
+import hashlib
+import threading
+from collections.abc import MutableSequence, Sequence
+from types import MappingProxyType
+
+
+def forms_version(data):
+    """Content hash identifying a structured forms file"""
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+def file_signature(paths, required=()):
+    """(path, mtime_ns, size) for each path; missing files raise only if listed in `required`"""
+    signature = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            if path in required:
+                raise
+            signature.append((path, None, None))
+        else:
+            signature.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(signature)
+
+
+class KnowledgeSnapshot:
+    """An immutable, fully-built view of the knowledge files"""
+
+    def __init__(self, entries, version, signature, sources=None, derived=None, artifact=None):
+        # Read-only sequences, like the memory-mapped entries of an artifact, are kept as they are
+        if not isinstance(entries, Sequence) or isinstance(entries, MutableSequence):
+            entries = tuple(entries)
+        self.entries = entries
+        # Decoded text of each source file; without it every entry stands as its own paragraph
+        self.sources = tuple(sources) if sources is not None else ('\n\n'.join(self.entries),)
+        self.version = version  # Content hash of the source files
+        self.signature = signature  # (path, mtime_ns, size) tuples used for change detection
+        self.artifact = artifact  # Path of the build_knowledge artifact it was loaded from, if any
+        self._derived = dict(derived or {})  # Prebuilt values, e.g. from the artifact
+        self._derived_lock = threading.RLock()  # Builders may derive other values
+
+    def derive(self, key, builder):
+        """
+        Return a value computed from this snapshot, building it once on first use.
+        Derived data lives and dies with the snapshot, so a reload invalidates it.
+        """
+        try:
+            return self._derived[key]
+        except KeyError:
+            pass
+        with self._derived_lock:
+            if key not in self._derived:
+                self._derived[key] = builder(self)
+            return self._derived[key]
+
+
+class KnowledgeStore:
+    """
+    Process-wide knowledge store.
+    Files are read once; every access does a cheap stat() of the sources and
+    the snapshot is rebuilt (and swapped in atomically) only when one changed.
+    When `artifact_path` holds a build_knowledge artifact of the same sources,
+    the snapshot is served from it instead of parsing and indexing the text.
+    """
+
+    def __init__(self, paths, optional_paths=(), artifact_path=None):
+        self.paths = tuple(paths)
+        self.optional_paths = tuple(optional_paths)
+        self.artifact_path = artifact_path
+        self.reload_count = 0
+        self._snapshot = None
+        self._artifact = None  # (file signature, KnowledgeArtifact or None)
+        self._lock = threading.Lock()
+
+    def _signature(self):
+        return file_signature(self.paths + self.optional_paths, required=self.paths)
+
+    def _build(self, signature):
+        sources = []
+        digest = hashlib.sha1()
+        for path in self.paths + self.optional_paths:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                if path in self.paths:
+                    raise
+                continue  # Optional sources are simply skipped when missing
+            digest.update(data)
+            sources.append(data.decode('utf-8'))
+        version = digest.hexdigest()[:16]
+
+        artifact = load_artifact(self, self.artifact_path)
+        if artifact is not None and artifact.version == version:
+            return artifact.snapshot(signature, sources)
+
+        entries = []
+        for source in sources:
+            # Same line semantics as iterating a text-mode file (universal newlines)
+            lines = io.StringIO(source, newline=None)
+            entries.extend(line.strip() for line in lines if line.strip())
+        return KnowledgeSnapshot(entries, version, signature, sources)
+
+    def get(self):
+        """Return the current snapshot, rebuilding it if the files changed on disk"""
+        signature = self._signature()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.signature == signature:
+            return snapshot
+
+        with self._lock:
+            # Another thread may have rebuilt while we waited for the lock
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.signature != signature:
+                snapshot = self._build(signature)
+                self._snapshot = snapshot
+                self.reload_count += 1
+            return snapshot
+
+    def reload(self):
+        """Force a rebuild regardless of file timestamps"""
+        with self._lock:
+            self._snapshot = self._build(self._signature())
+            self.reload_count += 1
+            return self._snapshot
+
+
+def load_artifact(store, path):
+    """
+    The store's memory-mapped build_knowledge artifact, mapped again only when the file
+    was replaced; None when there is no usable one. Callers hold the store's lock.
+    """
+    if not path:
+        return None
+    from .knowledge_artifact import open_artifact
+
+    path = os.fspath(path)
+    signature = file_signature([path])
+    if store._artifact is None or store._artifact[0] != signature:
+        store._artifact = (signature, open_artifact(path))
+    return store._artifact[1]
+
+
+def freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class FormRegistry:
+    """Parsed, read-only structured form definitions plus their compiled trigger matcher"""
+
+    def __init__(self, forms, signature, trigger_pattern=None):
+        self.forms = freeze(forms)
+        self.signature = signature
+        self.form_types = tuple(self.forms)
+        # A precomputed pattern (from the build_knowledge artifact) skips building it
+        self.trigger_pattern = re.compile(trigger_pattern) if trigger_pattern else self._compile_triggers()
+
+    def _compile_triggers(self):
+        # One alternation per form, in definition order, each in a named group. Wrapped in a
+        # lookahead the regex tries every start position without consuming text, so
+        # overlapping phrases are not skipped, and at each position the earliest form wins.
+        groups = []
+        for index, form_def in enumerate(self.forms.values()):
+            phrases = form_def.get('trigger_phrases', ())
+            if phrases:
+                alternation = '|'.join(re.escape(phrase.lower()) for phrase in phrases)
+                groups.append(f"(?P<f{index}>{alternation})")
+        if not groups:
+            return None
+        return re.compile(f"(?=(?:{'|'.join(groups)}))")
+
+    def match_trigger(self, text_lower):
+        """
+        Return the first form, in definition order, with a trigger phrase in the lowercased
+        text - the same answer as checking every phrase of every form with `in`.
+        """
+        if self.trigger_pattern is None:
+            return None
+        best = None
+        for match in self.trigger_pattern.finditer(text_lower):
+            index = int(match.lastgroup[1:])
+            if best is None or index < best:
+                best = index
+                if best == 0:
+                    break
+        return self.form_types[best] if best is not None else None
+
+
+class StructuredFormsStore:
+    """
+    Process-wide structured form registry, parsed once and hot-reloaded when the
+    JSON file changes. A missing or invalid file yields the given default forms.
+    When `artifact_path` holds a build_knowledge artifact of the same file, the
+    forms and trigger pattern come from it.
+    """
+
+    def __init__(self, path, defaults, artifact_path=None):
+        self.path = path
+        self.defaults = defaults
+        self.artifact_path = artifact_path
+        self.reload_count = 0
+        self._registry = None
+        self._artifact = None  # (file signature, KnowledgeArtifact or None)
+        self._lock = threading.Lock()
+
+    def _build(self, signature):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return FormRegistry(self.defaults, signature)
+
+        artifact = load_artifact(self, self.artifact_path)
+        if artifact is not None and artifact.forms_version == forms_version(data):
+            return artifact.form_registry(signature)
+        try:
+            forms = json.loads(data.decode('utf-8'))
+        except json.JSONDecodeError:
+            forms = self.defaults
+        return FormRegistry(forms, signature)
+
+    def get(self):
+        """Return the current FormRegistry, rebuilding it if the file changed on disk"""
+        signature = file_signature([self.path])
+        registry = self._registry
+        if registry is not None and registry.signature == signature:
+            return registry
+
+        with self._lock:
+            registry = self._registry
+            if registry is None or registry.signature != signature:
+                registry = self._build(signature)
+                self._registry = registry
+                self.reload_count += 1
+            return registry
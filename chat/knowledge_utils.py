@@ -1,8 +1,9 @@
 import os
+from .knowledge_store import KnowledgeStore
 
 KNOWLEDGE_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'chat', 'knowledge.txt')
 
+knowledge_store = KnowledgeStore([KNOWLEDGE_PATH])
+
 def load_knowledge_base():
-    with open(KNOWLEDGE_PATH, 'r', encoding='utf-8') as f:
-        entries = [line.strip() for line in f if line.strip()]
-    return entries
+    return list(knowledge_store.get().entries)
@@ -0,0 +1,61 @@
+import sys
+import json
+import platform
+import subprocess
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from chat.benchmarks import SUITES, scaled_knowledge
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = "Run chat engine benchmarks and print the results as JSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument('suites', nargs='*', help=f"Suites to run (default: all of {', '.join(SUITES)})")
+        parser.add_argument('--repeat', type=int, default=3, help="Passes over the query corpus per measurement")
+        parser.add_argument(
+            '--scale', type=int, default=1,
+            help="Grow the knowledge base to N times its size with synthetic entries",
+        )
+        parser.add_argument('--output', help="Also write the JSON results to this file")
+
+    def handle(self, *args, **options):
+        names = options['suites'] or list(SUITES)
+        unknown = [name for name in names if name not in SUITES]
+        if unknown:
+            raise CommandError(f"Unknown suite(s): {', '.join(unknown)}")
+
+        results = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'revision': git_revision(),
+                'python': sys.version.split()[0],
+                'django': django.get_version(),
+                'platform': platform.platform(),
+                'repeat': options['repeat'],
+                'scale': options['scale'],
+            },
+        }
+        with scaled_knowledge(options['scale']) as snapshot:
+            results['meta']['entries'] = len(snapshot.entries)
+            for name in names:
+                self.stderr.write(f"Running {name}...")
+                results[name] = SUITES[name](repeat=options['repeat'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output + '\n')
+        self.stdout.write(output)
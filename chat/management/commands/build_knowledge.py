@@ -0,0 +1,74 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import manual_engine, vector_index
+from chat.knowledge_artifact import write_artifact
+from chat.knowledge_store import KnowledgeStore, forms_version
+
+
+def validate_forms(forms):
+    """Problems with parsed structured form definitions, as messages"""
+    if not isinstance(forms, dict) or not forms:
+        return ["must be a non-empty JSON object of forms"]
+    problems = []
+    for form_type, form_def in forms.items():
+        if not isinstance(form_def, dict):
+            problems.append(f"{form_type}: must be an object")
+            continue
+        questions = form_def.get('questions')
+        if not isinstance(questions, dict) or not questions or not all(
+            isinstance(question, str) for question in questions.values()
+        ):
+            problems.append(f"{form_type}: 'questions' must be a non-empty object of strings")
+        phrases = form_def.get('trigger_phrases', [])
+        if not isinstance(phrases, list) or not all(isinstance(phrase, str) and phrase for phrase in phrases):
+            problems.append(f"{form_type}: 'trigger_phrases' must be a list of non-empty strings")
+        if not isinstance(form_def.get('follow_up_template', ''), str):
+            problems.append(f"{form_type}: 'follow_up_template' must be a string")
+    return problems
+
+
+class Command(BaseCommand):
+    help = "Validate the knowledge and structured form files and compile them into the artifact workers memory-map"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', help="Artifact path (default: CHAT_KNOWLEDGE_ARTIFACT)")
+
+    def handle(self, *args, **options):
+        path = options['output'] or manual_engine.KNOWLEDGE_ARTIFACT_PATH
+        if not path:
+            raise CommandError("Set CHAT_KNOWLEDGE_ARTIFACT or pass --output")
+
+        # Parsed from the text, never from an existing artifact
+        store = KnowledgeStore([manual_engine.KNOWLEDGE_PATH], optional_paths=[manual_engine.ULCER_KNOWLEDGE_PATH])
+        try:
+            snapshot = store.get()
+        except FileNotFoundError as e:
+            raise CommandError(f"Missing knowledge file: {e.filename}")
+        except UnicodeDecodeError as e:
+            raise CommandError(f"Knowledge files must be UTF-8: {e}")
+        if not snapshot.entries:
+            raise CommandError("The knowledge files have no entries")
+
+        try:
+            with open(manual_engine.STRUCTURED_FORMS_PATH, 'rb') as f:
+                data = f.read()
+            forms = json.loads(data.decode('utf-8'))
+        except FileNotFoundError:
+            raise CommandError(f"Missing structured forms file: {manual_engine.STRUCTURED_FORMS_PATH}")
+        except ValueError as e:
+            raise CommandError(f"Invalid structured forms file: {e}")
+        problems = validate_forms(forms)
+        if problems:
+            raise CommandError("Invalid structured forms file:\n" + '\n'.join(problems))
+
+        questions = snapshot.derive('questions', manual_engine.build_questions)
+        size = write_artifact(path, snapshot, questions, forms, forms_version(data))
+        self.stdout.write(
+            f"Wrote {path} ({size} bytes): {len(snapshot.entries)} entries, {len(questions)} questions, "
+            f"{len(forms)} forms, knowledge version {snapshot.version}"
+        )
+        removed = vector_index.remove_stale_vectors(snapshot.version)
+        if removed:
+            self.stdout.write(f"Removed {removed} embedding files of older knowledge versions")
@@ -0,0 +1,44 @@
+import io
+import os
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.profiling import profile_directory
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+class Command(BaseCommand):
+    help = "Summarize the hottest functions across the profiles captured for slow chat requests"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help="Profile directory (default: CHAT_PROFILE_DIR)")
+        parser.add_argument('--limit', type=int, default=20, help="Number of functions to list")
+        parser.add_argument('--sort', choices=SORT_KEYS, default='tottime', help="Ranking key")
+        parser.add_argument('--filter', help="Only list functions whose location matches this regex, e.g. chat/")
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or profile_directory()
+        try:
+            files = sorted(
+                os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.prof')
+            )
+        except FileNotFoundError:
+            files = []
+        if not files:
+            raise CommandError(f"No captured profiles in {directory}")
+
+        # pstats prints in fragments; collect them, as self.stdout ends every write with a newline
+        report = io.StringIO()
+        stats = pstats.Stats(files[0], stream=report)
+        for path in files[1:]:
+            stats.add(path)
+
+        self.stdout.write(f"{len(files)} profile(s) from {directory}, sorted by {options['sort']}")
+        if options['filter']:
+            # Match against full paths, so keep them
+            stats.sort_stats(options['sort']).print_stats(options['filter'], options['limit'])
+        else:
+            stats.strip_dirs().sort_stats(options['sort']).print_stats(options['limit'])
+        self.stdout.write(report.getvalue())
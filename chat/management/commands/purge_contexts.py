@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import manual_engine
+
+
+class Command(BaseCommand):
+    help = "Delete conversation contexts idle longer than CHAT_CONTEXT_IDLE_TTL from the shared context backend"
+
+    def handle(self, *args, **options):
+        backend = manual_engine.build_context_backend()
+        if not hasattr(backend, 'purge_expired'):
+            raise CommandError("The 'memory' context backend lives in each worker and expires contexts itself")
+        if not backend.idle_ttl:
+            raise CommandError("CHAT_CONTEXT_IDLE_TTL is 0, so contexts never expire")
+        removed = backend.purge_expired()
+        self.stdout.write(f"Removed {removed} expired contexts")
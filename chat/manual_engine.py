@@ -1,14 +1,68 @@
 import os
-import difflib
+import copy
+import tempfile
 import re
-import json
 from collections import defaultdict
+from django.core.exceptions import ImproperlyConfigured
+from .conf import setting
+from .context_store import ContextStore, DatabaseContextBackend, FileContextBackend
+from .knowledge_store import KnowledgeStore, StructuredFormsStore
+from .knowledge_index import build_entry_table, build_inverted_index, index_terms, tokenize
+from .matchers import Matcher, BM25Matcher, TfidfMatcher, VectorMatcher
+from .typo_index import build_typo_index
+from .passages import compile_knowledge
+from .response_cache import MISSING, ResponseCache, normalize_query
+from .metrics import metrics
+from .profiling import profile_slow_calls
 
 # Path configurations
 KNOWLEDGE_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'chat', 'knowledge.txt')
 ULCER_KNOWLEDGE_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'chat', 'ulcer_knowledge.txt')
 STRUCTURED_FORMS_PATH = os.path.join(os.path.dirname(__file__), 'templates', 'chat', 'structured_forms.json')
 
+# Forms used when structured_forms.json is missing or invalid
+DEFAULT_STRUCTURED_FORMS = {
+    "pain_assessment": {
+        "trigger_phrases": ["pain", "hurt", "ache", "sore"],
+        "questions": {
+            "location": "Where exactly is the pain located?",
+            "duration": "How long have you been experiencing this pain?",
+            "intensity": "On a scale of 1-10, how would you rate the pain?",
+            "characteristics": "How would you describe the pain? (sharp, dull, throbbing, etc.)"
+        },
+        "follow_up_template": "Based on your description of {intensity}/10 {characteristics} pain in the {location} for {duration}, I recommend..."
+    },
+    "symptom_assessment": {
+        "trigger_phrases": ["symptom", "fever", "cough", "dizzy", "nausea", "vomiting"],
+        "questions": {
+            "main_symptom": "What is your main symptom?",
+            "duration": "How long have you been experiencing these symptoms?",
+            "severity": "How severe are your symptoms?",
+            "other_symptoms": "Are you experiencing any other symptoms?"
+        },
+        "follow_up_template": "Based on your {severity} {main_symptom} for {duration}, along with {other_symptoms}, I suggest..."
+    }
+}
+
+# Compiled by `manage.py build_knowledge`; used while it matches the files above
+KNOWLEDGE_ARTIFACT_PATH = setting('CHAT_KNOWLEDGE_ARTIFACT', None)
+
+# Process-wide knowledge store; the ulcer knowledge file is optional
+knowledge_store = KnowledgeStore(
+    [KNOWLEDGE_PATH], optional_paths=[ULCER_KNOWLEDGE_PATH], artifact_path=KNOWLEDGE_ARTIFACT_PATH
+)
+
+# Process-wide structured form registry with precompiled trigger matching
+forms_store = StructuredFormsStore(
+    STRUCTURED_FORMS_PATH, DEFAULT_STRUCTURED_FORMS, artifact_path=KNOWLEDGE_ARTIFACT_PATH
+)
+
+# Results of context-free knowledge lookups, per knowledge version
+response_cache = ResponseCache(max_size=setting('CHAT_RESPONSE_CACHE_SIZE', 1024))
+
+# Number of inverted-index candidates rescored with difflib per query (candidate_index option)
+CANDIDATE_LIMIT = 60
+
 # Keywords that might trigger structured question flows
 MEDICAL_TRIGGERS = [
     'pain', 'headache', 'stomach', 'fever', 'cough', 'symptom', 
@@ -19,8 +73,13 @@ MEDICAL_TRIGGERS = [
 class ConversationContext:
     """Maintains the state of a conversation with a user"""
 
-    def __init__(self):
+    # Bumped whenever to_dict() changes shape; stored contexts of another version are discarded
+    SCHEMA_VERSION = 1
+
+    def __init__(self, max_history=None):
         self.history = []  # List of (user_msg, system_response) tuples
+        # Oldest exchanges are dropped beyond this many (None or 0 keeps everything)
+        self.max_history = setting('CHAT_CONTEXT_MAX_HISTORY', 50) if max_history is None else max_history
         self.current_form = None  # Current structured form being filled
         self.form_data = {}  # Data collected from structured forms
         self.missing_info = []  # Information we still need to collect
@@ -28,6 +87,8 @@ class ConversationContext:
     def add_exchange(self, user_msg, system_response):
         """Add a message exchange to history"""
         self.history.append((user_msg, system_response))
+        if self.max_history and len(self.history) > self.max_history:
+            del self.history[:-self.max_history]
 
     def start_structured_form(self, form_type):
         """Start collecting structured information"""
@@ -71,63 +132,59 @@ class ConversationContext:
         """Get the recent conversation context"""
         return self.history[-num_messages:] if len(self.history) > 0 else []
 
+    def to_dict(self):
+        """Plain-data form of the context for shared context backends"""
+        return {
+            'v': self.SCHEMA_VERSION,
+            'history': [list(exchange) for exchange in self.history],
+            'max_history': self.max_history,
+            'current_form': self.current_form,
+            'form_data': self.form_data,
+            'missing_info': self.missing_info,
+        }
 
-def load_knowledge_base():
-    """Load the knowledge base from file"""
-    # Load regular knowledge base
-    with open(KNOWLEDGE_PATH, 'r', encoding='utf-8') as f:
-        entries = [line.strip() for line in f if line.strip()]
+    @classmethod
+    def from_dict(cls, data):
+        """Rebuild a context from to_dict() output; raises ValueError for other schema versions"""
+        if data.get('v') != cls.SCHEMA_VERSION:
+            raise ValueError(f"Unsupported context schema version {data.get('v')!r}")
+        context = cls(max_history=data['max_history'])
+        context.history = [tuple(exchange) for exchange in data['history']]
+        context.current_form = data['current_form']
+        context.form_data = data['form_data']
+        context.missing_info = data['missing_info']
+        return context
 
-    # Load ulcer-specific knowledge
-    try:
-        with open(ULCER_KNOWLEDGE_PATH, 'r', encoding='utf-8') as f:
-            ulcer_entries = [line.strip() for line in f if line.strip()]
-            entries.extend(ulcer_entries)
-    except FileNotFoundError:
-        pass  # If ulcer knowledge file doesn't exist, just use the regular knowledge base
 
-    return entries
+def load_knowledge_base():
+    """
+    Return the knowledge base entries.
+    Served from the in-memory store; the files are only re-read after they change.
+    """
+    return knowledge_store.get().entries
 
 
 def load_structured_forms():
-    """Load structured form definitions"""
-    try:
-        with open(STRUCTURED_FORMS_PATH, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Return default forms if file doesn't exist or is invalid
-        return {
-            "pain_assessment": {
-                "trigger_phrases": ["pain", "hurt", "ache", "sore"],
-                "questions": {
-                    "location": "Where exactly is the pain located?",
-                    "duration": "How long have you been experiencing this pain?",
-                    "intensity": "On a scale of 1-10, how would you rate the pain?",
-                    "characteristics": "How would you describe the pain? (sharp, dull, throbbing, etc.)"
-                },
-                "follow_up_template": "Based on your description of {intensity}/10 {characteristics} pain in the {location} for {duration}, I recommend..."
-            },
-            "symptom_assessment": {
-                "trigger_phrases": ["symptom", "fever", "cough", "dizzy", "nausea", "vomiting"],
-                "questions": {
-                    "main_symptom": "What is your main symptom?",
-                    "duration": "How long have you been experiencing these symptoms?",
-                    "severity": "How severe are your symptoms?",
-                    "other_symptoms": "Are you experiencing any other symptoms?"
-                },
-                "follow_up_template": "Based on your {severity} {main_symptom} for {duration}, along with {other_symptoms}, I suggest..."
-            }
-        }
+    """
+    Load structured form definitions
+    Served from the in-memory registry; the JSON file is only re-parsed after it changes.
+    """
+    return forms_store.get().forms
 
 
 def extract_questions():
     """
     Extracts possible questions from the knowledge base.
     Assumes each entry starts with a question (ends with '?') or is formatted as 'Q: ...'
+    Computed once per knowledge version.
     """
-    entries = load_knowledge_base()
+    return list(knowledge_store.get().derive('questions', build_questions))
+
+
+def build_questions(snapshot):
+    """Builder for KnowledgeSnapshot.derive(): the questions extract_questions() returns"""
     questions = []
-    for entry in entries:
+    for entry in snapshot.entries:
         # Try to extract question part
         match = re.match(r'(Q:)?\s*(.*?\?)', entry)
         if match:
@@ -137,7 +194,125 @@ def extract_questions():
             first_sentence = entry.split('.')[0]
             if len(first_sentence) > 10:
                 questions.append(first_sentence.strip())
-    return questions
+    return tuple(questions)
+
+
+class DifflibMatcher(Matcher):
+    """
+    The original engine: difflib character similarity plus context and phrase boosts.
+
+    By default every entry is considered, with pruning that provably returns what the
+    full scan returns. The `candidate_index` option only rescores the `candidate_limit`
+    (60) entries sharing the most indexed terms with the query (misspelt words included,
+    with `typo_tolerance`): faster on large knowledge bases, but phrase boosts match
+    substrings the index can't see, so answers may differ from the full scan.
+
+    With the `passages` option, queries are scored against the short units of the
+    compiled knowledge (see passages) and the best unit's whole passage is returned;
+    `passage_max_chars` (600) and `unit_max_chars` (160) bound their lengths.
+    """
+
+    name = 'difflib'
+
+    def compiled(self, snapshot):
+        max_chars = self.options.get('passage_max_chars', 600)
+        unit_max_chars = self.options.get('unit_max_chars', 160)
+        return snapshot.derive(
+            ('compiled_knowledge', max_chars, unit_max_chars),
+            lambda snapshot: compile_knowledge(snapshot, max_chars, unit_max_chars),
+        )
+
+    def entry_table(self, snapshot):
+        """The NormalizedEntry rows queries are scored against: entries, or passage units"""
+        if self.options.get('passages'):
+            compiled = self.compiled(snapshot)
+            return snapshot.derive(('passage_table', compiled.max_chars, compiled.unit_max_chars),
+                                   lambda snapshot: compiled.entry_table())
+        return snapshot.derive('entry_table', build_entry_table)
+
+    def inverted_index(self, snapshot):
+        """The inverted index over the rows of entry_table()"""
+        if self.options.get('passages'):
+            compiled = self.compiled(snapshot)
+            return snapshot.derive(('passage_index', compiled.max_chars, compiled.unit_max_chars),
+                                   lambda snapshot: compiled.inverted_index())
+        return snapshot.derive('inverted_index', build_inverted_index)
+
+    def match(self, snapshot, query, threshold=0.5, context_boost=None):
+        context_boost = context_boost or {}
+
+        # With candidate_index, only the top lexical candidates from the inverted index go
+        # through difflib; queries sharing no indexed term with any entry still get the full scan
+        entry_ids = self.candidate_ids(snapshot, query, context_boost)
+        table = self.entry_table(snapshot)
+        if entry_ids:
+            entry_ids.sort()
+            candidates = [table[entry_id] for entry_id in entry_ids]
+        else:
+            candidates = table
+
+        return score_entries(
+            QueryPlan(query, context_boost), candidates, threshold, prune=self.options.get('prune', True)
+        )
+
+    def candidate_ids(self, snapshot, query, context_boost):
+        """Row ids of entry_table() to rescore for a query, or None for a full scan"""
+        if not self.options.get('candidate_index'):
+            return None
+        index = self.inverted_index(snapshot)
+        terms = index_terms(query) + tokenize(' '.join(context_boost))
+        if self.options.get('typo_tolerance', True):
+            # Misspelt words ("ulser") also look up the indexed words they were probably meant to be
+            typos = self.typo_index(snapshot)
+            for term in tokenize(query):
+                if term not in index.postings:
+                    terms.extend(typos.corrections(term))
+        return index.candidates(terms, self.options.get('candidate_limit', CANDIDATE_LIMIT)) or None
+
+    def typo_index(self, snapshot):
+        options = {
+            name: self.options[f'typo_{name}']
+            for name in ('num_perm', 'bands', 'threshold', 'max_corrections')
+            if f'typo_{name}' in self.options
+        }
+        key = ('typo_index',) + tuple(sorted(options.items()))
+        return snapshot.derive(key, lambda snapshot: build_typo_index(snapshot, **options))
+
+    def match_many(self, snapshot, queries, threshold=0.5, context_boosts=None):
+        """
+        match() for each query, sharing the entry table and index lookups. Every query
+        goes through the same bound-sorted score_entries() as match(), so a batch is
+        never slower than single calls and ties resolve identically.
+        """
+        context_boosts = context_boosts or [{}] * len(queries)
+        table = self.entry_table(snapshot)
+        prune = self.options.get('prune', True)
+
+        results = []
+        for query, boost in zip(queries, context_boosts):
+            boost = boost or {}
+            entry_ids = self.candidate_ids(snapshot, query, boost)
+            candidates = [table[entry_id] for entry_id in sorted(entry_ids)] if entry_ids else table
+            results.append(score_entries(QueryPlan(query, boost), candidates, threshold, prune=prune))
+        return results
+
+
+# Engines selectable with the CHAT_MATCHER setting
+MATCHERS = {matcher.name: matcher for matcher in (DifflibMatcher, BM25Matcher, TfidfMatcher, VectorMatcher)}
+_matcher_instances = {}
+
+
+def get_matcher():
+    """Return the engine configured by CHAT_MATCHER / CHAT_MATCHER_OPTIONS"""
+    name = setting('CHAT_MATCHER', 'difflib')
+    options = setting('CHAT_MATCHER_OPTIONS', {})
+    key = (name, tuple(sorted(options.items())))
+    matcher = _matcher_instances.get(key)
+    if matcher is None:
+        if name not in MATCHERS:
+            raise ImproperlyConfigured(f"Unknown CHAT_MATCHER {name!r}; expected one of {sorted(MATCHERS)}")
+        matcher = _matcher_instances[key] = MATCHERS[name](**options)
+    return matcher
 
 
 def find_best_match(query, threshold=0.5, context=None):
@@ -145,40 +320,162 @@ def find_best_match(query, threshold=0.5, context=None):
     Find the best matching response from the knowledge base
     Enhanced with context awareness
     """
-    knowledge_entries = load_knowledge_base()
+    snapshot = knowledge_store.get()
+    matcher = get_matcher()
+    context_boost = get_context_boost(context)
+
+    # Context boosts can change the winner, so only context-free lookups are cached
+    if context_boost:
+        return matcher.match(snapshot, query, threshold, context_boost)
+
+    key = (matcher.key(), threshold, normalize_query(query))
+    result = response_cache.get(snapshot.version, key)
+    if result is MISSING:
+        result = matcher.match(snapshot, query, threshold)
+        response_cache.put(snapshot.version, key, result)
+    return result
+
+
+def find_best_matches(queries, threshold=0.5, contexts=None):
+    """
+    find_best_match() for many queries at once, with identical results.
+    Repeated (query, context) pairs are scored once, and the engine scores the rest together.
+    """
+    snapshot = knowledge_store.get()
+    contexts = contexts or [None] * len(queries)
+    boosts = [get_context_boost(context) for context in contexts]
+    keys = [(query, tuple(boost.items())) for query, boost in zip(queries, boosts)]
+
+    unique = {}
+    for key, boost in zip(keys, boosts):
+        unique.setdefault(key, boost)
+    unique_keys = list(unique)
+
+    results = get_matcher().match_many(snapshot, [query for query, _ in unique_keys], threshold, list(unique.values()))
+    by_key = dict(zip(unique_keys, results))
+    return [by_key[key] for key in keys]
 
-    # Use context to improve matching if available
+
+def get_context_boost(context):
+    """Keywords from the recent conversation that boost entries containing them"""
     context_boost = {}
     if context and context.history:
         # Extract keywords from recent conversation
         recent_msgs = ' '.join([msg for msg, _ in context.history[-3:]])
         # Simple keyword extraction - could be enhanced
-        words = re.findall(r'\w{4,}', recent_msgs.lower())
+        words = re.findall(r'\w{4,}', recent_msgs.lower())
         for word in words:
             context_boost[word] = 0.1  # Boost entries containing recent keywords
+    return context_boost
+
+
+class QueryPlan:
+    """
+    A query compiled for the scoring loop.
+    Everything that depends only on the query and conversation context is
+    worked out once here, so scoring an entry does no per-entry preparation.
+    """
+
+    def __init__(self, query, context_boost=None):
+        self.query = query
+        self.query_lower = query.lower()
+        self.context_boost = list((context_boost or {}).items())
+        self.phrases = [phrase.lower() for phrase in extract_key_phrases(query) if len(phrase) > 3]
 
-    # Use difflib to get close matches
-    best_match = None
-    best_score = 0.0
+    def boosts(self, entry_lower):
+        """The context and phrase boosts an entry earns, in the order score() adds them"""
+        boosts = [boost for keyword, boost in self.context_boost if keyword in entry_lower]
+        boosts.extend(0.15 for phrase in self.phrases if phrase in entry_lower)  # Substantial boost for phrase matches
+        return boosts
 
-    for entry in knowledge_entries:
-        # Base score from string similarity
-        score = difflib.SequenceMatcher(None, query.lower(), entry.lower()).ratio()
+    def matcher_for(self, normalized, matcher=None):
+        """
+        The entry's matcher with this query as its first sequence.
+        `matcher` may be a private copy of the entry's matcher, reused across queries.
+        """
+        if matcher is None:
+            # Shallow copy shares the entry's prebuilt difflib tables and keeps this thread-safe
+            matcher = copy.copy(normalized.matcher)
+        matcher.set_seq1(self.query_lower)
+        return matcher
 
-        # Apply context boost
-        for keyword, boost in context_boost.items():
-            if keyword in entry.lower():
-                score += boost
+    def score(self, normalized, matcher=None):
+        """Score one NormalizedEntry: difflib similarity plus context and phrase boosts"""
+        matcher = self.matcher_for(normalized, matcher)
+        return add_boosts(matcher.ratio(), self.boosts(normalized.lower))
 
-        # Check for exact phrase matches for higher precision
-        phrases = extract_key_phrases(query)
-        for phrase in phrases:
-            if len(phrase) > 3 and phrase.lower() in entry.lower():
-                score += 0.15  # Substantial boost for phrase matches
 
-        if score > best_score:
-            best_score = score
-            best_match = entry
+def add_boosts(score, boosts):
+    for boost in boosts:
+        score += boost
+    return score
+
+
+# Pruning never changes a result. For one entry, real_quick_ratio() >= quick_ratio() >= ratio():
+# all three are 2*M/T for the same T, with M an upper bound on the matched characters that only
+# tightens. Float division and each addition of the same boost, in the same order, are monotone
+# under IEEE rounding, so add_boosts(bound, boosts) >= add_boosts(ratio(), boosts) == score().
+# An entry is skipped only when that bound can't beat the current best under the original rule:
+# the highest score wins and ties go to the earlier entry.
+
+
+def length_ratio(query_length, entry_length):
+    """SequenceMatcher.real_quick_ratio() from the two lengths alone, computed the same way"""
+    total = query_length + entry_length
+    return 2.0 * min(query_length, entry_length) / total if total else 1.0
+
+
+def score_entries(plan, normalized_entries, threshold, prune=True):
+    """
+    Return the best of the given entries for a QueryPlan, or None below the threshold.
+    With `prune`, entries are visited in order of their real_quick_ratio() upper bound,
+    skipped when their quick_ratio() bound can't win, and scoring stops once no remaining
+    bound can beat the best so far; the result is the same as scoring every entry in order.
+    """
+    if not prune:
+        best_match = None
+        best_score = 0.0
+
+        for normalized in normalized_entries:
+            score = plan.score(normalized)
+            if score > best_score:
+                best_score = score
+                best_match = normalized.text
+    else:
+        # First bound: real_quick_ratio(), which needs only the lengths, so no matcher
+        # is prepared for entries that can't win on length alone
+        query_length = len(plan.query_lower)
+        bounded = []
+        for position, normalized in enumerate(normalized_entries):
+            boosts = plan.boosts(normalized.lower)
+            bound = length_ratio(query_length, len(normalized.lower))
+            bounded.append((add_boosts(bound, boosts), position, normalized, boosts))
+        # Strongest bounds first; equal bounds in entry order
+        bounded.sort(key=lambda item: (-item[0], item[1]))
+
+        best_match = None
+        best_score = 0.0
+        best_position = None
+
+        def cannot_win(bound, position):
+            # Below the best, or at best a tie with an earlier entry
+            return bound < best_score or (
+                bound == best_score and (best_position is None or position > best_position)
+            )
+
+        for bound, position, normalized, boosts in bounded:
+            if bound < best_score:
+                break  # Sorted: nothing after this can win either
+            if cannot_win(bound, position):
+                continue
+            matcher = plan.matcher_for(normalized)
+            if cannot_win(add_boosts(matcher.quick_ratio(), boosts), position):
+                continue
+            score = add_boosts(matcher.ratio(), boosts)
+            if score > best_score or (score == best_score and best_position is not None and position < best_position):
+                best_score = score
+                best_match = normalized.text
+                best_position = position
 
     if best_score >= threshold:
         return best_match, best_score
@@ -211,20 +508,9 @@ def check_needs_structured_form(user_message, context):
     if context and context.current_form:
         return None
 
-    # Load form definitions
-    forms = load_structured_forms()
-
-    # Check for trigger phrases in each form
-    message_lower = user_message.lower()
-
-    for form_type, form_def in forms.items():
-        trigger_phrases = form_def.get('trigger_phrases', [])
-        for phrase in trigger_phrases:
-            if phrase.lower() in message_lower:
-                return form_type
-
-    # No triggers found
-    return None
+    # One pass over the message with every form's trigger phrases compiled together;
+    # the earliest form (in definition order) with a matching phrase wins
+    return forms_store.get().match_trigger(user_message.lower())
 
 
 def process_structured_form_input(user_message, context):
@@ -387,9 +673,26 @@ def generate_ulcer_lifestyle_response(form_data):
     return response
 
 
-# Global dictionary to store conversation contexts
-contexts = {}
+def build_context_backend():
+    """Create the conversation context store selected by CHAT_CONTEXT_BACKEND"""
+    backend = setting('CHAT_CONTEXT_BACKEND', 'memory')
+    idle_ttl = setting('CHAT_CONTEXT_IDLE_TTL', 3600)
+    purge_interval = setting('CHAT_CONTEXT_PURGE_INTERVAL', 300)
+    if backend == 'memory':
+        # Bounded by session count and idle time; only visible to this process
+        return ContextStore(max_sessions=setting('CHAT_CONTEXT_MAX_SESSIONS', 10000), idle_ttl=idle_ttl)
+    if backend == 'database':
+        return DatabaseContextBackend(ConversationContext, idle_ttl=idle_ttl, purge_interval=purge_interval)
+    if backend == 'file':
+        directory = setting('CHAT_CONTEXT_DIR', os.path.join(tempfile.gettempdir(), 'chat_contexts'))
+        return FileContextBackend(directory, ConversationContext, idle_ttl=idle_ttl, purge_interval=purge_interval)
+    raise ImproperlyConfigured(f"Unknown CHAT_CONTEXT_BACKEND {backend!r}; expected 'memory', 'database' or 'file'")
+
+
+# Conversation contexts for all sessions
+contexts = build_context_backend()
 
+@profile_slow_calls
 def process_message(user_message, session_id=None, contexts_dict=None):
     """
     Process a user message, using session context if available
@@ -399,35 +702,159 @@ def process_message(user_message, session_id=None, contexts_dict=None):
     if contexts_dict is None:
         contexts_dict = contexts
 
-    if session_id not in contexts_dict:
-        contexts_dict[session_id] = ConversationContext()
+    # A single get() so a bounded store can't evict the context between check and use
+    with metrics.stage('context_get'):
+        context = contexts_dict.get(session_id)
+    if context is None:
+        context = ConversationContext()
+
+    response, is_structured_form = respond(user_message, context)
+
+    # Store the context back so shared backends persist the updated state
+    with metrics.stage('context_put'):
+        contexts_dict[session_id] = context
+    return response, is_structured_form
+
+
+def respond(user_message, context):
+    """
+    Produce the reply to one message and record the exchange on the context
+    Returns (response, is_structured_form_question)
+    """
+    stream = respond_stream(user_message, context)
+    is_structured_form = next(stream)
+    return ''.join(stream), is_structured_form
+
+
+def respond_stream(user_message, context):
+    """
+    Generator form of respond(): yields is_structured_form_question first, then the
+    response text in sentence-sized segments that join back into the full response.
+    The flag is yielded before knowledge-base matching, the slow part, starts.
+    """
+    form_response = form_reply(user_message, context)
+    if form_response:
+        with metrics.stage('response'):
+            context.add_exchange(user_message, form_response)
+            segments = split_segments(form_response)
+        yield True
+        yield from segments
+        return
+
+    # Knowledge-base answers are never form questions
+    yield False
+
+    # Otherwise, find a matching response from knowledge base
+    with metrics.stage('match'):
+        best_match, best_score = find_best_match(user_message, threshold=0.5, context=context)
 
-    context = contexts_dict[session_id]
+    with metrics.stage('response'):
+        response = knowledge_reply(best_match)
+        context.add_exchange(user_message, response)
+        segments = split_segments(response)
+    yield from segments
 
+
+def form_reply(user_message, context):
+    """The structured form question or result answering a message, or None if the knowledge base should"""
     # If we're in a structured form, process input for it
     if context.current_form:
-        form_response = process_structured_form_input(user_message, context)
+        with metrics.stage('form_input'):
+            form_response = process_structured_form_input(user_message, context)
         if form_response:
-            context.add_exchange(user_message, form_response)
-            return form_response, True
+            return form_response
 
     # Check if we need to switch to a structured form
-    form_type = check_needs_structured_form(user_message, context)
+    with metrics.stage('form_check'):
+        form_type = check_needs_structured_form(user_message, context)
     if form_type:
         context.start_structured_form(form_type)
-        next_question = context.get_next_question()
-        if next_question:
-            context.add_exchange(user_message, next_question)
-            return next_question, True
+        return context.get_next_question()
+    return None
 
-    # Otherwise, find a matching response from knowledge base
-    best_match, best_score = find_best_match(user_message, threshold=0.5, context=context)
 
+def knowledge_reply(best_match):
     if best_match:
-        response = best_match
-    else:
-        response = "Sorry, I couldn't find a relevant answer. Could you provide more details or ask another question?"
+        return best_match
+    return "Sorry, I couldn't find a relevant answer. Could you provide more details or ask another question?"
+
 
-    context.add_exchange(user_message, response)
-    return response, False
+# Split points: after sentence punctuation, before the whitespace that follows it
+SEGMENT_BOUNDARY = re.compile(r'(?<=[.!?])(?=\s)')
+
+
+def split_segments(text):
+    """Split a response into sentence-sized pieces whose concatenation is the original text"""
+    return [segment for segment in SEGMENT_BOUNDARY.split(text) if segment]
+
+
+def process_message_stream(user_message, session_id=None, contexts_dict=None):
+    """
+    Streaming form of process_message(): yields is_structured_form_question, then
+    the response segments. The context is stored back once the stream is finished
+    or closed.
+    """
+    if contexts_dict is None:
+        contexts_dict = contexts
+
+    context = contexts_dict.get(session_id)
+    if context is None:
+        context = ConversationContext()
+
+    try:
+        yield from respond_stream(user_message, context)
+    finally:
+        contexts_dict[session_id] = context
+
+
+def process_messages(items, contexts_dict=None):
+    """
+    Process a batch of (session_id, user_message) pairs.
+    Messages of one session run in order. The batch goes in rounds of at most one
+    message per session, and each round's knowledge-base lookups are scored together
+    with find_best_matches().
+    Returns [(response, is_structured_form_question)] in input order.
+    """
+    if contexts_dict is None:
+        contexts_dict = contexts
 
+    by_session = defaultdict(list)
+    for position, (session_id, user_message) in enumerate(items):
+        by_session[session_id].append((position, user_message))
+
+    session_contexts = {}
+    with metrics.stage('context_get'):
+        for session_id in by_session:
+            context = contexts_dict.get(session_id)
+            session_contexts[session_id] = context if context is not None else ConversationContext()
+
+    results = [None] * len(items)
+    rounds = max((len(messages) for messages in by_session.values()), default=0)
+    for turn in range(rounds):
+        lookups = []
+        for session_id, messages in by_session.items():
+            if turn < len(messages):
+                position, user_message = messages[turn]
+                context = session_contexts[session_id]
+                form_response = form_reply(user_message, context)
+                if form_response:
+                    context.add_exchange(user_message, form_response)
+                    results[position] = (form_response, True)
+                else:
+                    lookups.append((position, user_message, context))
+
+        if lookups:
+            with metrics.stage('match'):
+                matches = find_best_matches(
+                    [user_message for _, user_message, _ in lookups], 0.5, [context for _, _, context in lookups]
+                )
+            for (position, user_message, context), (best_match, _) in zip(lookups, matches):
+                response = knowledge_reply(best_match)
+                context.add_exchange(user_message, response)
+                results[position] = (response, False)
+
+    # Store the contexts back so shared backends persist the updated state
+    with metrics.stage('context_put'):
+        for session_id, context in session_contexts.items():
+            contexts_dict[session_id] = context
+    return results
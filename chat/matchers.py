@@ -0,0 +1,279 @@
+import math
+from collections import Counter
+
+from django.core.exceptions import ImproperlyConfigured
+
+from . import vector_index
+from .knowledge_index import build_entry_table, tokenize
+
+try:
+    # Optional: vectorized scoring with sparse matrices
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = None
+    sparse = None
+
+
+class Matcher:
+    """
+    Interface for knowledge-base matching engines.
+    An engine picks the best entry of a knowledge snapshot for a query and
+    returns (entry, score), or (None, best_score) when nothing reaches the threshold.
+    """
+
+    name = None
+
+    def __init__(self, **options):
+        self.options = options
+
+    def key(self):
+        """Identifies the engine and its options, e.g. for caching its results"""
+        return (self.name,) + tuple(sorted(self.options.items()))
+
+    def match(self, snapshot, query, threshold=0.5, context_boost=None):
+        raise NotImplementedError
+
+    def match_many(self, snapshot, queries, threshold=0.5, context_boosts=None):
+        """match() for each query; engines override this to score queries together"""
+        context_boosts = context_boosts or [None] * len(queries)
+        return [
+            self.match(snapshot, query, threshold, boost)
+            for query, boost in zip(queries, context_boosts)
+        ]
+
+
+class TermMatrix:
+    """
+    Entry x term weight matrix.
+    Uses a SciPy CSR matrix when available, otherwise per-term postings, so a
+    query costs one sparse dot product either way.
+    """
+
+    def __init__(self, rows, vocabulary):
+        self.vocabulary = vocabulary
+        self.size = len(rows)
+        if sparse is not None:
+            data, indices, indptr = [], [], [0]
+            for row in rows:
+                for column, weight in sorted(row.items()):
+                    indices.append(column)
+                    data.append(weight)
+                indptr.append(len(indices))
+            self.matrix = sparse.csr_matrix(
+                (np.array(data, dtype=np.float64), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                shape=(len(rows), max(len(vocabulary), 1)),
+            )
+        else:
+            self.matrix = None
+            self.postings = [[] for _ in vocabulary]
+            for entry_id, row in enumerate(rows):
+                for column, weight in row.items():
+                    self.postings[column].append((entry_id, weight))
+
+    def dot(self, query_weights):
+        """Return [(entry_id, score)] for every entry with a non-zero score, in entry order"""
+        if not query_weights:
+            return []
+        if self.matrix is not None:
+            vector = np.zeros(self.matrix.shape[1])
+            for column, weight in query_weights.items():
+                vector[column] = weight
+            scores = self.matrix @ vector
+            return [(int(entry_id), float(scores[entry_id])) for entry_id in np.flatnonzero(scores)]
+
+        scores = {}
+        for column, query_weight in query_weights.items():
+            for entry_id, weight in self.postings[column]:
+                scores[entry_id] = scores.get(entry_id, 0.0) + weight * query_weight
+        return sorted(scores.items())
+
+    def dot_many(self, queries_weights):
+        """dot() for several queries; with SciPy this is one sparse x dense matrix product"""
+        if self.matrix is None:
+            return [self.dot(query_weights) for query_weights in queries_weights]
+        block = np.zeros((self.matrix.shape[1], len(queries_weights)))
+        for position, query_weights in enumerate(queries_weights):
+            for column, weight in query_weights.items():
+                block[column, position] = weight
+        scores = self.matrix @ block
+        results = []
+        for position in range(len(queries_weights)):
+            column_scores = scores[:, position]
+            results.append([(int(entry_id), float(column_scores[entry_id])) for entry_id in np.flatnonzero(column_scores)])
+        return results
+
+
+class TermStatistics:
+    """Per-entry term frequencies, lengths and document frequencies of a snapshot"""
+
+    def __init__(self, entries):
+        self.term_counts = [Counter(tokenize(entry)) for entry in entries]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        self.vocabulary = {}
+        document_frequency = Counter()
+        for counts in self.term_counts:
+            for term in counts:
+                self.vocabulary.setdefault(term, len(self.vocabulary))
+            document_frequency.update(counts.keys())
+        self.document_frequency = document_frequency
+
+
+class RankingMatcher(Matcher):
+    """Base for engines that score all entries at once through a TermMatrix"""
+
+    def build(self, snapshot):
+        raise NotImplementedError
+
+    def query_weights(self, model, counts):
+        raise NotImplementedError
+
+    def match(self, snapshot, query, threshold=0.5, context_boost=None):
+        return self.match_many(snapshot, [query], threshold, [context_boost])[0]
+
+    def match_many(self, snapshot, queries, threshold=0.5, context_boosts=None):
+        model = snapshot.derive(self.key(), self.build)
+        table = snapshot.derive('entry_table', build_entry_table)
+        context_boosts = context_boosts or [None] * len(queries)
+        weights = [self.query_weights(model, Counter(tokenize(query))) for query in queries]
+
+        results = []
+        for scored, context_boost in zip(model['matrix'].dot_many(weights), context_boosts):
+            best_match = None
+            best_score = 0.0
+            for entry_id, score in scored:
+                if context_boost:
+                    entry_lower = table[entry_id].lower
+                    for keyword, boost in context_boost.items():
+                        if keyword in entry_lower:
+                            score += boost
+                if score > best_score:
+                    best_score = score
+                    best_match = snapshot.entries[entry_id]
+            results.append((best_match, best_score) if best_score >= threshold else (None, best_score))
+        return results
+
+
+class BM25Matcher(RankingMatcher):
+    """
+    Okapi BM25 over precomputed term statistics.
+    Scores are divided by the query's maximum attainable BM25 score so they
+    land in [0, 1) and share the difflib engine's threshold scale.
+    """
+
+    name = 'bm25'
+
+    def build(self, snapshot):
+        k1 = self.options.get('k1', 1.5)
+        b = self.options.get('b', 0.75)
+        statistics = snapshot.derive('term_statistics', lambda s: TermStatistics(s.entries))
+        size = len(statistics.term_counts)
+        idf = {
+            term: math.log(1 + (size - df + 0.5) / (df + 0.5))
+            for term, df in statistics.document_frequency.items()
+        }
+        rows = []
+        for counts, length in zip(statistics.term_counts, statistics.lengths):
+            norm = k1 * (1 - b + b * length / statistics.average_length) if statistics.average_length else k1
+            rows.append({
+                statistics.vocabulary[term]: idf[term] * tf * (k1 + 1) / (tf + norm)
+                for term, tf in counts.items()
+            })
+        return {'matrix': TermMatrix(rows, statistics.vocabulary), 'idf': idf, 'k1': k1}
+
+    def query_weights(self, model, counts):
+        vocabulary = model['matrix'].vocabulary
+        ceiling = sum(model['idf'].get(term, 0.0) * (model['k1'] + 1) * count for term, count in counts.items())
+        if not ceiling:
+            return {}
+        return {vocabulary[term]: count / ceiling for term, count in counts.items() if term in vocabulary}
+
+
+class TfidfMatcher(RankingMatcher):
+    """Cosine similarity between log-scaled, L2-normalized TF-IDF vectors"""
+
+    name = 'tfidf'
+
+    def build(self, snapshot):
+        statistics = snapshot.derive('term_statistics', lambda s: TermStatistics(s.entries))
+        size = len(statistics.term_counts)
+        idf = {
+            term: math.log((1 + size) / (1 + df)) + 1
+            for term, df in statistics.document_frequency.items()
+        }
+        rows = [self._normalize({
+            statistics.vocabulary[term]: (1 + math.log(tf)) * idf[term]
+            for term, tf in counts.items()
+        }) for counts in statistics.term_counts]
+        return {'matrix': TermMatrix(rows, statistics.vocabulary), 'idf': idf}
+
+    def query_weights(self, model, counts):
+        vocabulary = model['matrix'].vocabulary
+        return self._normalize({
+            vocabulary[term]: (1 + math.log(count)) * model['idf'][term]
+            for term, count in counts.items() if term in vocabulary
+        })
+
+    @staticmethod
+    def _normalize(row):
+        norm = math.sqrt(sum(weight * weight for weight in row.values()))
+        if not norm:
+            return row
+        return {column: weight / norm for column, weight in row.items()}
+
+
+class VectorMatcher(Matcher):
+    """
+    Cosine similarity of hashed character/word n-gram embeddings, searched with a
+    random-projection ANN index. Embeddings are memory-mapped from a .npy file per
+    knowledge version (see vector_index). Needs NumPy.
+
+    Options: dim (512); tables (32), bits (12) and probes (True) for the ANN index; exact_below
+    (5000): knowledge bases smaller than this are searched exactly, which is faster there.
+    """
+
+    name = 'vector'
+
+    def __init__(self, **options):
+        if vector_index.np is None:
+            raise ImproperlyConfigured("The 'vector' matcher requires NumPy")
+        super().__init__(**options)
+
+    def build(self, snapshot):
+        vectors = vector_index.load_entry_vectors(snapshot, self.options.get('dim', 512))
+        if len(vectors) < self.options.get('exact_below', 5000):
+            return vector_index.ExactIndex(vectors)
+        return vector_index.RandomProjectionIndex(
+            vectors,
+            tables=self.options.get('tables', 32),
+            bits=self.options.get('bits', 12),
+            probes=self.options.get('probes', True),
+        )
+
+    def match(self, snapshot, query, threshold=0.5, context_boost=None):
+        return self.match_many(snapshot, [query], threshold, [context_boost])[0]
+
+    def match_many(self, snapshot, queries, threshold=0.5, context_boosts=None):
+        index = snapshot.derive(self.key(), self.build)
+        table = snapshot.derive('entry_table', build_entry_table)
+        context_boosts = context_boosts or [None] * len(queries)
+        vectors = vector_index.embed(queries, index.vectors.shape[1])
+
+        results = []
+        for vector, context_boost in zip(vectors, context_boosts):
+            best_match = None
+            best_score = 0.0
+            # With context boosts a lower-ranked neighbour can still win, so look at a few
+            k = 10 if context_boost else 1
+            for entry_id, score in index.search(vector, k):
+                if context_boost:
+                    entry_lower = table[entry_id].lower
+                    for keyword, boost in context_boost.items():
+                        if keyword in entry_lower:
+                            score += boost
+                if score > best_score:
+                    best_score = score
+                    best_match = snapshot.entries[entry_id]
+            results.append((best_match, best_score) if best_score >= threshold else (None, best_score))
+        return results
@@ -0,0 +1,164 @@
+import time
+import threading
+from contextlib import nullcontext
+from contextvars import ContextVar
+
+from .conf import setting
+
+# Upper bounds, in seconds, of the stage latency histogram buckets
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+# Per-request list of (stage, seconds) collected for the Server-Timing header, when enabled
+request_timings = ContextVar('chat_request_timings', default=None)
+
+_NOT_TIMED = nullcontext()
+
+
+class StageHistogram:
+    """Cumulative latency histogram of one process_message stage"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+                break
+        self.count += 1
+        self.sum += seconds
+
+
+class StageTimer:
+    __slots__ = ('registry', 'stage', 'collector', 'start')
+
+    def __init__(self, registry, stage, collector):
+        self.registry = registry
+        self.stage = stage
+        self.collector = collector
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        if self.registry is not None:
+            self.registry.observe(self.stage, elapsed)
+        if self.collector is not None:
+            self.collector.append((self.stage, elapsed))
+        return False
+
+
+class MetricsRegistry:
+    """
+    In-process stage timings for the chat engine.
+    Nothing is timed unless CHAT_METRICS is on or the current request collects
+    Server-Timing entries; otherwise stage() hands back a shared no-op context.
+    Each worker process keeps its own numbers.
+    """
+
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name):
+        """Context manager timing one stage of message processing"""
+        collector = request_timings.get()
+        registry = self if setting('CHAT_METRICS', False) else None
+        if registry is None and collector is None:
+            return _NOT_TIMED
+        return StageTimer(registry, name, collector)
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = StageHistogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """{stage: (bucket counts, count, sum)} copied under the lock"""
+        with self._lock:
+            return {
+                stage: (list(histogram.counts), histogram.count, histogram.sum)
+                for stage, histogram in self._stages.items()
+            }
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+
+
+metrics = MetricsRegistry()
+
+
+def format_server_timing(timings):
+    """Server-Timing header value; repeated stages are summed, in first-seen order"""
+    totals = {}
+    for stage, seconds in timings:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f"{stage};dur={seconds * 1000:.2f}" for stage, seconds in totals.items())
+
+
+def render_prometheus(registry, gauges):
+    """
+    Prometheus text exposition (version 0.0.4) of the stage histograms plus
+    gauges given as (name, type, help, value) tuples.
+    """
+    lines = []
+    samples = []
+    for stage, (counts, count, total) in sorted(registry.snapshot().items()):
+        cumulative = 0
+        for bound, bucket_count in zip(STAGE_BUCKETS, counts):
+            cumulative += bucket_count
+            samples.append((f'_bucket{{stage="{stage}",le="{bound}"}}', cumulative))
+        samples.append((f'_bucket{{stage="{stage}",le="+Inf"}}', count))
+        samples.append((f'_sum{{stage="{stage}"}}', total))
+        samples.append((f'_count{{stage="{stage}"}}', count))
+    lines.append("# HELP chat_stage_seconds Time spent in each stage of process_message")
+    lines.append("# TYPE chat_stage_seconds histogram")
+    lines.extend(f"chat_stage_seconds{suffix} {value}" for suffix, value in samples)
+
+    for name, kind, help_text, value in gauges:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.append(f"{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+
+def engine_gauges():
+    """Current knowledge, context store and response cache figures as (name, type, help, value)"""
+    # Imported here: the engine itself imports this module for its stage timers
+    from . import manual_engine
+
+    gauges = [
+        ('chat_knowledge_reloads_total', 'counter', "Knowledge base (re)loads in this process",
+         manual_engine.knowledge_store.reload_count),
+        ('chat_forms_reloads_total', 'counter', "Structured form definition (re)loads in this process",
+         manual_engine.forms_store.reload_count),
+    ]
+
+    context_stats = manual_engine.contexts.stats()
+    gauges.append(('chat_context_sessions', 'gauge', "Conversation contexts held by the context store",
+                   context_stats['sessions']))
+    if 'evictions' in context_stats:
+        gauges.append(('chat_context_evictions_total', 'counter', "Contexts evicted to respect the session cap",
+                       context_stats['evictions']))
+        gauges.append(('chat_context_expirations_total', 'counter', "Contexts dropped after their idle TTL",
+                       context_stats['expirations']))
+        gauges.append(('chat_context_bytes', 'gauge', "Approximate memory held by stored conversations",
+                       context_stats['approximate_bytes']))
+
+    cache_stats = manual_engine.response_cache.stats()
+    gauges.extend([
+        ('chat_response_cache_entries', 'gauge', "Entries in the response cache", cache_stats['size']),
+        ('chat_response_cache_hits_total', 'counter', "Response cache hits", cache_stats['hits']),
+        ('chat_response_cache_misses_total', 'counter', "Response cache misses", cache_stats['misses']),
+        ('chat_response_cache_hit_ratio', 'gauge', "Response cache hits per lookup", cache_stats['hit_rate']),
+        ('chat_response_cache_evictions_total', 'counter', "Response cache LRU evictions", cache_stats['evictions']),
+    ])
+    return gauges
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationState',
+            fields=[
+                ('session_id', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('data', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_conversationstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='report',
+            index=models.Index(fields=['user', '-created_at'], name='chat_report_user_created'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:04
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_report_user_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PdfJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_updated_at', models.DateTimeField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('report', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pdf_jobs', to='chat.report')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='chat_pdfjob_queue')],
+                'constraints': [models.UniqueConstraint(fields=('report', 'report_updated_at'), name='chat_pdfjob_report_version')],
+            },
+        ),
+    ]
@@ -16,6 +16,56 @@ class Report(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Per-user listings, newest first (reports page, dashboard, keyset pagination)
+            models.Index(fields=['user', '-created_at'], name='chat_report_user_created'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
+
+
+class ConversationState(models.Model):
+    """Serialized ConversationContext, shared by all workers when CHAT_CONTEXT_BACKEND is 'database'"""
+    session_id = models.CharField(max_length=64, primary_key=True)
+    data = models.TextField()
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    def __str__(self):
+        return self.session_id
+
+
+class PdfJob(models.Model):
+    """
+    Queued PDF rendering of one version of a report. Workers claim pending jobs by
+    flipping their status in a single UPDATE, so any process can run them safely.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    report = models.ForeignKey(Report, on_delete=models.CASCADE, related_name='pdf_jobs')
+    report_updated_at = models.DateTimeField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['report', 'report_updated_at'], name='chat_pdfjob_report_version'),
+        ]
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='chat_pdfjob_queue'),
+        ]
+
+    def __str__(self):
+        return f"PDF of report {self.report_id} ({self.status})"
@@ -0,0 +1,121 @@
+import re
+from collections import namedtuple
+
+from .knowledge_index import InvertedIndex, NormalizedEntry
+
+# Section titles: markdown headings, short numbered titles and ALL-CAPS lines
+HEADING_RE = re.compile(
+    r'^(?:#+\s*(?P<markdown>.+)'
+    r'|(?P<numbered>\d+\.\s+[^.!?:]{1,60})'
+    r'|(?P<caps>[A-Z][A-Z0-9 ()&/,\'-]{3,}))$'
+)
+
+# Split points inside a long line: after sentence punctuation, before the whitespace that follows it
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?;])\s+')
+
+Passage = namedtuple('Passage', 'text heading')
+Unit = namedtuple('Unit', 'text passage_id')
+
+
+def heading_of(line):
+    """The title of a heading line, or None if the line is content"""
+    match = HEADING_RE.match(line)
+    if match is None:
+        return None
+    return (match.group('markdown') or match.group('numbered') or match.group('caps')).strip()
+
+
+def pack(pieces, max_chars, separator):
+    """Join consecutive pieces into chunks of at most max_chars; a longer piece is a chunk of its own"""
+    chunks = []
+    current = []
+    length = 0
+    for piece in pieces:
+        added = len(piece) + (len(separator) if current else 0)
+        if current and length + added > max_chars:
+            chunks.append(separator.join(current))
+            current, length = [], 0
+            added = len(piece)
+        current.append(piece)
+        length += added
+    if current:
+        chunks.append(separator.join(current))
+    return chunks
+
+
+def split_units(line, max_chars):
+    """A line cut into units of at most max_chars, at sentence ends where possible, else between words"""
+    if len(line) <= max_chars:
+        return [line]
+    sentences = []
+    for sentence in SENTENCE_BOUNDARY.split(line):
+        if len(sentence) <= max_chars:
+            sentences.append(sentence)
+        else:
+            sentences.extend(pack(sentence.split(), max_chars, ' '))
+    return pack(sentences, max_chars, ' ')
+
+
+class CompiledKnowledge:
+    """
+    The knowledge files compiled into passages and scoring units.
+
+    A passage is a run of consecutive non-blank lines (a paragraph, a list, a
+    question with its answer) of at most `max_chars`, labelled with the heading
+    of the section it sits in; it is what a match returns. Each of its lines is
+    a unit of at most `unit_max_chars`, cut at sentence ends if longer, and
+    units are what queries are scored against. A section's heading is also a
+    unit, of the section's first passage.
+    """
+
+    def __init__(self, sources, max_chars=600, unit_max_chars=160):
+        self.max_chars = max_chars
+        self.unit_max_chars = unit_max_chars
+        self.passages = []
+        self.units = []
+        for source in sources:
+            self._compile(source)
+
+    def _compile(self, source):
+        heading = None
+        new_section = False
+        block = []
+        for line in source.splitlines() + ['']:
+            line = line.strip()
+            title = heading_of(line) if line else None
+            if line and title is None:
+                block.append(line)
+                continue
+            if block:
+                self._add_block(block, heading, new_section)
+                block = []
+                new_section = False
+            if title is not None:
+                heading = title
+                new_section = True
+
+    def _add_block(self, lines, heading, new_section):
+        for text in pack(lines, self.max_chars, '\n'):
+            passage_id = len(self.passages)
+            self.passages.append(Passage(text, heading))
+            if new_section:
+                # A query naming the section is answered with its first passage
+                self.units.append(Unit(heading, passage_id))
+                new_section = False
+            for line in text.split('\n'):
+                self.units.extend(Unit(unit, passage_id) for unit in split_units(line, self.unit_max_chars))
+
+    def entry_table(self):
+        """One NormalizedEntry per unit, matching the unit's text but carrying its passage's"""
+        return [NormalizedEntry(self.passages[unit.passage_id].text, unit.text) for unit in self.units]
+
+    def inverted_index(self):
+        """Inverted index over the units, each also indexed under its section heading"""
+        return InvertedIndex([
+            f"{self.passages[unit.passage_id].heading or ''}\n{unit.text}" for unit in self.units
+        ])
+
+
+def compile_knowledge(snapshot, max_chars=600, unit_max_chars=160):
+    """Builder for KnowledgeSnapshot.derive()"""
+    return CompiledKnowledge(snapshot.sources, max_chars, unit_max_chars)
@@ -0,0 +1,211 @@
+import os
+import glob
+import tempfile
+import threading
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import IntegrityError, close_old_connections
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .conf import setting
+from .models import PdfJob, Report
+
+
+def render_report_pdf(report, output):
+    """Write the report as a PDF to `output` (a path or binary file); needs ReportLab"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.lib import colors
+
+    # Create PDF document
+    doc = SimpleDocTemplate(output, pagesize=letter)
+    story = []
+
+    # Get styles
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18, spaceAfter=30, alignment=1)
+    heading_style = ParagraphStyle('CustomHeading', parent=styles['Heading2'], fontSize=14, spaceAfter=10, textColor=colors.darkblue)
+    body_style = ParagraphStyle('CustomBody', parent=styles['Normal'], fontSize=10, spaceAfter=10)
+
+    # Add title
+    story.append(Paragraph(report.title, title_style))
+    story.append(Spacer(1, 12))
+
+    # Add date
+    date_text = f"<b>Date:</b> {report.created_at.strftime('%B %d, %Y at %I:%M %p')}"
+    story.append(Paragraph(date_text, body_style))
+    story.append(Spacer(1, 20))
+
+    # Add the symptoms, diagnosis and recommendations sections if available
+    for heading, text in (
+        ("Symptoms", report.symptoms),
+        ("Diagnosis", report.diagnosis),
+        ("Recommendations", report.recommendations),
+    ):
+        if text:
+            story.append(Paragraph(f"<b>{heading}:</b>", heading_style))
+            story.append(Paragraph(text.replace('\n', '<br/>'), body_style))
+            story.append(Spacer(1, 20))
+
+    # Add conversation section
+    story.append(Paragraph("<b>Full Conversation:</b>", heading_style))
+
+    # Format conversation for display in table
+    conversation_data = []
+    for line in report.content.split('\n'):
+        if line.strip():
+            if line.startswith('System:'):
+                conversation_data.append(['', line])
+            else:
+                conversation_data.append([line, ''])
+
+    # Create table for conversation
+    if conversation_data:
+        table = Table(conversation_data, colWidths=[3*inch, 4*inch])
+        table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, 0), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+            ('GRID', (0, 0), (-1, -1), 1, colors.black)
+        ]))
+        story.append(table)
+
+    doc.build(story)
+
+
+def pdf_cache_dir():
+    return str(setting('CHAT_PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'chat_pdfs')))
+
+
+def pdf_cache_path(report_id, updated_at):
+    """Cached PDF location for one version of a report; an edit changes the name"""
+    version = int(updated_at.timestamp() * 1_000_000)
+    return os.path.join(pdf_cache_dir(), f"report-{report_id}-{version}.pdf")
+
+
+def cached_pdf(report):
+    """Path of the rendered PDF for the report as it is now, or None if not rendered yet"""
+    path = pdf_cache_path(report.id, report.updated_at)
+    return path if os.path.exists(path) else None
+
+
+def remove_cached_pdfs(report_id, keep=None):
+    for path in glob.glob(os.path.join(pdf_cache_dir(), f"report-{report_id}-*.pdf")):
+        if path != keep:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def build_pdf(report):
+    """Render the report into the cache (atomically, via a renamed temp file) and drop older versions"""
+    path = pdf_cache_path(report.id, report.updated_at)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            render_report_pdf(report, f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    remove_cached_pdfs(report.id, keep=path)
+    return path
+
+
+def claim_job(job_id):
+    """Mark a pending job as running; False if another worker got it first"""
+    return PdfJob.objects.filter(pk=job_id, status=PdfJob.PENDING).update(
+        status=PdfJob.RUNNING, started_at=timezone.now()
+    ) == 1
+
+
+def run_job(job):
+    """Render one claimed job and record the outcome"""
+    status, error = PdfJob.DONE, ''
+    try:
+        report = Report.objects.get(pk=job.report_id)
+        if report.updated_at == job.report_updated_at:
+            build_pdf(report)
+        # Otherwise the report changed since the job was queued; a newer job renders it
+    except ImportError:
+        status, error = PdfJob.FAILED, 'PDF generation requires ReportLab to be installed.'
+    except Exception as e:
+        status, error = PdfJob.FAILED, f'Error generating PDF: {e}'
+    PdfJob.objects.filter(pk=job.pk).update(status=status, error=error, finished_at=timezone.now())
+
+
+def run_pending_jobs():
+    """Work through the queue, oldest first, until no pending job is left; returns how many ran"""
+    processed = 0
+    try:
+        while True:
+            job = PdfJob.objects.filter(status=PdfJob.PENDING).order_by('created_at', 'id').first()
+            if job is None:
+                return processed
+            if claim_job(job.pk):
+                run_job(job)
+                processed += 1
+    finally:
+        close_old_connections()
+
+
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+
+
+def wake_workers():
+    """Have the worker pool drain the queue; with CHAT_PDF_WORKERS = 0 it runs in this thread"""
+    global _pdf_pool
+    workers = setting('CHAT_PDF_WORKERS', 2)
+    if not workers:
+        run_pending_jobs()
+        return
+    if _pdf_pool is None:
+        with _pdf_pool_lock:
+            if _pdf_pool is None:
+                _pdf_pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pdf')
+    _pdf_pool.submit(run_pending_jobs)
+
+
+def request_pdf(report):
+    """
+    The job rendering the report's current version, queued if there isn't one.
+    Jobs stuck running past CHAT_PDF_JOB_TIMEOUT seconds (a worker died) are requeued.
+    """
+    try:
+        job, created = PdfJob.objects.get_or_create(report=report, report_updated_at=report.updated_at)
+    except IntegrityError:
+        # Queued concurrently by another request
+        job, created = PdfJob.objects.get(report=report, report_updated_at=report.updated_at), False
+
+    stale_before = timezone.now() - timedelta(seconds=setting('CHAT_PDF_JOB_TIMEOUT', 300))
+    if job.status == PdfJob.RUNNING and job.started_at and job.started_at < stale_before:
+        PdfJob.objects.filter(pk=job.pk, status=PdfJob.RUNNING).update(status=PdfJob.PENDING)
+        created = True
+    elif job.status == PdfJob.DONE and cached_pdf(report) is None:
+        # Rendered, but the cache file was cleaned up since
+        PdfJob.objects.filter(pk=job.pk).update(status=PdfJob.PENDING)
+        created = True
+
+    if created or job.status == PdfJob.PENDING:
+        # Also for a job left pending by a restart or a worker that died before claiming it;
+        # claim_job lets only one worker run it, so extra wakes are harmless
+        wake_workers()
+        job.refresh_from_db()
+    return job
+
+
+@receiver(post_delete, sender=Report)
+def remove_deleted_report_pdfs(sender, instance, **kwargs):
+    remove_cached_pdfs(instance.pk)
@@ -0,0 +1,67 @@
+import os
+import time
+import cProfile
+import hashlib
+import tempfile
+import functools
+
+from .conf import setting
+
+
+def profile_directory():
+    return str(setting('CHAT_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'chat_profiles')))
+
+
+def query_digest(text):
+    """Short, stable stand-in for the message text; the text itself is never written"""
+    return hashlib.sha256(text.encode('utf-8', 'surrogatepass')).hexdigest()[:12]
+
+
+def rotate_profiles(directory, keep):
+    """Delete the oldest captured profiles so at most `keep` remain"""
+    profiles = sorted(name for name in os.listdir(directory) if name.endswith('.prof'))
+    for name in profiles[:max(len(profiles) - keep, 0)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass  # Removed by another worker
+
+
+def save_profile(profiler, query, elapsed):
+    directory = profile_directory()
+    os.makedirs(directory, exist_ok=True)
+    # Names sort by capture time, which rotation relies on
+    name = f"{time.time_ns()}-{elapsed * 1000:.0f}ms-{query_digest(query)}.prof"
+    profiler.dump_stats(os.path.join(directory, name))
+    rotate_profiles(directory, setting('CHAT_PROFILE_KEEP', 50))
+    return name
+
+
+def profile_slow_calls(func):
+    """
+    Run the decorated message handler under cProfile while CHAT_PROFILE_THRESHOLD_MS is
+    set, and keep the profile when the call took longer than that. The first positional
+    argument is the user's message; only its hash ends up in the file name.
+    """
+    @functools.wraps(func)
+    def wrapper(user_message, *args, **kwargs):
+        threshold_ms = setting('CHAT_PROFILE_THRESHOLD_MS', None)
+        if threshold_ms is None:
+            return func(user_message, *args, **kwargs)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active (only one at a time on Python 3.12+)
+            return func(user_message, *args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(user_message, *args, **kwargs)
+        finally:
+            profiler.disable()
+            elapsed = time.perf_counter() - start
+            if elapsed * 1000 >= threshold_ms:
+                save_profile(profiler, user_message, elapsed)
+
+    return wrapper
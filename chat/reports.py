@@ -0,0 +1,162 @@
+import csv
+from datetime import datetime
+
+from django.core.cache import caches
+from django.db.models import BooleanField, ExpressionWrapper, Q
+from django.db.models.functions import Substr
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import StreamingHttpResponse
+
+from .conf import setting
+from .models import Report
+from .streaming import streaming_content
+
+# Characters of symptoms/diagnosis shown in report listings
+SUMMARY_LENGTH = 100
+REPORT_COUNT_TIMEOUT = 300
+
+
+def summarize_text(text):
+    """Listing summary of a field fetched as its first SUMMARY_LENGTH + 1 characters"""
+    if not text:
+        return None
+    if len(text) > SUMMARY_LENGTH:
+        return text[:SUMMARY_LENGTH] + '...'
+    return text
+
+
+def report_listing(user):
+    """
+    The user's reports, newest first, as dicts of the listing columns only.
+    Summaries are cut in the database, so the full text fields are never loaded;
+    one extra character tells whether the text was longer.
+    """
+    return (
+        Report.objects.filter(user=user)
+        .order_by('-created_at', '-id')
+        .annotate(
+            symptoms_head=Substr('symptoms', 1, SUMMARY_LENGTH + 1),
+            diagnosis_head=Substr('diagnosis', 1, SUMMARY_LENGTH + 1),
+            has_recommendations=ExpressionWrapper(
+                Q(recommendations__isnull=False) & ~Q(recommendations=''), output_field=BooleanField()
+            ),
+        )
+        .values('id', 'title', 'created_at', 'symptoms_head', 'diagnosis_head', 'has_recommendations')
+    )
+
+
+def encode_cursor(row):
+    return f"{row['created_at'].isoformat()}_{row['id']}"
+
+
+def decode_cursor(cursor):
+    """(created_at, id) from a page cursor, or None if it is missing or malformed"""
+    try:
+        created_at, report_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(report_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def report_page(user, cursor=None, page_size=None):
+    """
+    One page of the user's report listing, continuing after `cursor`.
+    Keyset pagination on (created_at, id) walks the (user, -created_at) index,
+    so deep pages cost the same as the first. Returns (rows, next cursor or None).
+    """
+    page_size = page_size or setting('CHAT_REPORTS_PAGE_SIZE', 20)
+    listing = report_listing(user)
+    position = decode_cursor(cursor)
+    if position is not None:
+        created_at, report_id = position
+        listing = listing.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=report_id))
+
+    rows = list(listing[:page_size + 1])
+    next_cursor = encode_cursor(rows[page_size - 1]) if len(rows) > page_size else None
+    rows = rows[:page_size]
+    for row in rows:
+        row['symptoms_summary'] = summarize_text(row.pop('symptoms_head'))
+        row['diagnosis_summary'] = summarize_text(row.pop('diagnosis_head'))
+    return rows, next_cursor
+
+
+def report_count_key(user_id):
+    return f'chat:report_count:{user_id}'
+
+
+def report_count_cache():
+    """
+    The cache configured by CHAT_REPORT_COUNT_CACHE, or None to count in the database.
+    Saves and deletes invalidate a count only in the cache they run against, so it must
+    be one shared by every worker; a per-process cache would serve stale totals.
+    """
+    alias = setting('CHAT_REPORT_COUNT_CACHE', None)
+    return caches[alias] if alias else None
+
+
+def report_count(user):
+    """Number of reports the user has, cached until one is saved or deleted"""
+    count_cache = report_count_cache()
+    if count_cache is None:
+        return Report.objects.filter(user=user).count()
+    return count_cache.get_or_set(
+        report_count_key(user.pk),
+        lambda: Report.objects.filter(user=user).count(),
+        REPORT_COUNT_TIMEOUT,
+    )
+
+
+@receiver([post_save, post_delete], sender=Report)
+def invalidate_report_count(sender, instance, **kwargs):
+    count_cache = report_count_cache()
+    if count_cache is not None:
+        count_cache.delete(report_count_key(instance.user_id))
+
+
+class Echo:
+    """File-like object whose write() hands the line back, so csv.writer can feed a generator"""
+
+    def write(self, value):
+        return value
+
+
+def export_text(text):
+    # One line, cut to the first 100 characters
+    return text.replace('\n', ' ')[:100] if text else ''
+
+
+def report_csv_rows(reports, include_user=False):
+    """Yield the all-reports CSV one line at a time, reading the queryset in chunks"""
+    writer = csv.writer(Echo())
+    header = ['Title', 'Created Date', 'Symptoms', 'Diagnosis', 'Recommendations']
+    fields = ['title', 'created_at', 'symptoms', 'diagnosis', 'recommendations']
+    if include_user:
+        header.insert(0, 'User')
+        reports = reports.select_related('user')
+        fields.append('user__username')
+
+    yield writer.writerow(header)
+    for report in reports.only(*fields).iterator(chunk_size=setting('CHAT_EXPORT_CHUNK_SIZE', 2000)):
+        row = [
+            report.title,
+            report.created_at.strftime('%Y-%m-%d %H:%M'),
+            export_text(report.symptoms),
+            export_text(report.diagnosis),
+            export_text(report.recommendations),
+        ]
+        if include_user:
+            row.insert(0, report.user.username)
+        yield writer.writerow(row)
+
+
+def stream_reports_csv(request, reports, filename, include_user=False):
+    """
+    CSV download of the reports, streamed so memory stays flat however many rows there are.
+    Under ASGI the rows are produced in the sync thread a database chunk at a time.
+    """
+    rows = report_csv_rows(reports, include_user)
+    content = streaming_content(request, rows, batch=setting('CHAT_EXPORT_CHUNK_SIZE', 2000))
+    response = StreamingHttpResponse(content, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
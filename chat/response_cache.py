@@ -0,0 +1,78 @@
+import threading
+from collections import OrderedDict
+
+# Returned by ResponseCache.get() when there is no cached result
+MISSING = object()
+
+
+def normalize_query(query):
+    """
+    Cache key form of a query. Matching only ever looks at the lowercased query,
+    so case is folded; non-ASCII text is kept as-is because lowercasing it can
+    depend on the surrounding characters.
+    """
+    return query.lower() if query.isascii() else query
+
+
+class ResponseCache:
+    """
+    LRU cache of match results for one knowledge version at a time.
+    Seeing a new version clears it, so reloaded knowledge is never answered from stale results.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._version = None
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self._version:
+            if self._items:
+                self.invalidations += 1
+            self._items.clear()
+            self._version = version
+
+    def get(self, version, key):
+        """Cached value for key, or MISSING"""
+        with self._lock:
+            self._check_version(version)
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return MISSING
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, version, key, value):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._check_version(version)
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._items),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -121,20 +121,9 @@ async function handleQuestionClick(question) {
                 ]);
             }, 1000);
         } else {
-            // If no predefined answer, use the existing system to get a response
-            fetch('', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/x-www-form-urlencoded',
-                    'X-CSRFToken': getCookie('csrftoken'),
-                    'X-Requested-With': 'XMLHttpRequest'
-                },
-                body: `message=${encodeURIComponent(question)}`
-            })
-            .then(response => response.json())
+            // If no predefined answer, stream a response from the existing system
+            streamBotReply(question)
             .then(data => {
-                // Add bot response to chat
-                appendMessage('bot', data.response);
 
 
 
@@ -459,6 +448,64 @@ function getCookie(name) {
     return cookieValue;
 }
 
+// Function to stream the bot's reply from the server-sent events endpoint,
+// showing each segment as soon as it arrives
+async function streamBotReply(message) {
+    const formData = new FormData();
+    formData.append('message', message);
+
+    const response = await fetch('/chat/api/stream/', {
+        method: 'POST',
+        headers: {
+            'X-CSRFToken': getCookie('csrftoken'),
+            'X-Requested-With': 'XMLHttpRequest'
+        },
+        body: formData
+    });
+    if (!response.ok || !response.body) {
+        throw new Error(`Chat stream failed with status ${response.status}`);
+    }
+
+    const messages = document.getElementById('messages');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    let isStructuredForm = false;
+    let element = null;
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // Events are separated by a blank line: "event: <name>\ndata: <json>\n\n"
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const event = block.match(/^event: (.*)$/m);
+            const data = block.match(/^data: (.*)$/m);
+            if (!event || !data) continue;
+            const payload = JSON.parse(data[1]);
+
+            if (event[1] === 'meta') {
+                // The reply is on its way: swap the typing indicator for an empty bot message
+                isStructuredForm = payload.is_structured_form;
+                hideTypingIndicator();
+                messages.insertAdjacentHTML('beforeend', createMessageHTML('bot', ''));
+                element = messages.lastElementChild.querySelector('.message-content > div');
+            } else if (event[1] === 'chunk' && element) {
+                text += payload.text;
+                element.innerHTML = text;
+                messages.scrollTop = messages.scrollHeight;
+            }
+        }
+    }
+
+    return { response: text, is_structured_form: isStructuredForm };
+}
+
 // Initialize the chat with specific ulcer-related questions
 window.initializeChat = function() {
     const suggestionsContainer = document.getElementById('suggestions-container');
@@ -601,28 +648,10 @@ document.addEventListener('DOMContentLoaded', function() {
                     return;
                 }
 
-                // Send message to server using Django's CSRF protection
-                const formData = new FormData();
-                formData.append('message', userMsg);
-
-                const response = await fetch('', {
-                    method: 'POST',
-                    headers: {
-                        'X-CSRFToken': getCookie('csrftoken'),
-                        'X-Requested-With': 'XMLHttpRequest'
-                    },
-                    body: formData
-                });
-
-                // Hide typing indicator
+                // Stream the bot response into the chat as it is produced
+                const data = await streamBotReply(userMsg);
                 hideTypingIndicator();
 
-                // Get response data
-                const data = await response.json();
-
-                // Add bot response to chat
-                appendMessage('bot', data.response);
-
                 // Check if this response contains a diagnosis
                 if (data.response.includes("Based on your symptoms") || 
                     data.response.includes("you may have") || 
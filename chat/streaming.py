@@ -0,0 +1,34 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+
+async def iterate_in_thread(iterator, batch=1):
+    """
+    Async iterator over a sync iterator of strings, advanced in Django's sync thread
+    `batch` items at a time, each batch yielded as one string. The iterator is closed
+    if the client goes away mid-stream.
+    """
+    take = sync_to_async(lambda: list(islice(iterator, batch)))
+    try:
+        while True:
+            items = await take()
+            if not items:
+                return
+            yield ''.join(items)
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def streaming_content(request, iterator, batch=1):
+    """
+    Content for a StreamingHttpResponse that really streams under the request's handler.
+    Django buffers a sync iterator into a list under ASGI, so there it is wrapped in an
+    async iterator; under WSGI it is returned as is.
+    """
+    if isinstance(request, ASGIRequest):
+        return iterate_in_thread(iterator, batch)
+    return iterator
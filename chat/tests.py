@@ -1,3 +1,1059 @@
-from django.test import TestCase
+import io
+import os
+import csv
+import json
+import random
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from importlib.util import find_spec
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from asgiref.testing import ApplicationCommunicator
+
+from .knowledge_store import KnowledgeSnapshot, KnowledgeStore, StructuredFormsStore
+from . import manual_engine, pdf_export, views
+from .benchmarks import PASSAGE_QUERIES, legacy_find_best_match, scaled_knowledge, summarize
+from .websocket import ChatWebSocket
+from .response_cache import MISSING, ResponseCache
+from .executor import BoundedExecutor, ExecutorSaturated
+from .context_store import ContextStore, DatabaseContextBackend, FileContextBackend
+from .knowledge_index import build_entry_table, build_inverted_index
+from .knowledge_artifact import open_artifact
+from .matchers import BM25Matcher, TfidfMatcher, VectorMatcher
+from .typo_index import TypoIndex, build_typo_index
+from .passages import CompiledKnowledge, Passage, compile_knowledge
+from . import vector_index
+from .metrics import metrics
+from .models import ConversationState, PdfJob, Report
+from .reports import report_count
+from .profiling import query_digest
+from .streaming import iterate_in_thread
+
+
+class KnowledgeStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'knowledge.txt')
+        self.optional = os.path.join(self.tmpdir, 'missing.txt')
+        self.write('First entry\n\n  Second entry  \n')
+
+    def write(self, text, mtime=None):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        if mtime is not None:
+            os.utime(self.path, ns=(mtime, mtime))
+
+    def test_loads_once_and_reuses_snapshot(self):
+        store = KnowledgeStore([self.path], optional_paths=[self.optional])
+        first = store.get()
+        self.assertEqual(first.entries, ('First entry', 'Second entry'))
+        self.assertIs(store.get(), first)
+        self.assertEqual(store.reload_count, 1)
+
+    def test_reloads_when_file_changes(self):
+        store = KnowledgeStore([self.path])
+        first = store.get()
+        self.write('Replaced entry\n', mtime=first.signature[0][1] + 10**9)
+        second = store.get()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.entries, ('Replaced entry',))
+        self.assertNotEqual(second.version, first.version)
+
+    def test_derived_data_is_rebuilt_with_snapshot(self):
+        store = KnowledgeStore([self.path])
+        calls = []
+        build = lambda snapshot: calls.append(1) or len(snapshot.entries)
+        self.assertEqual(store.get().derive('count', build), 2)
+        self.assertEqual(store.get().derive('count', build), 2)
+        self.assertEqual(len(calls), 1)
+        store.reload()
+        store.get().derive('count', build)
+        self.assertEqual(len(calls), 2)
+
+    def test_engine_matches_direct_file_read(self):
+        expected = []
+        for path in (manual_engine.KNOWLEDGE_PATH, manual_engine.ULCER_KNOWLEDGE_PATH):
+            with open(path, 'r', encoding='utf-8') as f:
+                expected.extend(line.strip() for line in f if line.strip())
+        self.assertEqual(list(manual_engine.load_knowledge_base()), expected)
+
+
+# Fixed query set for matcher regression checks: the chat page suggestions plus typical free text
+REGRESSION_QUERIES = [
+    "What should I eat if I have an ulcer?",
+    "What foods should I avoid with an ulcer?",
+    "What are the symptoms of a stomach ulcer?",
+    "How are ulcers treated?",
+    "What causes ulcers?",
+    "How can I prevent ulcers?",
+    "What is the difference between gastric and duodenal ulcers?",
+    "How long does it take for an ulcer to heal?",
+    "hello",
+    "Can I drink coffee?",
+    "is milk good for ulcer",
+    "spicy food",
+    "H. pylori antibiotics",
+    "omeprazole dose",
+    "black stools",
+    "what is a peptic ulcer",
+    "alcohol and smoking",
+    "bleeding ulcer emergency",
+    "vomiting blood",
+]
+
+
+def regression_context():
+    context = manual_engine.ConversationContext()
+    context.add_exchange("I have burning stomach pain after eating spicy food", "")
+    return context
+
+
+def random_query(rng, entries):
+    """A query built like real ones: words from an entry, with typos, dropped words and stray punctuation"""
+    words = rng.choice(entries).split()
+    start = rng.randrange(len(words))
+    words = words[start:start + rng.randint(1, 8)]
+    query = []
+    for word in words:
+        if rng.random() < 0.2 and len(word) > 3:
+            cut = rng.randrange(len(word))
+            word = word[:cut] + word[cut + 1:]
+        if rng.random() < 0.9:
+            query.append(word)
+    return ' '.join(query) + rng.choice(['', '?', '.', ', please'])
+
+
+class FullScanEquivalenceTests(SimpleTestCase):
+    """The default engine must answer exactly like the original full difflib scan"""
+
+    # Queries whose best entries share no indexed term, or match phrase boosts inside words
+    INDEX_MISSES = [
+        "is coffee bad", "what about eggs", "what is gerd", "what medicine should i take",
+        "when should I see a doctor", "very",
+    ]
+
+    def test_generated_queries_match_full_scan(self):
+        rng = random.Random(1234)
+        entries = manual_engine.load_knowledge_base()
+        queries = REGRESSION_QUERIES + self.INDEX_MISSES + [random_query(rng, entries) for _ in range(150)]
+        for context in (None, regression_context()):
+            boost = manual_engine.get_context_boost(context)
+            for query in queries:
+                with self.subTest(query=query, context=bool(context)):
+                    self.assertEqual(
+                        manual_engine.find_best_match(query, 0.5, context),
+                        legacy_find_best_match(query, entries, 0.5, boost),
+                    )
+
+    def test_batch_matches_full_scan(self):
+        rng = random.Random(99)
+        entries = manual_engine.load_knowledge_base()
+        queries = self.INDEX_MISSES + [random_query(rng, entries) for _ in range(40)]
+        self.assertEqual(
+            manual_engine.find_best_matches(queries),
+            [legacy_find_best_match(query, entries) for query in queries],
+        )
+
+
+class PrunedScoringPropertyTests(SimpleTestCase):
+    """Pruned scoring must return exactly what scoring every entry in order returns"""
+
+    def test_pruned_matches_exhaustive_scan(self):
+        rng = random.Random(2024)
+        entries = manual_engine.load_knowledge_base()
+        table = build_entry_table(manual_engine.knowledge_store.get())
+        keywords = ['pain', 'ulcer', 'food', 'stomach', 'spicy', 'acid', 'bleeding']
+        for _ in range(150):
+            query = random_query(rng, entries)
+            boost = {keyword: rng.choice([0.05, 0.1, 0.2]) for keyword in rng.sample(keywords, rng.randint(0, 3))}
+            # Random subsets and orders stand in for inverted-index candidate lists
+            subset = rng.sample(table, rng.randint(1, len(table)))
+            plan = manual_engine.QueryPlan(query, boost)
+            with self.subTest(query=query, boost=boost):
+                expected = manual_engine.score_entries(plan, subset, 0.5, prune=False)
+                self.assertEqual(manual_engine.score_entries(plan, subset, 0.5), expected)
+
+    def test_batch_pruning_matches_exhaustive_batch(self):
+        rng = random.Random(7)
+        entries = manual_engine.load_knowledge_base()
+        snapshot = manual_engine.knowledge_store.get()
+        queries = [random_query(rng, entries) for _ in range(60)]
+        boosts = [manual_engine.get_context_boost(regression_context()) if i % 3 == 0 else {} for i in range(60)]
+        pruned = manual_engine.DifflibMatcher().match_many(snapshot, queries, 0.5, boosts)
+        exhaustive = manual_engine.DifflibMatcher(prune=False).match_many(snapshot, queries, 0.5, boosts)
+        self.assertEqual(pruned, exhaustive)
+
+
+class TypoIndexTests(SimpleTestCase):
+    def setUp(self):
+        self.snapshot = manual_engine.knowledge_store.get()
+        self.typos = build_typo_index(self.snapshot)
+
+    def test_misspellings_map_to_knowledge_words(self):
+        for typo, word in [('ulser', 'ulcer'), ('duodinal', 'duodenal'), ('pylory', 'pylori'), ('tretment', 'treatment')]:
+            with self.subTest(typo=typo):
+                self.assertEqual(self.typos.corrections(typo)[0], word)
+        self.assertEqual(self.typos.corrections('ulcer'), [])  # Already known
+        self.assertEqual(self.typos.corrections('ulc'), [])  # Too short to correct
+
+    def test_misspelt_query_retrieves_candidates_without_full_scan(self):
+        matcher = manual_engine.DifflibMatcher(candidate_index=True)
+        self.assertIsNone(manual_engine.DifflibMatcher().candidate_ids(self.snapshot, "stomache ulser", {}))
+        self.assertIsNone(
+            manual_engine.DifflibMatcher(candidate_index=True, typo_tolerance=False).candidate_ids(
+                self.snapshot, "stomache ulser", {}
+            )
+        )
+        candidates = matcher.candidate_ids(self.snapshot, "stomache ulser", {})
+        self.assertTrue(candidates)
+        match, _ = matcher.match(self.snapshot, "stomache ulser")
+        self.assertIn('ulcer', match.lower())
+
+    def test_num_perm_must_split_into_bands(self):
+        with self.assertRaises(ValueError):
+            TypoIndex(['ulcer'], num_perm=30, bands=16)
+
+
+class PassageTests(SimpleTestCase):
+    SOURCE = (
+        "# FAQ\n\n"
+        "Q: Is milk good for ulcers?\n"
+        "A: Milk may soothe symptoms temporarily but can later increase acid production.\n\n"
+        "COMMON SYMPTOMS\n"
+        "Burning pain. It often gets worse at night when the stomach is empty.\n"
+    )
+
+    def test_blocks_become_passages_under_their_heading(self):
+        compiled = CompiledKnowledge([self.SOURCE])
+        self.assertEqual(compiled.passages, [
+            Passage("Q: Is milk good for ulcers?\nA: Milk may soothe symptoms temporarily but can later increase acid production.", "FAQ"),
+            Passage("Burning pain. It often gets worse at night when the stomach is empty.", "COMMON SYMPTOMS"),
+        ])
+        self.assertEqual([unit.text for unit in compiled.units if unit.passage_id == 0][0], "FAQ")
+
+    def test_length_limits_bound_passages_and_units(self):
+        compiled = CompiledKnowledge([self.SOURCE], max_chars=60, unit_max_chars=30)
+        self.assertEqual(len(compiled.passages), 3)  # The question and answer no longer fit together
+        for unit in compiled.units:
+            self.assertLessEqual(len(unit.text), 30)
+        self.assertIn("Burning pain.", [unit.text for unit in compiled.units])
+
+    def test_match_returns_the_whole_passage(self):
+        snapshot = manual_engine.knowledge_store.get()
+        match, _ = manual_engine.DifflibMatcher(passages=True).match(snapshot, "Is milk good for ulcers?")
+        self.assertTrue(match.startswith("Q: Is milk good for ulcers?\nA: "))
+        self.assertEqual(manual_engine.DifflibMatcher().match(snapshot, "Is milk good for ulcers?")[0],
+                         "Q: Is milk good for ulcers?")
+
+    def test_match_many_agrees_with_match(self):
+        snapshot = manual_engine.knowledge_store.get()
+        matcher = manual_engine.DifflibMatcher(passages=True)
+        queries = [query for query, _ in PASSAGE_QUERIES]
+        self.assertEqual(matcher.match_many(snapshot, queries), [matcher.match(snapshot, query) for query in queries])
+
+    def test_snapshot_without_sources_keeps_one_passage_per_entry(self):
+        snapshot = KnowledgeSnapshot(["Ulcers are sores.", "Avoid NSAIDs."], 'test', signature=())
+        self.assertEqual([passage.text for passage in compile_knowledge(snapshot).passages], list(snapshot.entries))
+
+
+class MatcherSelectionTests(SimpleTestCase):
+    def test_default_engine_is_difflib(self):
+        self.assertIsInstance(manual_engine.get_matcher(), manual_engine.DifflibMatcher)
+
+    @override_settings(CHAT_MATCHER='bm25', CHAT_MATCHER_OPTIONS={'k1': 1.2})
+    def test_engine_is_selected_from_settings(self):
+        matcher = manual_engine.get_matcher()
+        self.assertIsInstance(matcher, BM25Matcher)
+        self.assertEqual(matcher.options, {'k1': 1.2})
+
+    @override_settings(CHAT_MATCHER='word2vec')
+    def test_unknown_engine_is_rejected(self):
+        with self.assertRaises(ImproperlyConfigured):
+            manual_engine.get_matcher()
+
+    def test_ranking_engines_find_the_obvious_entry(self):
+        snapshot = manual_engine.knowledge_store.get()
+        for matcher in (BM25Matcher(), TfidfMatcher()):
+            with self.subTest(engine=matcher.name):
+                match, score = matcher.match(snapshot, "black stools", 0.5)
+                self.assertEqual(match, "- Black or tarry stools")
+                self.assertLess(score, 1.0)
+                self.assertEqual(matcher.match(snapshot, "hello", 0.5), (None, 0.0))
+
+
+@skipUnless(find_spec('numpy'), "NumPy is not installed")
+class VectorMatcherTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_patch = override_settings(CHAT_VECTOR_DIR=self.directory)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+        self.snapshot = manual_engine.knowledge_store.get()
+
+    def test_embeddings_are_memory_mapped_per_version(self):
+        vectors = vector_index.load_entry_vectors(self.snapshot, 64)
+        self.assertIsInstance(vectors, vector_index.np.memmap)
+        self.assertEqual(vectors.shape, (len(self.snapshot.entries), 64))
+        self.assertEqual(vectors.dtype, vector_index.np.float32)
+        self.assertEqual(os.listdir(self.directory), [f'entries-{self.snapshot.version}-64.npy'])
+
+    def test_other_versions_are_kept_until_build_knowledge(self):
+        # Another worker may still be on the older version and about to map its file
+        older = os.path.join(self.directory, 'entries-older-64.npy')
+        vector_index.np.save(older, vector_index.embed(self.snapshot.entries[:3], 64))
+        vector_index.load_entry_vectors(self.snapshot, 64)
+        vector_index.load_entry_vectors(self.snapshot, 32)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+        artifact = os.path.join(self.directory, 'knowledge.bin')
+        out = io.StringIO()
+        call_command('build_knowledge', output=artifact, stdout=out)
+        self.assertIn("Removed 1 embedding files", out.getvalue())
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([
+            'knowledge.bin', f'entries-{self.snapshot.version}-32.npy', f'entries-{self.snapshot.version}-64.npy',
+        ]))
+
+    def test_exact_and_approximate_search_find_the_obvious_entry(self):
+        for options in ({}, {'exact_below': 0}):
+            with self.subTest(options=options):
+                matcher = VectorMatcher(**options)
+                match, score = matcher.match(self.snapshot, "black stools", 0.5)
+                self.assertEqual(match, "- Black or tarry stools")
+                self.assertEqual(matcher.match(self.snapshot, "hello", 0.5)[0], None)
+
+    def test_ann_returns_entries_as_their_own_nearest_neighbours(self):
+        index = VectorMatcher(exact_below=0).build(self.snapshot)
+        entry_ids = range(0, len(self.snapshot.entries), 25)
+        found = [index.search(index.vectors[entry_id], 1)[0][0] for entry_id in entry_ids]
+        exact = [vector_index.brute_force_search(index.vectors, index.vectors[entry_id], 1)[0][0] for entry_id in entry_ids]
+        self.assertEqual(found, exact)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ContextStoreTests(SimpleTestCase):
+    def test_least_recently_used_session_is_evicted(self):
+        store = ContextStore(max_sessions=2, idle_ttl=None)
+        store['a'] = manual_engine.ConversationContext()
+        store['b'] = manual_engine.ConversationContext()
+        store['a']  # Touch 'a' so 'b' becomes the oldest
+        store['c'] = manual_engine.ConversationContext()
+        self.assertIn('a', store)
+        self.assertNotIn('b', store)
+        self.assertEqual(store.evictions, 1)
+
+    def test_idle_sessions_expire(self):
+        clock = FakeClock()
+        store = ContextStore(idle_ttl=60, clock=clock)
+        store['a'] = manual_engine.ConversationContext()
+        clock.now = 30
+        store['b'] = manual_engine.ConversationContext()
+        clock.now = 61
+        self.assertNotIn('a', store)
+        self.assertIn('b', store)
+        self.assertEqual(store.stats()['expirations'], 1)
+
+    def test_process_message_uses_store(self):
+        store = ContextStore(max_sessions=1)
+        manual_engine.process_message("hello", 'first', store)
+        manual_engine.process_message("hello", 'second', store)
+        self.assertEqual(len(store), 1)
+        self.assertEqual(len(store['second'].history), 1)
+        self.assertGreater(store.approximate_size(), 0)
+
+    def test_history_is_capped(self):
+        context = manual_engine.ConversationContext(max_history=3)
+        for number in range(5):
+            context.add_exchange(f"message {number}", "reply")
+        self.assertEqual([msg for msg, _ in context.history], ["message 2", "message 3", "message 4"])
+
+
+class SharedContextBackendTests(TestCase):
+    def assert_form_survives_worker_switch(self, make_backend):
+        # Two backend instances stand in for two worker processes
+        first_worker, second_worker = make_backend(), make_backend()
+        response, is_form = manual_engine.process_message("I have stomach pain", 'session', first_worker)
+        self.assertTrue(is_form)
+        response, is_form = manual_engine.process_message("upper stomach", 'session', second_worker)
+        self.assertTrue(is_form)
+        context = first_worker['session']
+        self.assertEqual(context.form_data, {'pain_location': 'upper stomach'})
+        self.assertEqual(len(context.history), 2)
+
+    def test_file_backend_is_shared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.assert_form_survives_worker_switch(
+            lambda: FileContextBackend(directory, manual_engine.ConversationContext)
+        )
+
+    def test_database_backend_is_shared(self):
+        self.assert_form_survives_worker_switch(
+            lambda: DatabaseContextBackend(manual_engine.ConversationContext)
+        )
+
+    def test_other_schema_versions_are_discarded(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        backend = FileContextBackend(directory, manual_engine.ConversationContext)
+        backend['session'] = manual_engine.ConversationContext()
+        with open(backend._path('session'), 'w', encoding='utf-8') as f:
+            f.write('{"v": 0}')
+        self.assertNotIn('session', backend)
+
+
+class ContextPurgeTests(TestCase):
+    def age_file(self, path, seconds):
+        stamp = os.stat(path).st_mtime - seconds
+        os.utime(path, (stamp, stamp))
+
+    def test_file_writes_purge_idle_contexts_once_per_interval(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        other_worker = FileContextBackend(directory, manual_engine.ConversationContext, idle_ttl=60, purge_interval=0)
+        backend = FileContextBackend(directory, manual_engine.ConversationContext, idle_ttl=60, purge_interval=3600)
+        other_worker['idle'] = manual_engine.ConversationContext()
+        self.age_file(backend._path('idle'), 120)
+        backend['active'] = manual_engine.ConversationContext()
+        self.assertEqual(len(backend), 1)
+
+        other_worker['idle'] = manual_engine.ConversationContext()
+        self.age_file(backend._path('idle'), 120)
+        backend['active'] = manual_engine.ConversationContext()
+        self.assertEqual(len(backend), 2)  # Already purged in this interval
+
+    def test_database_writes_purge_idle_contexts(self):
+        backend = DatabaseContextBackend(manual_engine.ConversationContext, idle_ttl=60, purge_interval=0)
+        backend['idle'] = manual_engine.ConversationContext()
+        ConversationState.objects.update(updated_at=timezone.now() - timedelta(seconds=120))
+        backend['active'] = manual_engine.ConversationContext()
+        self.assertEqual(len(backend), 2)  # Disabled; left to purge_contexts
+
+        backend.purge_interval = 300
+        backend['active'] = manual_engine.ConversationContext()
+        self.assertEqual(list(ConversationState.objects.values_list('session_id', flat=True)), ['active'])
+
+    @override_settings(CHAT_CONTEXT_BACKEND='database', CHAT_CONTEXT_IDLE_TTL=60)
+    def test_purge_command(self):
+        backend = manual_engine.build_context_backend()
+        backend.purge_interval = 0
+        backend['idle'] = manual_engine.ConversationContext()
+        ConversationState.objects.update(updated_at=timezone.now() - timedelta(seconds=120))
+        backend['active'] = manual_engine.ConversationContext()
+        out = io.StringIO()
+        call_command('purge_contexts', stdout=out)
+        self.assertIn("Removed 1 expired contexts", out.getvalue())
+        self.assertEqual(len(backend), 1)
+
+    @override_settings(CHAT_CONTEXT_BACKEND='memory')
+    def test_purge_command_needs_a_shared_backend(self):
+        with self.assertRaises(CommandError):
+            call_command('purge_contexts')
+
+
+class StructuredFormsStoreTests(SimpleTestCase):
+    MESSAGES = [
+        "I have stomach pain", "what should I eat", "Treatment options?", "I can't sleep from stress",
+        "how to treat it", "meal plan please", "I want to know about exercise and diet",
+        "hello there", "", "HEALTHY HABITS", "repeat", "great",
+    ]
+
+    def naive_trigger(self, forms, message):
+        message_lower = message.lower()
+        for form_type, form_def in forms.items():
+            for phrase in form_def.get('trigger_phrases', []):
+                if phrase.lower() in message_lower:
+                    return form_type
+        return None
+
+    def test_compiled_triggers_match_nested_loop(self):
+        forms = manual_engine.load_structured_forms()
+        for message in self.MESSAGES:
+            with self.subTest(message=message):
+                self.assertEqual(
+                    manual_engine.check_needs_structured_form(message, None),
+                    self.naive_trigger(forms, message),
+                )
+
+    def test_earlier_form_wins_for_overlapping_phrases(self):
+        forms = {'later': {'trigger_phrases': ['treat']}, 'earlier': {'trigger_phrases': ['eat']}}
+        registry = StructuredFormsStore('/nonexistent/forms.json', forms).get()
+        self.assertEqual(registry.match_trigger("how to treat"), self.naive_trigger(forms, "how to treat"))
+        forms = {'first': {'trigger_phrases': ['eat']}, 'second': {'trigger_phrases': ['treat']}}
+        registry = StructuredFormsStore('/nonexistent/forms.json', forms).get()
+        self.assertEqual(registry.match_trigger("how to treat"), 'first')
+
+    def test_forms_are_parsed_once_and_reloaded_on_change(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'forms.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"a": {"trigger_phrases": ["x"], "questions": {}}}')
+        store = StructuredFormsStore(path, {})
+        registry = store.get()
+        self.assertIs(store.get(), registry)
+        with self.assertRaises(TypeError):
+            registry.forms['b'] = {}
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('not json')
+        os.utime(path, ns=(registry.signature[0][1] + 10**9,) * 2)
+        self.assertEqual(dict(store.get().forms), {})
+        self.assertEqual(store.reload_count, 2)
+
+
+class KnowledgeArtifactTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'knowledge.bin')
+        call_command('build_knowledge', output=self.path, stdout=io.StringIO())
+
+    def stores(self, artifact_path):
+        return (
+            KnowledgeStore([manual_engine.KNOWLEDGE_PATH], optional_paths=[manual_engine.ULCER_KNOWLEDGE_PATH],
+                           artifact_path=artifact_path),
+            StructuredFormsStore(manual_engine.STRUCTURED_FORMS_PATH, manual_engine.DEFAULT_STRUCTURED_FORMS,
+                                 artifact_path=artifact_path),
+        )
+
+    def test_artifact_serves_the_same_knowledge(self):
+        mapped_store, mapped_forms = self.stores(self.path)
+        text_store, text_forms = self.stores(None)
+        mapped, text = mapped_store.get(), text_store.get()
+        self.assertEqual(mapped.artifact, self.path)
+        self.assertIsNone(text.artifact)
+        self.assertEqual(list(mapped.entries), list(text.entries))
+        self.assertEqual(mapped.entries[-1], text.entries[-1])
+        self.assertEqual(list(mapped.derive('questions', None)), list(text.derive('questions', manual_engine.build_questions)))
+
+        mapped_index = mapped.derive('inverted_index', None)
+        text_index = text.derive('inverted_index', build_inverted_index)
+        self.assertEqual(dict(mapped_index.postings), text_index.postings)
+        self.assertEqual(dict(mapped_index.idf), text_index.idf)
+        self.assertNotIn('zzzz', mapped_index.postings)
+
+        for query in REGRESSION_QUERIES:
+            with self.subTest(query=query):
+                self.assertEqual(manual_engine.DifflibMatcher().match(mapped, query),
+                                 manual_engine.DifflibMatcher().match(text, query))
+        self.assertEqual(mapped_forms.get().trigger_pattern.pattern, text_forms.get().trigger_pattern.pattern)
+        self.assertEqual(dict(mapped_forms.get().forms['ulcer_diet']['questions']),
+                         dict(text_forms.get().forms['ulcer_diet']['questions']))
+
+    def test_stale_or_damaged_artifact_falls_back_to_the_text(self):
+        source = os.path.join(self.tmpdir, 'knowledge.txt')
+        with open(source, 'w', encoding='utf-8') as f:
+            f.write('A different entry\n')
+        snapshot = KnowledgeStore([source], artifact_path=self.path).get()
+        self.assertIsNone(snapshot.artifact)
+        self.assertEqual(snapshot.entries, ('A different entry',))
+
+        with open(self.path, 'wb') as f:
+            f.write(b'not an artifact')
+        self.assertIsNone(open_artifact(self.path))
+        self.assertIsNone(self.stores(self.path)[0].get().artifact)
+
+    def test_invalid_forms_are_rejected(self):
+        forms_path = os.path.join(self.tmpdir, 'forms.json')
+        with open(forms_path, 'w', encoding='utf-8') as f:
+            json.dump({'diet': {'trigger_phrases': 'eat', 'questions': {}}}, f)
+        with mock.patch.object(manual_engine, 'STRUCTURED_FORMS_PATH', forms_path):
+            with self.assertRaisesMessage(CommandError, "'questions' must be a non-empty object"):
+                call_command('build_knowledge', output=self.path, stdout=io.StringIO())
+
+
+class ChatPageTests(TestCase):
+    def test_suggestions_are_built_once_per_knowledge_version(self):
+        first = self.client.get(reverse('chat'))
+        second = self.client.get(reverse('chat'))
+        self.assertEqual(first.status_code, 200)
+        self.assertIs(first.context['questions'], second.context['questions'])
+        self.assertEqual(first.context['questions'][:1], ("What should I eat if I have an ulcer?",))
+        self.assertEqual(list(first.context['questions'][8:]), manual_engine.extract_questions())
+        self.assertNotContains(first, 'id="suggested-questions"')  # Nothing on the page reads them
+
+
+class ChatBatchTests(TestCase):
+    def post_batch(self, payload):
+        return self.client.post(reverse('chat_batch'), json.dumps(payload), content_type='application/json')
+
+    def test_batch_keeps_per_session_order(self):
+        response = self.post_batch({'messages': [
+            {'session_id': 'kiosk-1', 'message': 'I have stomach pain'},
+            {'session_id': 'kiosk-2', 'message': 'black stools'},
+            {'session_id': 'kiosk-1', 'message': 'upper stomach'},
+        ]})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['responses']
+        self.assertEqual([result['session_id'] for result in results], ['kiosk-1', 'kiosk-2', 'kiosk-1'])
+        self.assertTrue(results[0]['is_structured_form'])
+        self.assertEqual(results[1]['response'], "- Black or tarry stools")
+        # The second kiosk-1 message answered the first form question, so the next one is asked
+        forms = manual_engine.load_structured_forms()
+        self.assertEqual(results[2]['response'], forms['ulcer_diagnosis']['questions']['pain_timing'])
+
+    def test_knowledge_lookups_are_scored_together(self):
+        items = [(f'kiosk-{n}', query) for n, query in enumerate(["black stools", "omeprazole dose", "what is gerd"])]
+        with mock.patch.object(manual_engine, 'find_best_matches', wraps=manual_engine.find_best_matches) as batch, \
+                mock.patch.object(manual_engine, 'find_best_match') as single:
+            results = manual_engine.process_messages(items, ContextStore())
+        batch.assert_called_once()
+        single.assert_not_called()
+        expected = [manual_engine.process_message(message, session_id, ContextStore()) for session_id, message in items]
+        self.assertEqual(results, expected)
+
+    @override_settings(CHAT_CONTEXT_BACKEND='database')
+    def test_long_session_ids_fit_the_database_backend(self):
+        session_id = 'kiosk-' + 'x' * 500
+        with mock.patch.object(manual_engine, 'contexts', manual_engine.build_context_backend()):
+            first = self.post_batch([{'session_id': session_id, 'message': 'I have stomach pain'}])
+            second = self.post_batch([{'session_id': session_id, 'message': 'upper stomach'}])
+        self.assertEqual(first.status_code, 200)
+        forms = manual_engine.load_structured_forms()
+        self.assertEqual(second.json()['responses'][0]['response'], forms['ulcer_diagnosis']['questions']['pain_timing'])
+        key = views.batch_session_key(session_id)
+        self.assertLessEqual(len(key), ConversationState._meta.get_field('session_id').max_length)
+        self.assertTrue(ConversationState.objects.filter(session_id=key).exists())
+
+    def test_invalid_batches_are_rejected(self):
+        self.assertEqual(self.post_batch({'messages': 'hello'}).status_code, 400)
+        self.assertEqual(self.post_batch([{'message': 'no session'}]).status_code, 400)
+        with override_settings(CHAT_BATCH_MAX_ITEMS=1):
+            items = [{'session_id': 'a', 'message': 'hi'}] * 2
+            self.assertEqual(self.post_batch(items).status_code, 400)
+
+
+class BatchMatchingTests(SimpleTestCase):
+    def test_find_best_matches_equals_per_query_calls(self):
+        queries = REGRESSION_QUERIES + REGRESSION_QUERIES[:4]
+        contexts = [regression_context() if position % 3 == 0 else None for position in range(len(queries))]
+        for engine in ('difflib', 'bm25', 'tfidf'):
+            with self.subTest(engine=engine), override_settings(CHAT_MATCHER=engine):
+                expected = [
+                    manual_engine.find_best_match(query, 0.5, context)
+                    for query, context in zip(queries, contexts)
+                ]
+                self.assertEqual(manual_engine.find_best_matches(queries, 0.5, contexts), expected)
+
+
+class AsyncChatTests(TestCase):
+    def test_async_endpoint_answers(self):
+        response = self.client.post(reverse('chat_api_async'), {'message': 'black stools'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'response': "- Black or tarry stools", 'is_structured_form': False})
+        self.assertEqual(self.client.get(reverse('chat_api_async')).status_code, 405)
+
+    def test_saturated_executor_rejects_work(self):
+        executor = BoundedExecutor('thread', max_workers=1, queue_size=1)
+        release = threading.Event()
+        running = [executor.submit(release.wait), executor.submit(release.wait)]
+        with self.assertRaises(ExecutorSaturated):
+            executor.submit(release.wait)
+        self.assertEqual(executor.rejected, 1)
+        release.set()
+        executor.shutdown(wait=True)  # Joins the workers, so their done-callbacks have run
+        self.assertTrue(all(future.done() for future in running))
+        # Every slot was given back
+        self.assertTrue(all(executor._slots.acquire(blocking=False) for _ in range(executor.capacity)))
+
+    def test_tasks_release_database_connections(self):
+        executor = BoundedExecutor('thread', max_workers=1, queue_size=1)
+        self.addCleanup(executor.shutdown)
+        calls = []
+        with mock.patch('chat.executor.close_old_connections', lambda: calls.append('close')):
+            self.assertEqual(executor.submit(lambda: calls.append('task') or 'done').result(timeout=5), 'done')
+        self.assertEqual(calls, ['close', 'task', 'close'])
+
+
+class ChatStreamTests(TestCase):
+    def read_events(self, message):
+        response = self.client.post(reverse('chat_stream'), {'message': message})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        body = b''.join(response.streaming_content).decode('utf-8')
+        events = []
+        for block in body.strip().split('\n\n'):
+            event_line, data_line = block.split('\n')
+            events.append((event_line[len('event: '):], json.loads(data_line[len('data: '):])))
+        return events
+
+    def test_flag_comes_first_and_chunks_rebuild_the_response(self):
+        events = self.read_events("I have stomach pain")
+        self.assertEqual(events[0], ('meta', {'is_structured_form': True}))
+        self.assertEqual(events[-1], ('done', {}))
+        text = ''.join(data['text'] for event, data in events if event == 'chunk')
+        forms = manual_engine.load_structured_forms()
+        self.assertEqual(text, forms['ulcer_diagnosis']['questions']['pain_location'])
+
+    async def test_streams_under_asgi(self):
+        # Django reads a sync iterator into a list under ASGI, so the view must hand it an async one
+        response = await self.async_client.post(reverse('chat_stream'), {'message': 'I have stomach pain'})
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(chunks[0], b'event: meta\ndata: {"is_structured_form": true}\n\n')
+        self.assertEqual(chunks[-1], b'event: done\ndata: {}\n\n')
+
+    async def test_abandoned_stream_is_closed(self):
+        closed = []
+
+        def segments():
+            try:
+                yield 'first'
+                yield 'second'
+            finally:
+                closed.append(True)
+
+        stream = iterate_in_thread(segments())
+        self.assertEqual(await anext(stream), 'first')
+        await stream.aclose()
+        self.assertEqual(closed, [True])
+
+    def test_long_responses_are_split_into_segments(self):
+        form_data = {'pain_location': 'upper stomach', 'pain_timing': 'after eating'}
+        text = manual_engine.generate_ulcer_diagnosis_response(form_data)
+        segments = manual_engine.split_segments(text)
+        self.assertGreater(len(segments), 3)
+        self.assertEqual(''.join(segments), text)
+
+
+class ChatWebSocketTests(TestCase):
+    async def test_context_is_kept_for_the_connection(self):
+        communicator = ApplicationCommunicator(
+            ChatWebSocket(), {'type': 'websocket', 'path': '/ws/chat/', 'headers': []}
+        )
+        await communicator.send_input({'type': 'websocket.connect'})
+        self.assertEqual(await communicator.receive_output(), {'type': 'websocket.accept'})
+
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'message': 'I have stomach pain'})})
+        first = json.loads((await communicator.receive_output(timeout=5))['text'])
+        await communicator.send_input({'type': 'websocket.receive', 'text': 'upper stomach'})
+        second = json.loads((await communicator.receive_output(timeout=5))['text'])
+        await communicator.send_input({'type': 'websocket.receive', 'text': json.dumps({'type': 'ping'})})
+        pong = json.loads((await communicator.receive_output(timeout=5))['text'])
+
+        forms = manual_engine.load_structured_forms()
+        questions = forms['ulcer_diagnosis']['questions']
+        self.assertEqual(first, {'type': 'response', 'response': questions['pain_location'], 'is_structured_form': True})
+        self.assertEqual(second['response'], questions['pain_timing'])
+        self.assertEqual(pong, {'type': 'pong'})
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+    async def test_context_is_stored_while_the_socket_is_open(self):
+        session_id = 'socket-session'
+        self.addCleanup(manual_engine.contexts.__delitem__, session_id)
+        scope = {'type': 'websocket', 'path': '/ws/chat/', 'headers': [(b'cookie', f'sessionid={session_id}'.encode())]}
+        communicator = ApplicationCommunicator(ChatWebSocket(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        await communicator.receive_output(timeout=5)
+        await communicator.send_input({'type': 'websocket.receive', 'text': 'black stools'})
+        await communicator.receive_output(timeout=5)
+
+        # Visible to report creation before the socket closes
+        stored = manual_engine.contexts.get(session_id)
+        self.assertEqual(stored.history, [("black stools", "- Black or tarry stools")])
+
+        await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+
+    async def handshake(self, origin):
+        scope = {'type': 'websocket', 'path': '/ws/chat/', 'headers': [(b'origin', origin.encode())]}
+        communicator = ApplicationCommunicator(ChatWebSocket(), scope)
+        await communicator.send_input({'type': 'websocket.connect'})
+        reply = await communicator.receive_output(timeout=5)
+        if reply['type'] == 'websocket.accept':
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await communicator.wait(timeout=5)
+        return reply
+
+    @override_settings(ALLOWED_HOSTS=['chat.example.com'], CSRF_TRUSTED_ORIGINS=['https://*.partner.example'])
+    async def test_foreign_origins_are_refused(self):
+        for origin in ('https://evil.example', 'null', 'https://chat.example.com.evil.example', 'http://app.partner.example'):
+            with self.subTest(origin=origin):
+                self.assertEqual(await self.handshake(origin), {'type': 'websocket.close', 'code': 4403})
+        for origin in ('https://chat.example.com', 'http://chat.example.com:8000', 'https://app.partner.example'):
+            with self.subTest(origin=origin):
+                self.assertEqual(await self.handshake(origin), {'type': 'websocket.accept'})
+
+
+class ResponseCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResponseCache(max_size=2)
+        patcher = mock.patch.object(manual_engine, 'response_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_questions_hit_the_cache(self):
+        first = manual_engine.find_best_match("What causes ulcers?")
+        second = manual_engine.find_best_match("WHAT CAUSES ULCERS?")
+        self.assertEqual(first, second)
+        self.assertEqual(first, legacy_find_best_match("What causes ulcers?", manual_engine.load_knowledge_base()))
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_context_boosted_lookups_bypass_the_cache(self):
+        manual_engine.find_best_match("What causes ulcers?", context=regression_context())
+        self.assertEqual(self.cache.stats()['size'], 0)
+
+    def test_lru_eviction_and_version_invalidation(self):
+        self.cache.put('v1', 'a', 1)
+        self.cache.put('v1', 'b', 2)
+        self.cache.get('v1', 'a')
+        self.cache.put('v1', 'c', 3)
+        self.assertEqual(self.cache.evictions, 1)
+        self.assertIs(self.cache.get('v1', 'b'), MISSING)
+        self.assertIs(self.cache.get('v2', 'a'), MISSING)
+        self.assertEqual(self.cache.invalidations, 1)
+
+
+class BenchmarkTests(SimpleTestCase):
+    def test_summary_percentiles(self):
+        summary = summarize([i / 1000 for i in range(1, 101)])
+        self.assertEqual((summary['calls'], summary['p50_ms'], summary['p99_ms']), (100, 51, 100))
+
+    def test_scaled_knowledge_keeps_real_entries_first(self):
+        real = manual_engine.load_knowledge_base()
+        with scaled_knowledge(3) as snapshot:
+            self.assertEqual(len(snapshot.entries), 3 * len(real))
+            self.assertEqual(snapshot.entries[:len(real)], tuple(real))
+            self.assertIs(manual_engine.knowledge_store.get(), snapshot)
+            manual_engine.find_best_match("What causes ulcers?")
+        self.assertEqual(tuple(manual_engine.load_knowledge_base()), tuple(real))
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        store = ContextStore()
+        for module in (views, manual_engine):
+            patcher = mock.patch.object(module, 'contexts', store)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.client.session.save()  # Give the client a session before its first message
+
+    def test_disabled_by_default(self):
+        response = self.client.post(reverse('chat_api'), {'message': 'What causes ulcers?'})
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(metrics.snapshot(), {})
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(CHAT_SERVER_TIMING=True)
+    def test_server_timing_header(self):
+        response = self.client.post(reverse('chat_api'), {'message': 'omeprazole dose'})
+        stages = [part.split(';')[0] for part in response['Server-Timing'].split(', ')]
+        self.assertEqual(stages, ['context_get', 'form_check', 'match', 'response', 'context_put'])
+        self.assertEqual(metrics.snapshot(), {})
+
+    @override_settings(CHAT_METRICS=True)
+    def test_prometheus_endpoint(self):
+        self.client.post(reverse('chat_api'), {'message': 'I have stomach pain'})
+        self.client.post(reverse('chat_api'), {'message': 'upper stomach'})
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn('# TYPE chat_stage_seconds histogram', body)
+        self.assertIn('chat_stage_seconds_count{stage="form_input"} 1', body)
+        self.assertIn('chat_stage_seconds_count{stage="response"} 2', body)
+        self.assertIn('chat_stage_seconds_bucket{stage="form_check",le="+Inf"} 1', body)
+        self.assertIn('chat_response_cache_hit_ratio', body)
+        self.assertIn('chat_context_sessions 1\n', body)
+
+
+class SlowRequestProfilingTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_only_slow_messages_are_kept_with_the_query_hashed(self):
+        store = ContextStore()
+        with override_settings(CHAT_PROFILE_DIR=self.directory, CHAT_PROFILE_THRESHOLD_MS=60000):
+            manual_engine.process_message("What causes ulcers?", 'fast', store)
+        self.assertEqual(os.listdir(self.directory), [])
+
+        with override_settings(CHAT_PROFILE_DIR=self.directory, CHAT_PROFILE_THRESHOLD_MS=0, CHAT_PROFILE_KEEP=2):
+            for _ in range(3):
+                manual_engine.process_message("What causes ulcers?", 'slow', store)
+        names = os.listdir(self.directory)
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith(f"-{query_digest('What causes ulcers?')}.prof") for name in names))
+
+        out = io.StringIO()
+        call_command('profile_report', dir=self.directory, sort='cumulative', limit=5, stdout=out)
+        self.assertIn('2 profile(s)', out.getvalue())
+        self.assertIn('(process_message)\n', out.getvalue())
+
+
+class ReportListingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('patient', password='secret')
+        created_at = timezone.now()
+        # Pairs share a timestamp so pagination has to break ties on id
+        for index in range(25):
+            Report.objects.create(
+                user=self.user, title=f'Report {index}', content='...',
+                symptoms='s' * (150 if index == 24 else 10), diagnosis='' if index % 2 else 'gastric ulcer',
+                created_at=created_at - timedelta(minutes=index // 2),
+            )
+        self.client.force_login(self.user)
+
+    def test_keyset_pages_cover_every_report_once(self):
+        first = self.client.get(reverse('reports'))
+        self.assertEqual(first.context['total_reports'], 25)
+        self.assertEqual(len(first.context['reports']), 20)
+
+        second = self.client.get(reverse('reports'), {'after': first.context['next_cursor']})
+        self.assertIsNone(second.context['next_cursor'])
+        titles = [row['title'] for row in first.context['reports'] + second.context['reports']]
+        # Newest first; within a shared timestamp the later-created (higher id) report first
+        expected = sorted(range(25), key=lambda index: (index // 2, -index))
+        self.assertEqual(titles, [f'Report {index}' for index in expected])
+
+        last = second.context['reports'][-1]
+        self.assertEqual(last['symptoms_summary'], 's' * 100 + '...')
+        self.assertEqual(last['diagnosis_summary'], 'gastric ulcer')
+        self.assertIsNone(first.context['reports'][0]['diagnosis_summary'])
+        self.assertNotIn('content', last)
+
+    def test_total_is_counted_without_a_shared_cache(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(report_count(self.user), 25)
+        Report.objects.filter(user=self.user).first().delete()
+        self.assertEqual(report_count(self.user), 24)
+
+    @override_settings(CHAT_REPORT_COUNT_CACHE='default')
+    def test_total_count_is_cached_until_reports_change(self):
+        self.assertEqual(report_count(self.user), 25)
+        with self.assertNumQueries(0):
+            self.assertEqual(report_count(self.user), 25)
+        Report.objects.filter(user=self.user).first().delete()
+        self.assertEqual(report_count(self.user), 24)
+
+    def test_dashboard_shows_latest_three(self):
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual([row['title'] for row in response.context['reports']], ['Report 1', 'Report 0', 'Report 3'])
+        self.assertEqual(response.context['total_reports'], 25)
+
+
+class ReportExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('patient', password='secret')
+        self.other = User.objects.create_user('other', password='secret')
+        Report.objects.create(user=self.user, title='Mine', content='...', symptoms='burning\npain' + 'x' * 200)
+        Report.objects.create(user=self.other, title='Theirs', content='...')
+
+    def export(self, name):
+        response = self.client.get(reverse(name))
+        return response, list(csv.reader(io.StringIO(b''.join(response.streaming_content).decode())))
+
+    def test_user_export_streams_own_reports(self):
+        self.client.force_login(self.user)
+        response, rows = self.export('export_all_reports_csv')
+        self.assertTrue(response.streaming)
+        self.assertEqual(rows[0], ['Title', 'Created Date', 'Symptoms', 'Diagnosis', 'Recommendations'])
+        self.assertEqual([row[0] for row in rows[1:]], ['Mine'])
+        self.assertEqual(rows[1][2], ('burning pain' + 'x' * 200)[:100])
+
+    @override_settings(CHAT_EXPORT_CHUNK_SIZE=1)
+    async def test_export_streams_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get(reverse('export_all_reports_csv'))
+        self.assertTrue(response.is_async)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 2)  # Header, then one chunk per database chunk
+        self.assertTrue(chunks[1].startswith(b'Mine,'))
+
+    def test_all_users_export_is_staff_only(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('export_all_users_reports_csv')).status_code, 302)
+
+        self.user.is_staff = True
+        self.user.save()
+        response, rows = self.export('export_all_users_reports_csv')
+        self.assertEqual(rows[0][0], 'User')
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ['other', 'patient'])
+
+
+@override_settings(CHAT_PDF_WORKERS=0)
+class ReportPdfTests(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        settings_patch = override_settings(CHAT_PDF_CACHE_DIR=self.cache_dir)
+        settings_patch.enable()
+        self.addCleanup(settings_patch.disable)
+
+        self.user = User.objects.create_user('patient', password='secret')
+        self.report = Report.objects.create(
+            user=self.user, title='Checkup', content='User: I have stomach pain\nSystem: Where is the pain located?',
+            symptoms='burning pain',
+        )
+        self.client.force_login(self.user)
+        self.url = reverse('export_report_pdf', args=[self.report.id])
+
+    @skipUnless(find_spec('reportlab'), "ReportLab is not installed")
+    def test_rendered_once_then_served_from_cache(self):
+        with mock.patch.object(pdf_export, 'render_report_pdf', wraps=pdf_export.render_report_pdf) as render:
+            first = self.client.get(self.url)
+            second = self.client.get(self.url)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(b''.join(second.streaming_content), b''.join(first.streaming_content))
+        self.assertEqual(second['Content-Type'], 'application/pdf')
+
+        # Editing the report renders a new version and drops the old file
+        self.report.save()
+        self.client.get(self.url)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+
+    def test_pending_job_is_polled_until_a_worker_renders_it(self):
+        with mock.patch.object(pdf_export, 'wake_workers'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 202)
+        status_url = reverse('report_pdf_status', args=[self.report.id])
+        self.assertEqual(self.client.get(status_url).json()['status'], 'pending')
+
+        with mock.patch.object(pdf_export, 'render_report_pdf', side_effect=lambda report, f: f.write(b'%PDF')):
+            self.assertEqual(pdf_export.run_pending_jobs(), 1)
+        self.assertEqual(self.client.get(status_url).json()['status'], 'done')
+        self.assertEqual(b''.join(self.client.get(self.url).streaming_content), b'%PDF')
+
+    def test_orphaned_pending_job_wakes_a_worker_again(self):
+        with mock.patch.object(pdf_export, 'wake_workers'):
+            self.client.get(self.url)  # Queued, then the process restarted before a worker claimed it
+        with mock.patch.object(pdf_export, 'render_report_pdf', side_effect=lambda report, f: f.write(b'%PDF')), \
+                override_settings(CHAT_PDF_WORKERS=0):
+            response = self.client.get(self.url)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF')
+
+    def test_cache_file_removed_before_opening_is_rendered_again(self):
+        with mock.patch.object(pdf_export, 'render_report_pdf', side_effect=lambda report, f: f.write(b'%PDF')), \
+                override_settings(CHAT_PDF_WORKERS=0):
+            self.client.get(self.url)
+            with mock.patch.object(views, 'open', side_effect=FileNotFoundError, create=True):
+                response = self.client.get(self.url)
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(b''.join(self.client.get(self.url).streaming_content), b'%PDF')
+
+    def test_failure_is_reported_and_retried_on_next_request(self):
+        with mock.patch.object(pdf_export, 'render_report_pdf', side_effect=ImportError):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.content, b'PDF generation requires ReportLab to be installed.')
+        self.assertFalse(PdfJob.objects.exists())
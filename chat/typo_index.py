@@ -0,0 +1,93 @@
+import zlib
+import random
+from collections import defaultdict
+
+# Mersenne prime for the universal hash family (a * x + b) mod p
+PRIME = (1 << 61) - 1
+
+# Words shorter than this aren't corrected: too many neighbours are one letter away
+MIN_WORD_LENGTH = 4
+
+
+def char_trigrams(word):
+    """Character trigrams of a word padded with spaces, so its first and last letters count too"""
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaccard(first, second):
+    return len(first & second) / len(first | second)
+
+
+class MinHasher:
+    """`num_perm` seeded hash functions; a set's signature is the minimum of each over its members"""
+
+    def __init__(self, num_perm=32, seed=1):
+        rng = random.Random(seed)
+        self.num_perm = num_perm
+        self.params = [(rng.randrange(1, PRIME), rng.randrange(0, PRIME)) for _ in range(num_perm)]
+
+    def signature(self, shingles):
+        # crc32 rather than hash(): stable across processes and runs
+        hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingles]
+        return tuple(min((a * value + b) % PRIME for value in hashes) for a, b in self.params)
+
+
+class TypoIndex:
+    """
+    MinHash LSH over the character trigram sets of the knowledge vocabulary, for finding
+    the indexed words a misspelt query word was meant to be ("ulser" -> "ulcer").
+
+    Signatures are cut into `bands` bands of num_perm / bands rows; words sharing any
+    whole band land in the same bucket and become candidates, so a lookup touches a few
+    buckets instead of the whole vocabulary. Candidates are then checked against
+    `threshold` with the exact trigram Jaccard similarity.
+
+    Tuning: more bands (fewer rows each) finds more distant spellings at the cost of
+    more candidates to check; a lower threshold accepts looser corrections.
+    """
+
+    def __init__(self, words, num_perm=32, bands=16, threshold=0.25, max_corrections=3):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.hasher = MinHasher(num_perm)
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.threshold = threshold
+        self.max_corrections = max_corrections
+        self.trigrams = {}
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        for word in words:
+            if len(word) >= MIN_WORD_LENGTH and word not in self.trigrams:
+                self.trigrams[word] = char_trigrams(word)
+                for band, key in enumerate(self._band_keys(self.hasher.signature(self.trigrams[word]))):
+                    self.buckets[band][key].append(word)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[band * rows:(band + 1) * rows] for band in range(self.bands)]
+
+    def corrections(self, word):
+        """Vocabulary words close to `word`, most similar first; empty if it is too short or known"""
+        if len(word) < MIN_WORD_LENGTH or word in self.trigrams:
+            return []
+        trigrams = char_trigrams(word)
+        candidates = set()
+        for band, key in enumerate(self._band_keys(self.hasher.signature(trigrams))):
+            candidates.update(self.buckets[band].get(key, ()))
+
+        scored = []
+        for candidate in candidates:
+            similarity = jaccard(trigrams, self.trigrams[candidate])
+            if similarity >= self.threshold:
+                scored.append((-similarity, candidate))
+        scored.sort()
+        return [candidate for _, candidate in scored[:self.max_corrections]]
+
+
+def build_typo_index(snapshot, **options):
+    """Builder for KnowledgeSnapshot.derive(): a TypoIndex over the inverted index's single-word terms"""
+    from .knowledge_index import build_inverted_index
+
+    index = snapshot.derive('inverted_index', build_inverted_index)
+    return TypoIndex((term for term in index.postings if ' ' not in term), **options)
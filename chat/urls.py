@@ -4,6 +4,9 @@ from . import views
 urlpatterns = [
     path('', views.chat_view, name='chat'),
     path('api/', views.chat_post, name='chat_api'),
+    path('api/stream/', views.chat_stream, name='chat_stream'),
+    path('api/async/', views.chat_post_async, name='chat_api_async'),
+    path('api/batch/', views.chat_batch, name='chat_batch'),
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('register/', views.register_view, name='signup'),
     path('login/', views.login_view, name='login'),
@@ -14,7 +17,9 @@ urlpatterns = [
     path('reports/view/<int:report_id>/', views.view_report, name='view_report'),
     path('reports/export/<int:report_id>/', views.export_report_csv, name='export_report_csv'),
     path('reports/export/pdf/<int:report_id>/', views.export_report_pdf, name='export_report_pdf'),
+    path('reports/export/pdf/<int:report_id>/status/', views.report_pdf_status, name='report_pdf_status'),
     path('reports/export-all/', views.export_all_reports_csv, name='export_all_reports_csv'),
+    path('reports/export-all/all-users/', views.export_all_users_reports_csv, name='export_all_users_reports_csv'),
     path("profile/update/", views.profile_update, name="profile_update"),
 
 ]
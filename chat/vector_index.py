@@ -0,0 +1,156 @@
+import os
+import glob
+import zlib
+import tempfile
+from collections import Counter, defaultdict
+
+from .conf import setting
+from .knowledge_index import TOKEN_RE, tokenize
+
+try:
+    # Optional: the vector engine needs NumPy
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def hashed_features(text):
+    """
+    Hashing-trick features of a text: character 3- and 4-grams of each word (robust to
+    typos and inflections), stemmed content words and adjacent word pairs.
+    """
+    lower = text.lower()
+    features = Counter()
+    for word in TOKEN_RE.findall(lower):
+        padded = f" {word} "
+        for n in (3, 4):
+            features.update(f"c:{padded[i:i + n]}" for i in range(len(padded) - n + 1))
+    words = tokenize(lower)
+    features.update(f"w:{word}" for word in words)
+    features.update(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    return features
+
+
+def embed(texts, dim):
+    """L2-normalized float32 rows, one per text, of signed, log-scaled hashed features"""
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature, count in hashed_features(text).items():
+            digest = zlib.crc32(feature.encode('utf-8'))
+            # Low bits pick the column, the top bit the sign, so collisions tend to cancel out
+            sign = -1.0 if digest & 0x80000000 else 1.0
+            vectors[row, digest % dim] += sign * (1.0 + np.log(count))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def vector_dir():
+    return str(setting('CHAT_VECTOR_DIR', os.path.join(tempfile.gettempdir(), 'chat_vectors')))
+
+
+def load_entry_vectors(snapshot, dim):
+    """
+    The snapshot's entry embeddings as a read-only memory map of `entries-<version>-<dim>.npy`,
+    computed and saved the first time. Every worker maps the same file, so the OS keeps a
+    single copy in its page cache. Other versions' files are left alone, since a worker still
+    on that version may be about to map one; build_knowledge removes them.
+    """
+    directory = vector_dir()
+    path = os.path.join(directory, f"entries-{snapshot.version}-{dim}.npy")
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, embed(snapshot.entries, dim))
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+    return np.load(path, mmap_mode='r')
+
+
+def remove_stale_vectors(version):
+    """
+    Delete the embedding files of knowledge versions other than `version`; returns how
+    many were removed. Workers already mapping one keep reading it until they reload.
+    """
+    removed = 0
+    for path in glob.glob(os.path.join(vector_dir(), 'entries-*-*.npy')):
+        if os.path.basename(path).startswith(f'entries-{version}-'):
+            continue
+        try:
+            os.unlink(path)
+            removed += 1
+        except FileNotFoundError:
+            pass  # Removed concurrently
+    return removed
+
+
+class RandomProjectionIndex:
+    """
+    Approximate nearest neighbours by cosine similarity: `tables` independent sets of
+    `bits` random hyperplanes hash each vector to a bucket per table (SimHash). A query
+    looks in its own bucket and, with `probes`, the buckets one flipped bit away, then
+    ranks the union exactly. More tables or probes raise recall; more bits make buckets
+    smaller and queries faster.
+    """
+
+    def __init__(self, vectors, tables=32, bits=12, probes=True, seed=0):
+        rng = np.random.default_rng(seed)
+        self.vectors = vectors
+        self.tables = tables
+        self.bits = bits
+        self.probes = probes
+        # All tables' hyperplanes side by side, so hashing is a single matrix product
+        self.planes = rng.standard_normal((vectors.shape[1], tables * bits)).astype(np.float32)
+        self.powers = 1 << np.arange(bits)
+        self.buckets = [defaultdict(list) for _ in range(tables)]
+        for entry_id, codes in enumerate(self._codes(vectors).tolist()):
+            for table, code in zip(self.buckets, codes):
+                table[code].append(entry_id)
+
+    def _codes(self, vectors):
+        """Bucket code of each vector in each table, shape (len(vectors), tables)"""
+        signs = (vectors @ self.planes > 0).reshape(len(vectors), self.tables, self.bits)
+        return signs @ self.powers
+
+    def candidates(self, vector):
+        """Ids of the entries sharing (or, with probes, neighbouring) a bucket with the vector"""
+        found = set()
+        for table, code in zip(self.buckets, self._codes(vector[np.newaxis])[0].tolist()):
+            found.update(table.get(code, ()))
+            if self.probes:
+                for bit in range(self.bits):
+                    found.update(table.get(code ^ (1 << bit), ()))
+        return np.array(sorted(found), dtype=np.int64)
+
+    def search(self, vector, k=1):
+        """[(entry_id, cosine)] of the k best candidates, best first"""
+        ids = self.candidates(vector)
+        if not len(ids):
+            return []
+        scores = self.vectors[ids] @ vector
+        top = np.argsort(-scores, kind='stable')[:k]
+        return [(int(ids[i]), float(scores[i])) for i in top]
+
+
+def brute_force_search(vectors, vector, k=1):
+    """Exact cosine top-k over every row, the reference for measuring ANN recall"""
+    scores = vectors @ vector
+    top = np.argsort(-scores, kind='stable')[:k]
+    return [(int(i), float(scores[i])) for i in top]
+
+
+class ExactIndex:
+    """Brute-force search with the RandomProjectionIndex interface, for small knowledge bases"""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def candidates(self, vector):
+        return np.arange(len(self.vectors))
+
+    def search(self, vector, k=1):
+        return brute_force_search(self.vectors, vector, k)
@@ -1,18 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, HttpResponse
+from django.urls import reverse
+from django.http import FileResponse, Http404, JsonResponse, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.views.decorators.http import require_http_methods
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
 from django.utils import timezone
-from .manual_engine import process_message, extract_questions, contexts
+from asgiref.sync import sync_to_async
+from .conf import setting
+from .executor import ExecutorSaturated, get_chat_executor
+from .metrics import engine_gauges, format_server_timing, metrics, render_prometheus, request_timings
+from .manual_engine import process_message, process_message_stream, process_messages, build_questions, contexts, knowledge_store
 from django.contrib.auth.models import User
-from .models import Report
+from .models import PdfJob, Report
+from .pdf_export import cached_pdf, request_pdf
+from .reports import report_count, report_page, stream_reports_csv
+from .streaming import streaming_content
 import csv
 import json
+import asyncio
+import hashlib
 from .models import *
 
 
@@ -25,29 +36,32 @@ def home(request):
 
 # Chat view
 
-class ChatView(View):
-    def get(self, request):
-        # For GET requests, provide possible questions
-        # First get the general questions from the knowledge base
-        general_questions = extract_questions()
-
-        # Add specific ulcer-related questions
-        ulcer_questions = [
-            "What should I eat if I have an ulcer?",
-            "What foods should I avoid with an ulcer?",
-            "What are the symptoms of a stomach ulcer?",
-            "How are ulcers treated?",
-            "What causes ulcers?",
-            "How can I prevent ulcers?",
-            "What is the difference between gastric and duodenal ulcers?",
-            "How long does it take for an ulcer to heal?"
-        ]
+# Ulcer-related questions shown ahead of those extracted from the knowledge base
+ULCER_QUESTIONS = (
+    "What should I eat if I have an ulcer?",
+    "What foods should I avoid with an ulcer?",
+    "What are the symptoms of a stomach ulcer?",
+    "How are ulcers treated?",
+    "What causes ulcers?",
+    "How can I prevent ulcers?",
+    "What is the difference between gastric and duodenal ulcers?",
+    "How long does it take for an ulcer to heal?"
+)
 
-        
 
-        # Combine the questions, prioritizing ulcer-related ones
-        questions = ulcer_questions + general_questions
+def build_chat_suggestions(snapshot):
+    """
+    Suggested questions for the chat page.
+    Built once per knowledge version, so a GET does no regex work for them.
+    """
+    # Combine the questions, prioritizing ulcer-related ones
+    return ULCER_QUESTIONS + snapshot.derive('questions', build_questions)
+
 
+class ChatView(View):
+    def get(self, request):
+        # For GET requests, provide possible questions
+        questions = knowledge_store.get().derive('chat_suggestions', build_chat_suggestions)
         return render(request, 'chat/chat.html', {'questions': questions})
 
     @method_decorator(csrf_exempt)
@@ -75,8 +89,79 @@ def chat_post(request):
     user_message = request.POST.get('message', '')
     session_id = request.session.session_key or request.session.create()
 
-    # Process the message using the manual engine
-    response, is_structured_form = process_message(user_message, session_id, contexts)
+    # Collect per-stage timings for a Server-Timing header when enabled
+    timings = [] if setting('CHAT_SERVER_TIMING', False) else None
+    token = request_timings.set(timings)
+    try:
+        # Process the message using the manual engine
+        response, is_structured_form = process_message(user_message, session_id, contexts)
+    finally:
+        request_timings.reset(token)
+
+    response = JsonResponse({
+        'response': response,
+        'is_structured_form': is_structured_form
+    })
+    if timings:
+        response['Server-Timing'] = format_server_timing(timings)
+    return response
+
+
+# Prometheus scrape endpoint; 404 unless CHAT_METRICS is on
+def metrics_view(request):
+    if not setting('CHAT_METRICS', False):
+        raise Http404()
+    return HttpResponse(
+        render_prometheus(metrics, engine_gauges()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+def server_sent_event(event, data):
+    """Format one Server-Sent Event with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+# Streaming variant: the structured-form flag, then the response text as it is produced
+@require_http_methods(["POST"])
+def chat_stream(request):
+    user_message = request.POST.get('message', '')
+    session_id = request.session.session_key or request.session.create()
+
+    def events():
+        stream = process_message_stream(user_message, session_id, contexts)
+        try:
+            yield server_sent_event('meta', {'is_structured_form': next(stream)})
+            for segment in stream:
+                yield server_sent_event('chunk', {'text': segment})
+            yield server_sent_event('done', {})
+        finally:
+            stream.close()  # Stores the context even if the client left mid-stream
+
+    response = StreamingHttpResponse(streaming_content(request, events()), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # Keep nginx from buffering the stream
+    return response
+
+
+# Async variant for ASGI deployments: matching runs on a bounded executor so a
+# slow query can't block the event loop, and a full executor answers 503 at once
+async def chat_post_async(request):
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    user_message = request.POST.get('message', '')
+    session_id = request.session.session_key or await sync_to_async(request.session.create)()
+
+    try:
+        future = get_chat_executor().submit(process_message, user_message, session_id)
+    except ExecutorSaturated:
+        return JsonResponse(
+            {'error': 'The assistant is busy right now, please try again in a moment.'},
+            status=503,
+            headers={'Retry-After': '1'},
+        )
+    response, is_structured_form = await asyncio.wrap_future(future)
 
     return JsonResponse({
         'response': response,
@@ -84,12 +169,54 @@ def chat_post(request):
     })
 
 
+def batch_session_key(session_id):
+    """
+    Context key for a batch client's session id: namespaced so batch clients can't reach
+    browser sessions, and hashed to a fixed 46 characters, since any client string must
+    fit ConversationState.session_id (at most 64)
+    """
+    return 'batch:' + hashlib.sha1(session_id.encode('utf-8')).hexdigest()
+
+
+# Batch API for integrations (e.g. replaying queued offline questions)
+@csrf_exempt
+@require_http_methods(["POST"])
+def chat_batch(request):
+    """
+    Accepts {"messages": [{"session_id": ..., "message": ...}, ...]} and answers every
+    message in one payload. Session ids may be any string; see batch_session_key().
+    """
+    try:
+        data = json.loads(request.body)
+        items = data['messages'] if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("'messages' must be a list")
+        pairs = [(str(item['session_id']), str(item['message'])) for item in items]
+    except (ValueError, KeyError, TypeError) as e:
+        return JsonResponse({'error': f'Invalid batch: {e}'}, status=400)
+
+    max_items = setting('CHAT_BATCH_MAX_ITEMS', 100)
+    if len(pairs) > max_items:
+        return JsonResponse({'error': f'Batch too large (at most {max_items} messages)'}, status=400)
+
+    results = process_messages([(batch_session_key(session_id), message) for session_id, message in pairs])
+
+    return JsonResponse({
+        'responses': [
+            {'session_id': session_id, 'response': response, 'is_structured_form': is_structured_form}
+            for (session_id, _), (response, is_structured_form) in zip(pairs, results)
+        ]
+    })
+
+
 # Dashboard view
 @login_required
 def dashboard_view(request):
-    reports = Report.objects.filter(user = request.user)
+    # Only the latest few are shown; the total comes from the cached count
+    reports, _ = report_page(request.user, page_size=3)
     context = {
-        'reports': reports
+        'reports': reports,
+        'total_reports': report_count(request.user),
     }
     return render(request, 'dashboard/dashboard.html', context)
 
@@ -168,130 +295,59 @@ def history_view(request):
 # Reports view
 @login_required
 def reports_view(request):
-    # Get all reports for the current user
-    user_reports = Report.objects.filter(user=request.user)
-    
-    # Format reports for table display
-    formatted_reports = []
-    for report in user_reports:
-        formatted_reports.append({
-            'id': report.id,
-            'title': report.title,
-            'created_at': report.created_at.strftime('%B %d, %Y at %I:%M %p'),
-            'symptoms_summary': report.symptoms[:100] + '...' if report.symptoms and len(report.symptoms) > 100 else report.symptoms or 'N/A',
-            'diagnosis_summary': report.diagnosis[:100] + '...' if report.diagnosis and len(report.diagnosis) > 100 else report.diagnosis or 'N/A',
-            'has_recommendations': bool(report.recommendations)
-        })
-    
+    # One keyset page of the current user's reports, listing columns only
+    reports, next_cursor = report_page(request.user, cursor=request.GET.get('after'))
+
     return render(request, 'dashboard/reports.html', {
-        'reports': user_reports,
-        'formatted_reports': formatted_reports
+        'reports': reports,
+        'total_reports': report_count(request.user),
+        'next_cursor': next_cursor,
+        'is_first_page': not request.GET.get('after'),
     })
 
 
 # Generate PDF report
 @login_required
 def export_report_pdf(request, report_id):
-    report = get_object_or_404(Report, id=report_id, user=request.user)
-    
-    try:
-        # Try to import ReportLab for PDF generation
-        from reportlab.lib.pagesizes import letter
-        from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-        from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-        from reportlab.lib.units import inch
-        from reportlab.lib import colors
-        
-        # Create the PDF response
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="{report.title.replace(" ", "_")}.pdf"'
-        
-        # Create PDF document
-        doc = SimpleDocTemplate(response, pagesize=letter)
-        story = []
-        
-        # Get styles
-        styles = getSampleStyleSheet()
-        title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=18, spaceAfter=30, alignment=1)
-        heading_style = ParagraphStyle('CustomHeading', parent=styles['Heading2'], fontSize=14, spaceAfter=10, textColor=colors.darkblue)
-        body_style = ParagraphStyle('CustomBody', parent=styles['Normal'], fontSize=10, spaceAfter=10)
-        
-        # Add title
-        story.append(Paragraph(report.title, title_style))
-        story.append(Spacer(1, 12))
-        
-        # Add date
-        date_text = f"<b>Date:</b> {report.created_at.strftime('%B %d, %Y at %I:%M %p')}"
-        story.append(Paragraph(date_text, body_style))
-        story.append(Spacer(1, 20))
-        
-        # Add symptoms section if available
-        if report.symptoms:
-            story.append(Paragraph("<b>Symptoms:</b>", heading_style))
-            symptoms_text = report.symptoms.replace('\n', '<br/>')
-            story.append(Paragraph(symptoms_text, body_style))
-            story.append(Spacer(1, 20))
-        
-        # Add diagnosis section if available
-        if report.diagnosis:
-            story.append(Paragraph("<b>Diagnosis:</b>", heading_style))
-            diagnosis_text = report.diagnosis.replace('\n', '<br/>')
-            story.append(Paragraph(diagnosis_text, body_style))
-            story.append(Spacer(1, 20))
-        
-        # Add recommendations section if available
-        if report.recommendations:
-            story.append(Paragraph("<b>Recommendations:</b>", heading_style))
-            recommendations_text = report.recommendations.replace('\n', '<br/>')
-            story.append(Paragraph(recommendations_text, body_style))
-            story.append(Spacer(1, 20))
-        
-        # Add conversation section
-        story.append(Paragraph("<b>Full Conversation:</b>", heading_style))
-        
-        # Format conversation for display in table
-        conversation_lines = report.content.split('\n')
-        conversation_data = []
-        
-        for line in conversation_lines:
-            if line.strip():
-                if line.startswith('User:'):
-                    conversation_data.append([line, ''])
-                elif line.startswith('System:'):
-                    conversation_data.append(['', line])
-                else:
-                    conversation_data.append([line, ''])
-        
-        # Create table for conversation
-        if conversation_data:
-            col_widths = [3*inch, 4*inch]
-            table = Table(conversation_data, colWidths=col_widths)
-            
-            # Style the table
-            style = TableStyle([
-                ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-                ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-                ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-                ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-                ('FONTSIZE', (0, 0), (-1, 0), 10),
-                ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-                ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-                ('GRID', (0, 0), (-1, -1), 1, colors.black)
-            ])
-            
-            table.setStyle(style)
-            story.append(table)
-        
-        # Build PDF
-        doc.build(story)
-        return response
-        
-    except ImportError:
-        # If ReportLab is not installed, return an error
-        return HttpResponse('PDF generation requires ReportLab to be installed.', status=500)
-    except Exception as e:
-        # Handle any other errors
-        return HttpResponse(f'Error generating PDF: {str(e)}', status=500)
+    report = get_object_or_404(Report.objects.only('id', 'title', 'updated_at'), id=report_id, user=request.user)
+    filename = f'{report.title.replace(" ", "_")}.pdf'
+
+    # Unchanged reports are served straight from the PDF cache
+    path = cached_pdf(report)
+    if path is None:
+        job = request_pdf(report)
+        if job.status == PdfJob.FAILED:
+            # Forget the failure so the next click tries again
+            job.delete()
+            return HttpResponse(job.error, status=500)
+        path = cached_pdf(report)
+    if path is not None:
+        try:
+            return FileResponse(open(path, 'rb'), as_attachment=True, filename=filename, content_type='application/pdf')
+        except FileNotFoundError:
+            # Removed since cached_pdf() found it (the report changed or was deleted); render it again
+            request_pdf(report)
+
+    # Still rendering in the background: a page that reloads this URL until the file is ready
+    response = render(request, 'dashboard/pdf_pending.html', {'report': report}, status=202)
+    response['Retry-After'] = '2'
+    return response
+
+
+# Poll endpoint for background PDF rendering
+@login_required
+def report_pdf_status(request, report_id):
+    report = get_object_or_404(Report.objects.only('id', 'updated_at'), id=report_id, user=request.user)
+    if cached_pdf(report) is not None:
+        status, error = PdfJob.DONE, ''
+    else:
+        job = PdfJob.objects.filter(report=report, report_updated_at=report.updated_at).first()
+        status, error = (job.status, job.error) if job else ('missing', '')
+    return JsonResponse({
+        'status': status,
+        'error': error,
+        'download_url': reverse('export_report_pdf', args=[report.id]),
+    })
 
 
 # Create report view
@@ -332,8 +388,8 @@ def create_report_view(request):
         # Handle regular POST request (from the web interface)
         # Get the last conversation from the session
         session_id = request.session.session_key
-        if session_id and session_id in contexts:
-            context = contexts[session_id]
+        context = contexts.get(session_id) if session_id else None
+        if context is not None:
             
             # Extract information from the conversation
             title = f"Medical Report - {timezone.now().strftime('%Y-%m-%d %H:%M')}"
@@ -425,32 +481,13 @@ def export_report_csv(request, report_id):
 @login_required
 def export_all_reports_csv(request):
     reports = Report.objects.filter(user=request.user)
-    
-    # Create the HttpResponse object with CSV header
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="all_reports.csv"'
-    
-    writer = csv.writer(response)
-    
-    # Write the header
-    writer.writerow(['Title', 'Created Date', 'Symptoms', 'Diagnosis', 'Recommendations'])
-    
-    # Write report data
-    for report in reports:
-        # Clean up text for CSV (remove newlines and limit length)
-        symptoms = report.symptoms.replace('\n', ' ')[:100] if report.symptoms else ''
-        diagnosis = report.diagnosis.replace('\n', ' ')[:100] if report.diagnosis else ''
-        recommendations = report.recommendations.replace('\n', ' ')[:100] if report.recommendations else ''
-        
-        writer.writerow([
-            report.title,
-            report.created_at.strftime('%Y-%m-%d %H:%M'),
-            symptoms,
-            diagnosis,
-            recommendations
-        ])
-    
-    return response
+    return stream_reports_csv(request, reports, 'all_reports.csv')
+
+
+# Export every user's reports to CSV (staff only)
+@staff_member_required
+def export_all_users_reports_csv(request):
+    return stream_reports_csv(request, Report.objects.all(), 'all_users_reports.csv', include_user=True)
 
 
 # View single report
@@ -0,0 +1,153 @@
+import json
+import asyncio
+from http.cookies import SimpleCookie
+from urllib.parse import urlsplit
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http.request import split_domain_port, validate_host
+from django.utils.http import is_same_domain
+
+from .conf import setting
+from .executor import ExecutorSaturated, get_chat_executor
+from .manual_engine import ConversationContext, contexts, respond
+
+WEBSOCKET_PATH = '/ws/chat/'
+
+
+def header_from_scope(scope, header):
+    """The first value of a handshake header, if sent"""
+    for name, value in scope.get('headers', []):
+        if name == header:
+            return value.decode('latin-1')
+    return None
+
+
+def session_key_from_scope(scope):
+    """The Django session key from the handshake's cookies, if any"""
+    value = header_from_scope(scope, b'cookie')
+    if value is None:
+        return None
+    cookie = SimpleCookie()
+    cookie.load(value)
+    morsel = cookie.get(settings.SESSION_COOKIE_NAME)
+    return morsel.value if morsel else None
+
+
+def origin_allowed(scope):
+    """
+    Whether the handshake's Origin is a host in ALLOWED_HOSTS or one of
+    CSRF_TRUSTED_ORIGINS, so another site's pages can't open a socket riding
+    the visitor's session cookie. Browsers always send Origin on WebSocket
+    handshakes; one without it is from a non-browser client, which is allowed.
+    """
+    origin = header_from_scope(scope, b'origin')
+    if origin is None:
+        return True
+    parsed = urlsplit(origin)
+    if not parsed.scheme or not parsed.netloc:
+        return False  # 'null' from sandboxed frames and file:// pages
+
+    allowed_hosts = settings.ALLOWED_HOSTS
+    if settings.DEBUG and not allowed_hosts:
+        allowed_hosts = ['.localhost', '127.0.0.1', '[::1]']  # As Django allows for HTTP requests
+    domain, _ = split_domain_port(parsed.netloc)
+    if domain and validate_host(domain, allowed_hosts):
+        return True
+
+    for trusted in settings.CSRF_TRUSTED_ORIGINS:
+        if '*' in trusted:
+            trusted = urlsplit(trusted)
+            if parsed.scheme == trusted.scheme and is_same_domain(parsed.netloc, trusted.netloc.lstrip('*')):
+                return True
+        elif origin == trusted:
+            return True
+    return False
+
+
+class ChatWebSocket:
+    """
+    ASGI application for the chat WebSocket (/ws/chat/).
+    Each connection owns its ConversationContext for its whole lifetime, so
+    messages skip the per-request session and context lookups of the HTTP API;
+    the context is stored back after every reply for the HTTP views to see.
+    Messages on one connection are answered in order; the server pings every
+    CHAT_WEBSOCKET_HEARTBEAT seconds. Handshakes from other sites' pages are
+    refused with close code 4403 (see origin_allowed).
+
+    Client -> server: {"message": "..."} (or plain text), {"type": "ping"}
+    Server -> client: {"type": "response", "response": ..., "is_structured_form": ...},
+                      {"type": "ping"}, {"type": "pong"}, {"type": "error", "error": ...}
+    """
+
+    async def __call__(self, scope, receive, send):
+        if scope['path'] != WEBSOCKET_PATH:
+            await receive()  # websocket.connect
+            await send({'type': 'websocket.close', 'code': 4404})
+            return
+
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if not origin_allowed(scope):
+            await send({'type': 'websocket.close', 'code': 4403})
+            return
+        await send({'type': 'websocket.accept'})
+
+        session_id = session_key_from_scope(scope)
+        context = None
+        if session_id:
+            context = await sync_to_async(contexts.get)(session_id)
+        if context is None:
+            context = ConversationContext()
+
+        heartbeat = asyncio.ensure_future(self.heartbeat(send))
+        try:
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message['type'] == 'websocket.receive':
+                    reply = await self.handle(message.get('text') or '', context)
+                    if reply is not None and reply['type'] == 'response' and session_id:
+                        # Stored before replying, so the HTTP views (e.g. report creation) see the
+                        # exchange while the socket is open, and its idle timer stays fresh
+                        await sync_to_async(contexts.__setitem__)(session_id, context)
+                    if reply is not None:
+                        await send({'type': 'websocket.send', 'text': json.dumps(reply)})
+        finally:
+            heartbeat.cancel()
+
+    async def handle(self, text, context):
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = {'message': text}
+        if not isinstance(data, dict):
+            data = {'message': str(data)}
+
+        if data.get('type') == 'ping':
+            return {'type': 'pong'}
+        if data.get('type') == 'pong':
+            return None  # Heartbeat answer, nothing to send back
+
+        user_message = str(data.get('message', ''))
+        try:
+            response, is_structured_form = await self.respond(user_message, context)
+        except ExecutorSaturated:
+            return {'type': 'error', 'error': 'The assistant is busy right now, please try again in a moment.'}
+        return {'type': 'response', 'response': response, 'is_structured_form': is_structured_form}
+
+    async def respond(self, user_message, context):
+        # The context is mutated in place, so it must stay in this process: use the
+        # bounded thread pool when configured, otherwise a plain worker thread
+        executor = get_chat_executor()
+        if executor.kind == 'thread':
+            return await asyncio.wrap_future(executor.submit(respond, user_message, context))
+        return await sync_to_async(respond, thread_sensitive=False)(user_message, context)
+
+    async def heartbeat(self, send):
+        interval = setting('CHAT_WEBSOCKET_HEARTBEAT', 20)
+        while True:
+            await asyncio.sleep(interval)
+            await send({'type': 'websocket.send', 'text': json.dumps({'type': 'ping'})})
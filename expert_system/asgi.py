@@ -2,6 +2,7 @@
 ASGI config for expert_system project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+WebSocket connections are served by chat.websocket.ChatWebSocket.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
@@ -13,4 +14,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'expert_system.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after Django is set up: the chat engine reads settings at import time
+from chat.websocket import ChatWebSocket  # noqa: E402
+
+websocket_application = ChatWebSocket()
+
+
+async def application(scope, receive, send):
+    """Route WebSocket connections to the chat socket and everything else to Django"""
+    if scope['type'] == 'websocket':
+        return await websocket_application(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -122,3 +122,80 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Chat engine
+
+# Knowledge matching engine: 'difflib' (default), 'bm25', 'tfidf' or 'vector' (hashed n-gram embeddings, needs NumPy)
+CHAT_MATCHER = 'difflib'
+# Extra keyword arguments for the engine, e.g. {'k1': 1.2, 'b': 0.75} for bm25. For difflib:
+# 'candidate_index' (False) to rescore only the 'candidate_limit' (60) entries an inverted index retrieves
+# (faster on large knowledge bases, but answers can differ from the exact full scan), with
+# 'typo_tolerance' (True), and 'typo_num_perm' (32) / 'typo_bands' (16) / 'typo_threshold' (0.25) /
+# 'typo_max_corrections' (3) to trade misspelling recall against latency; 'passages' (False) to score
+# short units of the compiled knowledge and answer with whole passages, bounded by 'passage_max_chars'
+# (600) and 'unit_max_chars' (160)
+CHAT_MATCHER_OPTIONS = {}
+
+# Where conversation contexts live: 'memory' (per process), 'database' or 'file' (shared by all workers)
+CHAT_CONTEXT_BACKEND = 'memory'
+# Directory for the 'file' backend (defaults to a folder in the system temp dir)
+# CHAT_CONTEXT_DIR = BASE_DIR / 'chat_contexts'
+# Session cap ('memory' only), idle lifetime in seconds and exchanges kept per session
+CHAT_CONTEXT_MAX_SESSIONS = 10000
+CHAT_CONTEXT_IDLE_TTL = 3600
+CHAT_CONTEXT_MAX_HISTORY = 50
+# Idle contexts in the 'database' and 'file' backends are deleted by a write at most once per this many
+# seconds per worker. Keep it on for small deployments; with many workers or a large backlog set it to 0
+# and run `python manage.py purge_contexts` from cron instead, so no request pays for the purge
+CHAT_CONTEXT_PURGE_INTERVAL = 300
+
+# Batch chat API: most messages per request
+CHAT_BATCH_MAX_ITEMS = 100
+
+# Executor behind the async chat endpoint: 'thread' or 'process' ('process' needs a shared context backend),
+# worker count and how many more messages may wait before new ones get a 503
+CHAT_EXECUTOR = 'thread'
+CHAT_EXECUTOR_WORKERS = 4
+CHAT_EXECUTOR_QUEUE_SIZE = 16
+
+# Seconds between server pings on the chat WebSocket (/ws/chat/, ASGI only)
+CHAT_WEBSOCKET_HEARTBEAT = 20
+
+# Cached results of context-free knowledge lookups (0 disables the cache)
+CHAT_RESPONSE_CACHE_SIZE = 1024
+
+# Per-stage timings of message processing, exposed in Prometheus format at /metrics (per worker process)
+CHAT_METRICS = False
+# Add a Server-Timing header with the stage timings to chat API responses
+CHAT_SERVER_TIMING = False
+
+# Profile chat messages with cProfile and keep the profiles of those slower than this many ms (None disables);
+# summarize them with `python manage.py profile_report`. Profiling roughly doubles message latency while on.
+CHAT_PROFILE_THRESHOLD_MS = None
+# CHAT_PROFILE_DIR = BASE_DIR / 'chat_profiles'
+# Most recent profiles kept on disk
+CHAT_PROFILE_KEEP = 50
+
+# Reports listed per page on the reports page
+CHAT_REPORTS_PAGE_SIZE = 20
+# Cache alias holding per-user report totals, invalidated when a report is saved or deleted. It must be
+# shared by all workers (e.g. Redis or Memcached): the default per-process LocMemCache would keep serving
+# other workers' stale totals. None counts in the database on every request (an indexed count)
+CHAT_REPORT_COUNT_CACHE = None
+# Rows fetched per database round trip by the streamed CSV exports
+CHAT_EXPORT_CHUNK_SIZE = 2000
+
+# Background PDF rendering: worker threads per process (0 renders in the request), seconds before a
+# job stuck running is requeued, and where rendered PDFs are cached
+CHAT_PDF_WORKERS = 2
+CHAT_PDF_JOB_TIMEOUT = 300
+# CHAT_PDF_CACHE_DIR = BASE_DIR / 'pdf_cache'
+
+# Where the 'vector' matcher keeps its memory-mapped entry embeddings (defaults to a folder in the system temp dir);
+# files of older knowledge versions are removed by `python manage.py build_knowledge`
+# CHAT_VECTOR_DIR = BASE_DIR / 'chat_vectors'
+
+# Compiled knowledge written by `python manage.py build_knowledge` and memory-mapped by every worker;
+# used only while it matches the knowledge files, which are parsed as before otherwise (None disables)
+CHAT_KNOWLEDGE_ARTIFACT = BASE_DIR / 'chat_knowledge.bin'
@@ -21,5 +21,6 @@ from chat import views
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('chat/', include('chat.urls')),
+    path('metrics', views.metrics_view, name='metrics'),
     path('', views.home, name='home'),
 ]